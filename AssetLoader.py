@@ -0,0 +1,246 @@
+"""
+Loads models and textures in the background, so a window can show frames while they
+load.
+
+AssetLoader.load_object and load_lod_object return an Object3D straight away. A pool of
+workers does the CPU side of loading -- reading the OBJ's mesh cache (or parsing the
+OBJ and building its levels of detail), reading its MTL files, and reading its
+textures' cache (or decoding and baking the images) -- and puts the finished buffers
+on a queue. Once per frame, update() drains that queue on the GL thread, uploading
+textures and meshes through the AssetManager until its time budget for the frame runs
+out, and gives each object its meshes. Until then an object draws the loader's
+placeholder mesh, or, without one, is left out by ready().
+
+Workers are threads by default. A ProcessPoolExecutor also works, since prepare_asset
+and its results can be pickled, and parses OBJ files without holding up the main
+thread's interpreter; threads start sooner and share the mesh cache's memory maps.
+"""
+import concurrent.futures
+import os
+import queue
+import time
+
+from AssetManager import AssetManager
+from Object3D import Object3D
+import TextureCache
+from VertexFormat import STANDARD_FORMAT
+
+# Milliseconds of uploads per update(), about a quarter of a 60 Hz frame.
+UPLOAD_BUDGET_MS = 4.0
+
+
+def prepare_asset(
+    obj_filename, texture_filename=None, levels=1, ratio=0.5, texture_format="rgb", max_texture_size=None
+):
+    """
+    Does the CPU work of loading an OBJ file's levels of detail and the textures they
+    draw with, without a GL context (see AssetManager.prepare_lods and
+    TextureCache.load_texture). Returns (lods, materials, {image filename: TextureData}).
+    """
+    lods, materials = AssetManager.prepare_lods(obj_filename, levels, ratio)
+    textures = {
+        filename: TextureCache.load_texture(filename, texture_format, max_texture_size)
+        for filename in AssetManager.texture_filenames(lods[0], materials, texture_filename)
+    }
+    return lods, materials, textures
+
+
+class _Job:
+    """
+    One background load: its key, the AssetManager.load_lods arguments it prepares, its
+    future, and the objects waiting for its meshes.
+    """
+
+    def __init__(self, key, obj_filename, texture_filename, levels, ratio, vertex_format):
+        self.key = key
+        self.obj_filename = obj_filename
+        self.texture_filename = texture_filename
+        self.levels = levels
+        self.ratio = ratio
+        self.vertex_format = vertex_format
+        self.future = None
+        self.objects = []
+
+
+class AssetLoader:
+    """
+    Loads objects through an AssetManager without blocking the GL thread: see the
+    module docstring. Objects loading the same files with the same options share one
+    background load.
+
+    Call update() once per frame, and draw only ready(objects) if there is no
+    placeholder. A load that failed raises its exception from update() or wait(), once;
+    its objects then stop being pending without ever becoming ready (see is_failed).
+    Objects are released with AssetManager.release_object once they are ready.
+    """
+
+    def __init__(self, assets: AssetManager, executor=None, placeholder=None, budget_ms=UPLOAD_BUDGET_MS):
+        self.assets = assets
+        self._owns_executor = executor is None
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(min(4, os.cpu_count() or 1))
+        # A Mesh3D to draw in place of objects that are still loading, such as Mesh3D.cube().
+        self.placeholder = placeholder
+        self.budget_ms = budget_ms
+        self._jobs = {}
+        # Jobs whose workers have finished, in the order they finished.
+        self._finished = queue.Queue()
+        # The upload steps of the job being uploaded, which may span several frames.
+        self._uploading = None
+        self._pending = set()
+        # Objects whose load failed; they never get meshes.
+        self._failed = set()
+
+    def load_object(self, obj_filename, texture_filename=None, vertex_format=STANDARD_FORMAT) -> Object3D:
+        """
+        Creates a new Object3D that will draw the shared mesh for the given OBJ file and
+        texture once it is loaded, like AssetManager.load_object.
+        """
+        return self._load(obj_filename, texture_filename, 1, 0.5, vertex_format)
+
+    def load_lod_object(
+        self, obj_filename, texture_filename=None, levels=4, ratio=0.5, vertex_format=STANDARD_FORMAT
+    ) -> Object3D:
+        """
+        Creates a new Object3D that will switch between shared levels of detail of the
+        given OBJ file and texture once they are loaded, like
+        AssetManager.load_lod_object.
+        """
+        return self._load(obj_filename, texture_filename, levels, ratio, vertex_format)
+
+    def _load(self, obj_filename, texture_filename, levels, ratio, vertex_format):
+        key = (
+            os.path.normpath(obj_filename),
+            texture_filename and os.path.normpath(texture_filename),
+            levels,
+            ratio,
+            vertex_format.name,
+        )
+        job = self._jobs.get(key)
+        if job is None:
+            job = self._jobs[key] = _Job(key, obj_filename, texture_filename, levels, ratio, vertex_format)
+            job.future = self.executor.submit(
+                prepare_asset,
+                obj_filename,
+                texture_filename,
+                levels,
+                ratio,
+                self.assets.texture_format,
+                self.assets.max_texture_size,
+            )
+            job.future.add_done_callback(lambda future: self._finished.put(job))
+        obj = Object3D(self.placeholder)
+        job.objects.append(obj)
+        self._pending.add(id(obj))
+        return obj
+
+    @property
+    def pending(self):
+        """
+        The number of objects still waiting for their meshes.
+        """
+        return len(self._pending)
+
+    def is_ready(self, obj: Object3D):
+        return id(obj) not in self._pending and id(obj) not in self._failed
+
+    def is_failed(self, obj: Object3D):
+        return id(obj) in self._failed
+
+    def ready(self, objects):
+        """
+        Gets the objects that can be drawn: those that are loaded, or all of them if
+        there is a placeholder.
+        """
+        if self.placeholder is not None:
+            return list(objects)
+        return [o for o in objects if self.is_ready(o)]
+
+    def update(self, budget_ms=None):
+        """
+        Uploads finished loads on the GL thread until `budget_ms` (by default the
+        loader's budget) have passed. Each step uploads one texture or one object's
+        meshes, and at least one step runs per call, so loading always progresses.
+        """
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        deadline = time.perf_counter() + budget_ms / 1000
+        while True:
+            if self._uploading is None:
+                try:
+                    self._uploading = self._upload(self._finished.get_nowait())
+                except queue.Empty:
+                    return
+            if next(self._uploading, None) is None:
+                self._uploading = None
+            if time.perf_counter() >= deadline:
+                return
+
+    def wait(self):
+        """
+        Blocks until every object is loaded, uploading without a budget.
+        """
+        while self._pending:
+            if self._uploading is None:
+                self._uploading = self._upload(self._finished.get())
+            for _ in self._uploading:
+                pass
+            self._uploading = None
+
+    def _upload(self, job: _Job):
+        """
+        Generates the upload steps of a finished job, yielding True after each.
+        """
+        try:
+            lods, materials, textures = job.future.result()
+        except Exception:
+            self._fail(job)
+            raise
+        # Each texture is uploaded in a step of its own, and held until the meshes
+        # have taken their own references to it.
+        uploaded = []
+        try:
+            for filename, data in textures.items():
+                uploaded.append(self.assets.load_texture(filename, data))
+                yield True
+            # Objects may still join the job while it uploads.
+            i = 0
+            while i < len(job.objects):
+                obj = job.objects[i]
+                meshes = self.assets.load_lods(
+                    job.obj_filename,
+                    job.texture_filename,
+                    job.levels,
+                    job.ratio,
+                    job.vertex_format,
+                    prepared=(lods, materials),
+                )
+                obj.set_lods(meshes)
+                self._pending.discard(id(obj))
+                i += 1
+                yield True
+            del self._jobs[job.key]
+        except Exception:
+            # Uploads fail too, say when the vertex format can't pack the mesh.
+            self._fail(job)
+            raise
+        finally:
+            for texture in uploaded:
+                self.assets.release_texture(texture)
+
+    def _fail(self, job: _Job):
+        """
+        Gives up on a job whose load or upload raised. Later loads of the same files
+        try again. The objects still waiting on it are done waiting, so wait() doesn't
+        block on a load that will never finish.
+        """
+        del self._jobs[job.key]
+        for obj in job.objects:
+            if id(obj) in self._pending:
+                self._pending.discard(id(obj))
+                self._failed.add(id(obj))
+
+    def close(self):
+        """
+        Stops the loader's own workers, abandoning loads that haven't started.
+        """
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
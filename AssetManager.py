@@ -0,0 +1,261 @@
+from OpenGL.GL import *
+import os
+
+import MeshCache
+from Material import load_mtl
+from Mesh3D_normals import Mesh3D, Submesh
+from Object3D import Object3D
+import TextureCache
+from VertexFormat import STANDARD_FORMAT
+
+
+class _Asset:
+    """
+    A loaded asset, the key it was loaded under, and how many users hold it. `detail`
+    is extra text for reports.
+    """
+
+    def __init__(self, key, value, gpu_bytes, detail=None):
+        self.key = key
+        self.value = value
+        self.gpu_bytes = gpu_bytes
+        self.detail = detail
+        self.refcount = 0
+
+
+class AssetManager:
+    """
+    Loads meshes and textures at most once each. Every load of the same file (with the
+    same options) returns the same Mesh3D or OpenGL texture and bumps its reference
+    count; release() drops a reference and frees the GL objects once none are left.
+
+    Meshes get their materials from the MTL files their OBJ names, and the textures of
+    those materials are loaded and released along with the mesh. A texture given with
+    the OBJ file is used by the faces whose material has no texture of its own.
+
+    Textures come from TextureCache, baked in `texture_format` and without the mip
+    levels larger than `max_texture_size`. A compressed format the GPU doesn't support
+    falls back to the uncompressed one.
+
+    Loading is split into CPU work that needs no GL context (prepare_lods and
+    TextureCache.load_texture), which AssetLoader runs on worker threads, and uploads,
+    which take the prepared data instead of reading files themselves.
+    """
+
+    def __init__(self, texture_format="rgb", max_texture_size=None):
+        if texture_format not in TextureCache.FORMATS:
+            raise ValueError(f"texture format must be one of {sorted(TextureCache.FORMATS)}, not {texture_format!r}")
+        self.texture_format = texture_format
+        self.max_texture_size = max_texture_size
+        self.meshes = {}
+        self.textures = {}
+        # Maps a loaded Mesh3D back to its key, since meshes themselves aren't hashable by path.
+        self._mesh_keys = {}
+        # The textures loaded for each Mesh3D, released along with it.
+        self._mesh_textures = {}
+        # Whether the GPU can use each texture format, checked on first use.
+        self._supported_formats = {}
+
+    def load_texture(self, filename, prepared=None):
+        """
+        Gets the OpenGL texture for the given image file, uploading it on first use from
+        `prepared` (the TextureCache.TextureData of the file in this manager's format)
+        if given, otherwise from the texture cache.
+        """
+        key = os.path.normpath(filename)
+        asset = self.textures.get(key)
+        if asset is None:
+            data = prepared or TextureCache.load_texture(filename, self.texture_format, self.max_texture_size)
+            if not self._supports(data.format):
+                data = TextureCache.load_texture(filename, TextureCache.UNCOMPRESSED_FORMATS[data.format], self.max_texture_size)
+            texture = Mesh3D.upload_mipmaps(data.levels, data.internal_format, data.compressed)
+            detail = f"{data.format} {data.width}x{data.height}"
+            asset = self.textures[key] = _Asset(key, texture, data.nbytes, detail)
+        asset.refcount += 1
+        return asset.value
+
+    def _supports(self, texture_format):
+        if texture_format not in self._supported_formats:
+            self._supported_formats[texture_format] = TextureCache.gl_supports(texture_format)
+        return self._supported_formats[texture_format]
+
+    def release_texture(self, texture):
+        """
+        Drops one reference to the given texture, deleting it when it is no longer used.
+        """
+        for key, asset in self.textures.items():
+            if asset.value == texture:
+                asset.refcount -= 1
+                if asset.refcount == 0:
+                    glDeleteTextures([asset.value])
+                    del self.textures[key]
+                return
+        raise KeyError(f"texture {texture} was not loaded by this AssetManager")
+
+    def load_mesh(self, obj_filename, texture_filename=None, vertex_format=STANDARD_FORMAT) -> Mesh3D:
+        """
+        Gets the Mesh3D for the given OBJ file and texture, loading it on first use.
+        """
+        return self.load_lods(obj_filename, texture_filename, levels=1, vertex_format=vertex_format)[0]
+
+    def load_lods(
+        self,
+        obj_filename,
+        texture_filename=None,
+        levels=4,
+        ratio=0.5,
+        vertex_format=STANDARD_FORMAT,
+        prepared=None,
+    ) -> list[Mesh3D]:
+        """
+        Gets Mesh3Ds for `levels` levels of detail of the given OBJ file and texture (see
+        MeshCache.load_lods), loading each on first use. Their vertex buffers are packed
+        in `vertex_format`. `prepared` is what prepare_lods returned for the same file,
+        levels and ratio, if it was already called.
+        """
+        obj_key = os.path.normpath(obj_filename)
+        texture_key = texture_filename and os.path.normpath(texture_filename)
+        keys = [
+            (obj_key, texture_key, level, ratio if level else None, vertex_format.name)
+            for level in range(levels)
+        ]
+        lods = materials = None
+        meshes = []
+        for level, key in enumerate(keys):
+            asset = self.meshes.get(key)
+            if asset is None:
+                if lods is None:
+                    lods, materials = prepared or AssetManager.prepare_lods(obj_filename, levels, ratio)
+                mesh = self._create_mesh(lods[level], materials, texture_filename, vertex_format)
+                asset = self.meshes[key] = _Asset(key, mesh, mesh.gpu_bytes())
+                self._mesh_keys[id(mesh)] = key
+            asset.refcount += 1
+            meshes.append(asset.value)
+        return meshes
+
+    @staticmethod
+    def prepare_lods(obj_filename, levels=4, ratio=0.5):
+        """
+        Does the CPU side of load_lods: gets the ObjData of each level of detail and the
+        {name: Material} of the OBJ's MTL files. Returns (lods, materials).
+        """
+        lods = MeshCache.load_lods(obj_filename, levels, ratio)
+        return lods, AssetManager._load_materials(obj_filename, lods[0].material_libraries)
+
+    @staticmethod
+    def texture_filenames(data, materials, texture_filename=None):
+        """
+        Gets the image files that a mesh of the given ObjData and materials draws with:
+        the texture given with the OBJ file, if any, then the diffuse maps of its
+        submeshes' materials. Texture maps that are missing are left out, like missing
+        MTL files.
+        """
+        filenames = {}
+        if texture_filename is not None:
+            filenames[os.path.normpath(texture_filename)] = texture_filename
+        for submesh in data.submeshes:
+            material = materials.get(submesh.material)
+            filename = material and material.diffuse_map
+            if filename is not None and os.path.normpath(filename) not in filenames and os.path.exists(filename):
+                filenames[os.path.normpath(filename)] = filename
+        return list(filenames.values())
+
+    @staticmethod
+    def _load_materials(obj_filename, material_libraries):
+        """
+        Gets {name: Material} from the given MTL files, which are named relative to the
+        OBJ file. Missing MTL files are skipped, leaving their materials' faces with the
+        default look.
+        """
+        materials = {}
+        directory = os.path.dirname(obj_filename)
+        for library in material_libraries:
+            path = os.path.join(directory, library)
+            if os.path.exists(path):
+                materials.update(load_mtl(path))
+        return materials
+
+    def _create_mesh(self, data, materials, texture_filename, vertex_format):
+        """
+        Uploads one level of an OBJ file's ObjData, loading the textures it draws with.
+        """
+        textures = {}
+        for filename in AssetManager.texture_filenames(data, materials, texture_filename):
+            textures[os.path.normpath(filename)] = self.load_texture(filename)
+
+        submeshes = []
+        for submesh in data.submeshes:
+            material = materials.get(submesh.material)
+            if material is not None and material.diffuse_map is not None:
+                material.texture = textures.get(os.path.normpath(material.diffuse_map))
+            submeshes.append(Submesh(material, submesh.first, submesh.count))
+
+        # Without a texture of its own, the mesh takes its first material's.
+        texture = None
+        if texture_filename is not None:
+            texture = textures[os.path.normpath(texture_filename)]
+        elif textures:
+            texture = next(iter(textures.values()))
+        mesh = Mesh3D(data.vertices, data.faces, texture, submeshes, vertex_format)
+        self._mesh_textures[id(mesh)] = list(textures.values())
+        return mesh
+
+    def release_mesh(self, mesh: Mesh3D):
+        """
+        Drops one reference to the given mesh. The last release deletes the mesh's GL
+        objects and drops its reference to its texture.
+        """
+        key = self._mesh_keys[id(mesh)]
+        asset = self.meshes[key]
+        asset.refcount -= 1
+        if asset.refcount == 0:
+            mesh.delete()
+            for texture in self._mesh_textures.pop(id(mesh)):
+                self.release_texture(texture)
+            del self.meshes[key]
+            del self._mesh_keys[id(mesh)]
+
+    def load_object(self, obj_filename, texture_filename=None, vertex_format=STANDARD_FORMAT) -> Object3D:
+        """
+        Creates a new Object3D drawing the shared mesh for the given OBJ file and texture.
+        """
+        return Object3D(self.load_mesh(obj_filename, texture_filename, vertex_format))
+
+    def load_lod_object(
+        self, obj_filename, texture_filename=None, levels=4, ratio=0.5, vertex_format=STANDARD_FORMAT
+    ) -> Object3D:
+        """
+        Creates a new Object3D that switches between shared levels of detail of the given
+        OBJ file and texture.
+        """
+        meshes = self.load_lods(obj_filename, texture_filename, levels, ratio, vertex_format)
+        obj = Object3D(meshes[0])
+        obj.set_lods(meshes)
+        return obj
+
+    def release_object(self, obj: Object3D):
+        for mesh in obj.lods:
+            self.release_mesh(mesh)
+
+    def report(self):
+        """
+        Gets (kind, name, reference count, GPU bytes) for every loaded asset.
+        """
+        rows = []
+        for (obj_filename, texture_filename, level, _, format_name), asset in self.meshes.items():
+            name = obj_filename if texture_filename is None else f"{obj_filename} + {texture_filename}"
+            if level:
+                name += f" (lod {level}, {asset.value.fcount // 3} triangles)"
+            if format_name != STANDARD_FORMAT.name:
+                name += f" [{format_name}]"
+            rows.append(("mesh", name, asset.refcount, asset.gpu_bytes))
+        for filename, asset in self.textures.items():
+            rows.append(("texture", f"{filename} [{asset.detail}]", asset.refcount, asset.gpu_bytes))
+        return rows
+
+    def print_report(self):
+        rows = self.report()
+        for kind, name, refcount, gpu_bytes in rows:
+            print(f"{kind:<8} {name:<40} refs={refcount:<3} {gpu_bytes / 1024:10.1f} KiB")
+        total = sum(row[3] for row in rows)
+        print(f"{'total':<8} {'':<40} {'':<8} {total / 1024:10.1f} KiB")
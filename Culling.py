@@ -0,0 +1,75 @@
+"""
+View-frustum culling of many objects at once.
+
+The six frustum planes come from the rows of projection * view (Gribb & Hartmann), as
+(a, b, c, d) with the normal pointing into the frustum, so a point p is inside a plane
+when a*x + b*y + c*z + d >= 0. Every test here checks all objects against all planes
+with a single NumPy expression.
+"""
+import glm
+import numpy as np
+
+from TransformStore import model_matrices
+
+
+def frustum_planes(projection_matrix: glm.mat4, view_matrix: glm.mat4):
+    """
+    Gets the normalized (6, 4) left, right, bottom, top, near and far planes of the
+    frustum seen through the given projection and view matrices.
+    """
+    # np.asarray gives a glm matrix in row-major (mathematical) order.
+    m = np.asarray(projection_matrix * view_matrix, dtype=np.float64)
+    planes = np.array(
+        [m[3] + m[0], m[3] - m[0], m[3] + m[1], m[3] - m[1], m[3] + m[2], m[3] - m[2]]
+    )
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def spheres_visible(planes, centers, radii):
+    """
+    Gets a boolean mask of which spheres, given as (N, 3) centers and (N,) radii, are
+    at least partly inside the frustum.
+    """
+    distances = centers @ planes[:, :3].T + planes[:, 3]
+    return (distances >= -np.asarray(radii)[:, None]).all(axis=1)
+
+
+def boxes_visible(planes, mins, maxs):
+    """
+    Gets a boolean mask of which axis-aligned boxes, given as (N, 3) min and max
+    corners, are at least partly inside the frustum. A box is outside a plane when even
+    its corner farthest along the plane's normal is behind it.
+    """
+    normals = planes[:, :3]
+    # (N, 6, 3): for each box and plane, the corner farthest along the plane normal.
+    corners = np.where(normals >= 0, maxs[:, None, :], mins[:, None, :])
+    distances = (corners * normals).sum(axis=2) + planes[:, 3]
+    return (distances >= 0).all(axis=1)
+
+
+def world_boxes(model_matrices, mins, maxs):
+    """
+    Transforms (N, 3) local-space boxes by (N, 16) column-major model matrices, and gets
+    the world-space axis-aligned boxes (mins, maxs) that enclose them.
+    """
+    # Row i of each (4, 4) block is column i of the matrix, so transpose to rows.
+    matrices = model_matrices.reshape(-1, 4, 4).transpose(0, 2, 1)
+    linear = matrices[:, :3, :3]
+    translation = matrices[:, :3, 3]
+    centers = (mins + maxs) / 2
+    extents = (maxs - mins) / 2
+    world_centers = np.einsum("nij,nj->ni", linear, centers) + translation
+    world_extents = np.einsum("nij,nj->ni", np.abs(linear), extents)
+    return world_centers - world_extents, world_centers + world_extents
+
+
+def objects_visible(planes, objects):
+    """
+    Gets a boolean mask of which of the given Object3Ds are at least partly inside the
+    frustum, testing each mesh's bounding box as transformed by its model matrix.
+    """
+    if not objects:
+        return np.zeros(0, dtype=bool)
+    mins = np.array([o.mesh.aabb_min for o in objects], dtype=np.float32)
+    maxs = np.array([o.mesh.aabb_max for o in objects], dtype=np.float32)
+    return boxes_visible(planes, *world_boxes(model_matrices(objects), mins, maxs))
@@ -0,0 +1,256 @@
+"""
+Meshes whose vertices change after they are created, such as a bird flapping its wings.
+
+A DynamicMesh keeps its packed vertex buffer on the CPU as well. update() writes new
+vertices there and marks their range dirty, and flush() -- which the draw methods call,
+so it runs once per frame in practice -- sends the dirty ranges to the GPU in one of
+three ways:
+
+- "subdata": a GL_DYNAMIC_DRAW buffer and one glBufferSubData per merged dirty range.
+  If the GPU is still drawing from the buffer, the driver has to wait for it or copy
+  the new data aside.
+- "orphan": a GL_STREAM_DRAW buffer re-specified with glBufferData on every flush, so
+  the driver hands out fresh storage while the old one is still being drawn. The whole
+  buffer is sent each time.
+- "ring" (the default): a buffer holding RING_SIZE copies of the vertices. Each flush
+  writes the next copy and draws read it through glDrawElementsBaseVertex, while the
+  GPU may still be reading the copies of the last frames. A fence per copy makes sure
+  the GPU is done with a copy before it is written again. Each copy catches up on the
+  ranges changed since it was last written. With GL 4.4 or ARB_buffer_storage the
+  buffer is mapped once, persistently, and dirty ranges are NumPy copies straight into
+  GPU-visible memory; otherwise each range is written through an unsynchronized
+  glMapBufferRange, since the fences already keep the writes safe.
+
+The vertex format must not quantize positions, since the dequantization is fixed when
+the mesh is created. Bounds don't follow the vertices; call update_bounds() when a
+deformation moves them far enough to matter for culling and LOD selection.
+"""
+from OpenGL.GL import *
+import ctypes
+
+import numpy as np
+
+from Mesh3D_normals import Mesh3D
+from VertexFormat import SOURCE_STRIDE, STANDARD_FORMAT
+
+MODES = ("subdata", "orphan", "ring")
+
+# Copies of the vertices in a "ring" buffer: one being written, and the ones of the
+# two frames the GPU may still be drawing.
+RING_SIZE = 3
+
+# Nanoseconds per glClientWaitSync while waiting for the GPU to finish with a copy.
+FENCE_TIMEOUT_NS = 100_000_000
+
+
+def _merge(ranges):
+    """
+    Merges (first, end) ranges into a sorted list of disjoint ones, joining ranges that
+    overlap or touch.
+    """
+    merged = []
+    for first, end in sorted(ranges):
+        if merged and first <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((first, end))
+    return merged
+
+
+def supports_buffer_storage():
+    """
+    Checks whether the current OpenGL context has glBufferStorage, for persistent
+    mapping.
+    """
+    if (glGetIntegerv(GL_MAJOR_VERSION), glGetIntegerv(GL_MINOR_VERSION)) >= (4, 4):
+        return True
+    extensions = {
+        glGetStringi(GL_EXTENSIONS, i).decode() for i in range(glGetIntegerv(GL_NUM_EXTENSIONS))
+    }
+    return "GL_ARB_buffer_storage" in extensions
+
+
+class DynamicMesh(Mesh3D):
+    """
+    A Mesh3D whose vertices can be updated every frame: see the module docstring.
+    `mode` is how updates reach the GPU, and `persistent` whether a "ring" buffer is
+    mapped persistently; by default it is when the GPU supports it.
+
+    `stalls` counts the flushes that had to wait for the GPU to finish with a ring copy.
+    """
+
+    def __init__(
+        self,
+        vertices,
+        faces,
+        texture=None,
+        submeshes=None,
+        vertex_format=STANDARD_FORMAT,
+        mode="ring",
+        persistent=None,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, not {mode!r}")
+        if vertex_format.quantizes_positions:
+            raise ValueError(f"{vertex_format.name} quantizes positions, so its vertices can't be updated")
+        vertices = np.array(vertices, dtype=np.float32).reshape(-1, SOURCE_STRIDE)
+        usage = GL_DYNAMIC_DRAW if mode == "subdata" else GL_STREAM_DRAW
+        super().__init__(vertices.reshape(-1), faces, texture, submeshes, vertex_format, usage)
+        self.mode = mode
+        self.vertex_count = len(vertices)
+        self.positions = vertices[:, :3].copy()
+        # The packed vertex buffer, one row of stride bytes per vertex.
+        self._packed = self._pack(vertices)
+        # (first, end) vertex ranges updated since the last flush.
+        self._dirty = []
+        # The ring copy that draws read, and the first vertex of that copy.
+        self.copy = 0
+        self.base_vertex = 0
+        self.stalls = 0
+        self.persistent = False
+        if mode == "ring":
+            self.persistent = supports_buffer_storage() if persistent is None else persistent
+            # The ranges each copy is missing, and a fence for the draws of each copy.
+            self._missing = [[] for _ in range(RING_SIZE)]
+            self._fences = [None] * RING_SIZE
+            self._mapped = self._create_ring()
+            self.vertex_bytes = RING_SIZE * self._packed.nbytes
+
+    def _pack(self, vertices):
+        packed = np.ascontiguousarray(self.vertex_format.pack(vertices.reshape(-1)))
+        return packed.view(np.uint8).reshape(len(vertices), self.vertex_format.stride)
+
+    def _create_ring(self):
+        """
+        Replaces the vertex buffer with one holding RING_SIZE copies of the vertices.
+        Returns a (copy, vertex, byte) NumPy view of the buffer if it is persistently
+        mapped, otherwise None.
+        """
+        contents = np.tile(self._packed, (RING_SIZE, 1))
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        mapped = None
+        if self.persistent:
+            flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+            glBufferStorage(GL_ARRAY_BUFFER, contents.nbytes, contents, flags)
+            address = glMapBufferRange(GL_ARRAY_BUFFER, 0, contents.nbytes, flags)
+            mapped = np.ctypeslib.as_array((ctypes.c_ubyte * contents.nbytes).from_address(address))
+            mapped = mapped.reshape(RING_SIZE, self.vertex_count, -1)
+        else:
+            glBufferData(GL_ARRAY_BUFFER, contents.nbytes, contents, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        return mapped
+
+    def update(self, vertices, first=0):
+        """
+        Replaces vertices first, first + 1, ... with the given interleaved float32
+        vertices (x, y, z, nx, ny, nz, u, v). They are drawn from the next flush().
+        """
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, SOURCE_STRIDE)
+        end = first + len(vertices)
+        if first < 0 or end > self.vertex_count:
+            raise IndexError(f"vertices {first} to {end} are outside the mesh's {self.vertex_count}")
+        self._packed[first:end] = self._pack(vertices)
+        self.positions[first:end] = vertices[:, :3]
+        self._dirty.append((first, end))
+
+    def update_bounds(self):
+        """
+        Recomputes the mesh's bounding box and sphere from its current positions.
+        """
+        self.aabb_min, self.aabb_max = Mesh3D.bounding_box(self.positions)
+        self.bounding_center, self.bounding_radius = Mesh3D.bounding_sphere(self.positions)
+
+    def flush(self):
+        """
+        Sends the vertices updated since the last flush to the GPU.
+        """
+        if not self._dirty:
+            return
+        ranges = _merge(self._dirty)
+        self._dirty = []
+        stride = self.vertex_format.stride
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        if self.mode == "subdata":
+            for first, end in ranges:
+                glBufferSubData(GL_ARRAY_BUFFER, first * stride, (end - first) * stride, self._packed[first:end])
+        elif self.mode == "orphan":
+            glBufferData(GL_ARRAY_BUFFER, self._packed.nbytes, self._packed, GL_STREAM_DRAW)
+        else:
+            self._write_next_copy(ranges)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _write_next_copy(self, ranges):
+        """
+        Brings the next ring copy up to date and makes it the one drawn.
+        """
+        for i in range(RING_SIZE):
+            self._missing[i] = _merge(self._missing[i] + ranges)
+        # Every draw of the current copy has been issued by now.
+        if self._fences[self.copy] is not None:
+            glDeleteSync(self._fences[self.copy])
+        self._fences[self.copy] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+        copy = (self.copy + 1) % RING_SIZE
+        self._wait(copy)
+        stride = self.vertex_format.stride
+        for first, end in self._missing[copy]:
+            if self._mapped is not None:
+                self._mapped[copy, first:end] = self._packed[first:end]
+            else:
+                size = (end - first) * stride
+                flags = GL_MAP_WRITE_BIT | GL_MAP_UNSYNCHRONIZED_BIT | GL_MAP_INVALIDATE_RANGE_BIT
+                address = glMapBufferRange(GL_ARRAY_BUFFER, (copy * self.vertex_count + first) * stride, size, flags)
+                ctypes.memmove(address, self._packed[first:end].ctypes.data, size)
+                glUnmapBuffer(GL_ARRAY_BUFFER)
+        self._missing[copy] = []
+        self.copy = copy
+        self.base_vertex = copy * self.vertex_count
+
+    def _wait(self, copy):
+        """
+        Waits until the GPU has finished the draws that read the given ring copy.
+        """
+        fence = self._fences[copy]
+        if fence is None:
+            return
+        if glClientWaitSync(fence, 0, 0) == GL_TIMEOUT_EXPIRED:
+            self.stalls += 1
+            while glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, FENCE_TIMEOUT_NS) == GL_TIMEOUT_EXPIRED:
+                pass
+        glDeleteSync(fence)
+        self._fences[copy] = None
+
+    def draw_elements(self, mode=GL_TRIANGLES, submesh=None):
+        """
+        Like Mesh3D.draw_elements, after flushing any updated vertices, from the ring
+        copy being drawn.
+        """
+        self.flush()
+        first, count = (0, self.fcount) if submesh is None else (submesh.first, submesh.count)
+        glDrawElementsBaseVertex(
+            mode, count, self.index_type, ctypes.c_void_p(self.index_size * first), self.base_vertex
+        )
+
+    def draw_instances(self, count, mode=GL_TRIANGLES, submesh=None):
+        """
+        Like Mesh3D.draw_instances, after flushing any updated vertices, from the ring
+        copy being drawn.
+        """
+        self.flush()
+        first, index_count = (0, self.fcount) if submesh is None else (submesh.first, submesh.count)
+        glDrawElementsInstancedBaseVertex(
+            mode, index_count, self.index_type, ctypes.c_void_p(self.index_size * first), count, self.base_vertex
+        )
+
+    def delete(self):
+        """
+        Releases the mesh's fences as well as its buffers and texture. Deleting the
+        vertex buffer also unmaps it.
+        """
+        if self.mode == "ring":
+            for fence in self._fences:
+                if fence is not None:
+                    glDeleteSync(fence)
+            self._fences = [None] * RING_SIZE
+            self._mapped = None
+        super().delete()
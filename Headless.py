@@ -0,0 +1,133 @@
+"""
+Offscreen OpenGL rendering with no window, for benchmarks and CI machines without a
+display or a GPU.
+
+OffscreenContext creates a core profile 4.1 context through EGL (with no surface, which
+Mesa's llvmpipe software renderer supports) or OSMesa, and renders into a framebuffer
+object. PyOpenGL picks its platform when OpenGL is first imported, so import this module
+before anything else that imports OpenGL:
+
+    import Headless
+    context = Headless.OffscreenContext(800, 800)
+
+Set PYOPENGL_PLATFORM=osmesa in the environment to use OSMesa instead of EGL.
+"""
+import os
+
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+if os.environ["PYOPENGL_PLATFORM"] == "egl":
+    # Lets Mesa create a context with no display server at all.
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import ctypes
+
+import numpy as np
+from OpenGL.GL import *
+
+PLATFORM = os.environ["PYOPENGL_PLATFORM"]
+
+
+class OffscreenContext:
+    """
+    A current OpenGL context with a width x height framebuffer object (RGBA8 color and a
+    24-bit depth buffer) bound for drawing, and depth testing enabled as in light_demo.py.
+    """
+
+    def __init__(self, width=800, height=800):
+        self.width = width
+        self.height = height
+        if PLATFORM == "egl":
+            self._make_egl_context()
+        elif PLATFORM == "osmesa":
+            self._make_osmesa_context()
+        else:
+            raise RuntimeError(f"headless rendering needs PYOPENGL_PLATFORM=egl or osmesa, not {PLATFORM}")
+
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        self.renderbuffers = glGenRenderbuffers(2)
+        for renderbuffer, storage, attachment in zip(
+            self.renderbuffers,
+            (GL_RGBA8, GL_DEPTH_COMPONENT24),
+            (GL_COLOR_ATTACHMENT0, GL_DEPTH_ATTACHMENT),
+        ):
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer)
+            glRenderbufferStorage(GL_RENDERBUFFER, storage, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, renderbuffer)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError(f"offscreen framebuffer is incomplete: {status}")
+
+        glViewport(0, 0, width, height)
+        glEnable(GL_DEPTH_TEST)
+
+    def _make_egl_context(self):
+        from OpenGL import EGL
+
+        self._egl = EGL
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("could not initialize EGL")
+
+        config_attributes = (EGL.EGLint * 5)(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_NONE,
+        )
+        config, count = EGL.EGLConfig(), EGL.EGLint()
+        EGL.eglChooseConfig(self.display, config_attributes, ctypes.pointer(config), 1, ctypes.pointer(count))
+        if count.value == 0:
+            raise RuntimeError("no EGL config supports desktop OpenGL")
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context_attributes = (EGL.EGLint * 7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, 4,
+            EGL.EGL_CONTEXT_MINOR_VERSION, 1,
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+            EGL.EGL_NONE,
+        )
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, context_attributes)
+        if not self.context:
+            raise RuntimeError("could not create an OpenGL 4.1 core context through EGL")
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.context)
+
+    def _make_osmesa_context(self):
+        from OpenGL import arrays, osmesa
+
+        self._osmesa = osmesa
+        attributes = arrays.GLintArray.asArray([
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+            osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 4,
+            osmesa.OSMESA_CONTEXT_MINOR_VERSION, 1,
+            0,
+        ])
+        self.context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+        if not self.context:
+            raise RuntimeError("could not create an OpenGL 4.1 core context through OSMesa")
+        # OSMesa needs a default framebuffer to make the context current, even though
+        # everything is drawn into the framebuffer object.
+        self._osmesa_buffer = arrays.GLubyteArray.zeros((self.height, self.width, 4))
+        osmesa.OSMesaMakeCurrent(self.context, self._osmesa_buffer, GL_UNSIGNED_BYTE, self.width, self.height)
+
+    def read_pixels(self):
+        """
+        Gets the framebuffer's colors as a (height, width, 4) uint8 array, top row first.
+        """
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.framebuffer)
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 4)[::-1]
+
+    def close(self):
+        glDeleteRenderbuffers(2, self.renderbuffers)
+        glDeleteFramebuffers(1, [self.framebuffer])
+        if PLATFORM == "egl":
+            EGL = self._egl
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.display, self.context)
+            EGL.eglTerminate(self.display)
+        else:
+            self._osmesa.OSMesaDestroyContext(self.context)
@@ -0,0 +1,133 @@
+import glm
+import math
+import numpy as np
+
+MAX_LIGHTS = 32
+MAX_OBJECT_LIGHTS = 8
+
+# The #defines that size the Lights block and the per-object light indices in the lit
+# fragment shaders; give them to the ShaderManager that builds those programs.
+SHADER_DEFINES = {"MAX_LIGHTS": MAX_LIGHTS, "MAX_OBJECT_LIGHTS": MAX_OBJECT_LIGHTS}
+
+DIRECTIONAL = 0
+POINT = 1
+SPOT = 2
+
+# Attenuated lights stop affecting objects once they contribute less than this.
+_CUTOFF = 1 / 256
+
+
+class Light:
+    """
+    A directional, point or spot light. Point and spot lights fade with distance d by
+    1 / (constant + linear * d + quadratic * d^2); spot lights also fade from full
+    strength at `inner_angle` to nothing at `outer_angle` (both in radians) away from
+    their direction.
+    """
+
+    def __init__(
+        self,
+        kind: int = POINT,
+        position: glm.vec3 = glm.vec3(0, 0, 0),
+        direction: glm.vec3 = glm.vec3(0, 0, -1),
+        color: glm.vec3 = glm.vec3(1, 1, 1),
+        attenuation: glm.vec3 = glm.vec3(1, 0, 0),
+        inner_angle: float = math.radians(20),
+        outer_angle: float = math.radians(25),
+    ):
+        self.kind = kind
+        self.position = position
+        self.direction = direction
+        self.color = color
+        self.attenuation = attenuation
+        self.inner_angle = inner_angle
+        self.outer_angle = outer_angle
+
+    @staticmethod
+    def directional(direction: glm.vec3, color: glm.vec3 = glm.vec3(1, 1, 1)) -> "Light":
+        return Light(DIRECTIONAL, direction=direction, color=color)
+
+    @staticmethod
+    def point(
+        position: glm.vec3,
+        color: glm.vec3 = glm.vec3(1, 1, 1),
+        attenuation: glm.vec3 = glm.vec3(1, 0, 0),
+    ) -> "Light":
+        return Light(POINT, position=position, color=color, attenuation=attenuation)
+
+    @staticmethod
+    def spot(
+        position: glm.vec3,
+        direction: glm.vec3,
+        color: glm.vec3 = glm.vec3(1, 1, 1),
+        attenuation: glm.vec3 = glm.vec3(1, 0, 0),
+        inner_angle: float = math.radians(20),
+        outer_angle: float = math.radians(25),
+    ) -> "Light":
+        return Light(SPOT, position, direction, color, attenuation, inner_angle, outer_angle)
+
+    def range(self) -> float:
+        """
+        Gets the distance past which the light no longer visibly affects anything:
+        infinite for directional and unattenuated lights.
+        """
+        if self.kind == DIRECTIONAL:
+            return math.inf
+        brightness = max(self.color)
+        if brightness <= 0:
+            # A switched-off light reaches nothing.
+            return 0.0
+        constant, linear, quadratic = self.attenuation
+        # Solve brightness / (constant + linear * d + quadratic * d^2) == _CUTOFF for d.
+        # A light too dim to reach the cutoff even up close has no positive solution.
+        c = constant - brightness / _CUTOFF
+        if quadratic > 0:
+            discriminant = max(linear * linear - 4 * quadratic * c, 0.0)
+            return max((-linear + math.sqrt(discriminant)) / (2 * quadratic), 0.0)
+        if linear > 0:
+            return max(-c / linear, 0.0)
+        return math.inf
+
+
+def pack_lights(lights: list[Light]):
+    """
+    Packs up to MAX_LIGHTS lights into the four vec4 arrays of the Lights uniform block:
+    positions (w = kind), directions (w = cosine of the outer angle), colors (w = cosine
+    of the inner angle) and attenuations (x, y, z = constant, linear, quadratic).
+    """
+    if len(lights) > MAX_LIGHTS:
+        raise ValueError(f"at most {MAX_LIGHTS} lights are supported, got {len(lights)}")
+    packed = np.zeros((4, MAX_LIGHTS, 4), dtype=np.float32)
+    for i, light in enumerate(lights):
+        # Only spot and directional lights use their direction, so a point light's may
+        # be zero, which doesn't normalize.
+        direction = glm.vec3(light.direction)
+        if glm.length(direction) > 0:
+            direction = glm.normalize(direction)
+        packed[0, i] = (*light.position, light.kind)
+        packed[1, i] = (*direction, math.cos(light.outer_angle))
+        packed[2, i] = (*light.color, math.cos(light.inner_angle))
+        packed[3, i, :3] = light.attenuation
+    return packed
+
+
+def light_bounds(lights: list[Light]):
+    """
+    Gets the positions (L, 3) and ranges (L,) of the given lights, for cull_lights.
+    """
+    positions = np.array([tuple(light.position) for light in lights], dtype=np.float32)
+    ranges = np.array([light.range() for light in lights])
+    return positions.reshape(-1, 3), ranges
+
+
+def cull_lights(positions, ranges, center: glm.vec3, radius: float):
+    """
+    Gets the indexes of up to MAX_OBJECT_LIGHTS lights (given by light_bounds) whose
+    range reaches the sphere with the given center and radius. Lights with infinite
+    range come first, then the rest from nearest to farthest.
+    """
+    distances = np.linalg.norm(positions - np.asarray(center), axis=1)
+    indexes = np.flatnonzero(distances <= ranges + radius)
+    distances = np.where(np.isinf(ranges), 0, distances)
+    indexes = indexes[np.argsort(distances[indexes], kind="stable")]
+    return indexes[:MAX_OBJECT_LIGHTS].tolist()
@@ -0,0 +1,70 @@
+import glm
+import os
+
+
+class Material:
+    """
+    A surface's look, as described by a Wavefront MTL file: a diffuse color (which
+    multiplies the texture), a specular color and shininess for highlights, an opacity,
+    and the file name of a diffuse texture map. The defaults leave a texture's colors
+    as they are and match the lighting shader's fixed highlight.
+
+    `texture` is the OpenGL texture loaded from `diffuse_map`, once an AssetManager has
+    loaded it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        diffuse: glm.vec3 = glm.vec3(1, 1, 1),
+        specular: glm.vec3 = glm.vec3(1, 1, 1),
+        shininess: float = 32.0,
+        opacity: float = 1.0,
+        diffuse_map: str = None,
+    ):
+        self.name = name
+        self.diffuse = diffuse
+        self.specular = specular
+        self.shininess = shininess
+        self.opacity = opacity
+        self.diffuse_map = diffuse_map
+        self.texture = None
+
+
+# The look of faces that have no material.
+DEFAULT_MATERIAL = Material(None)
+
+
+def load_mtl(mtl_filename) -> dict[str, Material]:
+    """
+    Parses an MTL file into {name: Material}. Reads newmtl, Kd, Ks, Ns, d, Tr and
+    map_Kd statements and ignores the rest. Texture map names are relative to the MTL
+    file's directory, and any options before them are skipped.
+    """
+    materials = {}
+    material = None
+    directory = os.path.dirname(mtl_filename)
+    with open(mtl_filename) as f:
+        for line in f:
+            tokens = line.split("#", 1)[0].split()
+            if not tokens:
+                continue
+            keyword, values = tokens[0], tokens[1:]
+            if keyword == "newmtl":
+                name = " ".join(values)
+                material = materials[name] = Material(name)
+            elif material is None:
+                continue
+            elif keyword == "Kd":
+                material.diffuse = glm.vec3(*map(float, values[:3]))
+            elif keyword == "Ks":
+                material.specular = glm.vec3(*map(float, values[:3]))
+            elif keyword == "Ns":
+                material.shininess = float(values[0])
+            elif keyword == "d":
+                material.opacity = float(values[-1])
+            elif keyword == "Tr":
+                material.opacity = 1 - float(values[-1])
+            elif keyword == "map_Kd":
+                material.diffuse_map = os.path.join(directory, values[-1])
+    return materials
@@ -1,61 +1,378 @@
 from OpenGL.GL import *
 from numpy import array
+import numpy as np
+import glm
 import pygame
 import ctypes
+import re
+from collections import namedtuple
+
+from MeshNormals import generate_normals, vertex_normals
+from Profiler import profiler
+from VertexFormat import STANDARD_FORMAT
+
+# Bump whenever parse_obj changes its output, so cached meshes get rebuilt.
+OBJ_LOADER_VERSION = 3
+
+# Characters of OBJ text that parse_textured_obj_stream parses at a time.
+OBJ_CHUNK_SIZE = 1 << 22
+
+# First attribute location of the per-instance model matrix in normal_perspective.vert (INSTANCED).
+INSTANCE_MODEL_LOCATION = 3
+# Location of the per-instance texture array layer in normal_perspective.vert (TEXTURE_ARRAY).
+INSTANCE_LAYER_LOCATION = 7
+INSTANCE_ATTRIBUTES = {"instanceModel": INSTANCE_MODEL_LOCATION, "instanceLayer": INSTANCE_LAYER_LOCATION}
 
 
 class Mesh3D:
     """
     Represents a 3D mesh using an OpenGL vertex buffer + attrib array to
     store the vertices and faces.
+
+    Indices are uploaded as uint16 whenever the mesh has few enough vertices, and as
+    uint32 otherwise; `index_type` is the GL type to draw them with. With a vertex
+    format that quantizes positions, the vertex buffer holds positions relative to the
+    mesh's bounding box and `dequantization` maps them back, so draws must use
+    model_matrix() (or upload_instances, which applies it) rather than an object's own
+    model matrix.
     """
 
-    def __init__(self, vertices, faces, texture=None):
-        self.vao = Mesh3D.get_vao(vertices, faces, texture)
+    def __init__(
+        self, vertices, faces, texture=None, submeshes=None, vertex_format=STANDARD_FORMAT, usage=GL_STATIC_DRAW
+    ):
+        """
+        Uploads the given vertex and index buffers. `texture` is either a pygame Surface,
+        which is uploaded and owned by this mesh, or the name of an existing OpenGL
+        texture, which is shared and left alone by delete(). `submeshes` splits the
+        index buffer into ranges drawn with different Material.Materials; by default
+        the whole buffer is one range with no material. `vertex_format` is the
+        VertexFormat the vertices are packed into on the GPU, and `usage` the usage hint
+        of the vertex buffer (see DynamicMesh for vertices that change).
+        """
+        # Every vertex is x, y, z, nx, ny, nz, u, v.
+        positions = vertices.reshape(-1, 8)[:, :3]
+        self.aabb_min, self.aabb_max = Mesh3D.bounding_box(positions)
+        self.bounding_center, self.bounding_radius = Mesh3D.bounding_sphere(positions)
+
+        self.vertex_format = vertex_format
+        self.dequantization = None
+        if vertex_format.quantizes_positions:
+            vertices, self.dequantization = Mesh3D.quantize_positions(vertices)
+            # The same matrix as column-major bytes, for upload_instances.
+            self._dequantization_columns = np.frombuffer(self.dequantization.to_bytes(), dtype=np.float32).reshape(4, 4)
+        vertex_buffer = vertex_format.pack(vertices)
+        index_buffer, self.index_type = Mesh3D.index_buffer(faces, len(positions))
+        self.index_size = index_buffer.itemsize
+        self.vao, self.vbo, self.ebo = Mesh3D.get_vao(
+            vertex_buffer, index_buffer, texture, usage=usage, vertex_format=vertex_format
+        )
         self.fcount = len(faces)
-        if texture is not None:
+        if submeshes is None:
+            submeshes = [Submesh(None, 0, self.fcount)]
+        self.submeshes = list(submeshes)
+        self.vertex_bytes = vertex_buffer.nbytes
+        self.index_bytes = index_buffer.nbytes
+        self.texture = None
+        self.owns_texture = False
+        self.instance_vbo = None
+        self.instance_layer_vbo = None
+        if isinstance(texture, pygame.Surface):
             self.texture = Mesh3D.get_texture(texture)
+            self.owns_texture = True
+        elif texture is not None:
+            self.texture = texture
 
-    def draw(self, mode=GL_TRIANGLES):
+    def delete(self):
         """
-        Draws the mesh by binding its VAO and then triggering glDrawElements.
+        Releases the mesh's OpenGL buffers, and its texture if the mesh owns it.
         """
-        glBindVertexArray(self.vao)
-        if self.texture is not None:
-            glBindTexture(GL_TEXTURE_2D, self.texture)
+        glDeleteVertexArrays(1, [self.vao])
+        glDeleteBuffers(2, [self.vbo, self.ebo])
+        for buffer in (self.instance_vbo, self.instance_layer_vbo):
+            if buffer is not None:
+                glDeleteBuffers(1, [buffer])
+        if self.owns_texture:
+            glDeleteTextures([self.texture])
+        self.vao = self.vbo = self.ebo = self.instance_vbo = self.instance_layer_vbo = self.texture = None
+
+    def model_matrix(self, model_matrix: glm.mat4) -> glm.mat4:
+        """
+        Gets the matrix to draw the mesh with for an object with the given model matrix,
+        which includes the dequantization of quantized positions.
+        """
+        if self.dequantization is None:
+            return model_matrix
+        return model_matrix * self.dequantization
+
+    def check_program(self, program):
+        """
+        Checks that a linked shader program reads the mesh's vertex attributes where its
+        vertex format puts them, raising ValueError if not (see VertexFormat.check_program).
+        """
+        self.vertex_format.check_program(program, INSTANCE_ATTRIBUTES)
+
+    def gpu_bytes(self):
+        """
+        Gets the number of bytes of GPU memory held by the mesh's vertex and index
+        buffers. Textures are not included.
+        """
+        return self.vertex_bytes + self.index_bytes
+
+    def draw(self, mode=GL_TRIANGLES, submesh=None):
+        """
+        Draws the mesh (or just one of its submeshes) by binding its VAO and then
+        triggering one glDrawElements per submesh, each with its own texture.
+        """
+        with profiler.scope("Mesh3D.draw"):
+            glBindVertexArray(self.vao)
+            for submesh in self.submeshes if submesh is None else [submesh]:
+                texture = self.submesh_texture(submesh)
+                if texture is not None:
+                    glBindTexture(GL_TEXTURE_2D, texture)
+                self.draw_elements(mode, submesh)
+            glBindVertexArray(0)
+
+    def draw_elements(self, mode=GL_TRIANGLES, submesh=None):
+        """
+        Issues the glDrawElements of one submesh, or of the whole mesh, assuming its VAO
+        and texture are already bound.
+        """
+        if submesh is None:
+            glDrawElements(mode, self.fcount, self.index_type, None)
+        else:
+            glDrawElements(
+                mode, submesh.count, self.index_type, ctypes.c_void_p(self.index_size * submesh.first)
+            )
 
-        glDrawElements(mode, self.fcount, GL_UNSIGNED_INT, None)
+    def submesh_texture(self, submesh, texture=None):
+        """
+        Gets the texture to draw a submesh with: its material's texture map if it has
+        one, otherwise `texture`, which defaults to the mesh's own texture.
+        """
+        material = submesh.material
+        if material is not None and material.texture is not None:
+            return material.texture
+        return self.texture if texture is None else texture
+
+    def draw_instanced(self, model_matrices, mode=GL_TRIANGLES):
+        """
+        Draws one copy of the mesh per model matrix with one glDrawElementsInstanced per
+        submesh. `model_matrices` is a float32 array of shape (count, 16), one
+        column-major matrix per row, which is uploaded as the per-instance attribute at
+        locations 3-6.
+        """
+        self.upload_instances(model_matrices)
+        for submesh in self.submeshes:
+            texture = self.submesh_texture(submesh)
+            if texture is not None:
+                glBindTexture(GL_TEXTURE_2D, texture)
+            self.draw_instances(len(model_matrices), mode, submesh)
         glBindVertexArray(0)
 
+    def upload_instances(self, model_matrices, layers=None):
+        """
+        Binds the mesh's VAO and uploads per-instance model matrices for draw_instances,
+        with the dequantization of quantized positions applied, and, if given, a float32
+        array of the instances' texture array layers.
+        """
+        if self.dequantization is not None:
+            # For column-major blocks, model @ dequantization is dequantization_t @ model_t.
+            model_matrices = (self._dequantization_columns @ model_matrices.reshape(-1, 4, 4)).reshape(-1, 16)
+        glBindVertexArray(self.vao)
+        if self.instance_vbo is None:
+            self.instance_vbo = Mesh3D.get_instance_buffer()
+        else:
+            glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        # Orphan the previous contents so the driver doesn't wait for the last frame's draw.
+        glBufferData(GL_ARRAY_BUFFER, model_matrices.nbytes, model_matrices, GL_STREAM_DRAW)
+        if layers is not None:
+            if self.instance_layer_vbo is None:
+                self.instance_layer_vbo = Mesh3D.get_instance_layer_buffer()
+            else:
+                glBindBuffer(GL_ARRAY_BUFFER, self.instance_layer_vbo)
+            glBufferData(GL_ARRAY_BUFFER, layers.nbytes, layers, GL_STREAM_DRAW)
+
+    def draw_instances(self, count, mode=GL_TRIANGLES, submesh=None):
+        """
+        Issues the glDrawElementsInstanced of one submesh, or of the whole mesh, for the
+        first `count` uploaded instances, assuming its VAO and texture are already bound.
+        """
+        if submesh is None:
+            glDrawElementsInstanced(mode, self.fcount, self.index_type, None, count)
+        else:
+            glDrawElementsInstanced(
+                mode,
+                submesh.count,
+                self.index_type,
+                ctypes.c_void_p(self.index_size * submesh.first),
+                count,
+            )
+
+    @staticmethod
+    def get_instance_buffer():
+        """
+        Creates a buffer for per-instance model matrices and attaches it to the currently
+        bound VAO. A mat4 attribute takes four locations, one per column.
+        """
+        instance_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, instance_vbo)
+        for column in range(4):
+            location = INSTANCE_MODEL_LOCATION + column
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(
+                location, 4, GL_FLOAT, False, 64, ctypes.c_void_p(16 * column)
+            )
+            # Advance this attribute once per instance instead of once per vertex.
+            glVertexAttribDivisor(location, 1)
+        return instance_vbo
+
+    @staticmethod
+    def get_instance_layer_buffer():
+        """
+        Creates a buffer for per-instance texture array layers, one float each, and
+        attaches it to the currently bound VAO.
+        """
+        layer_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, layer_vbo)
+        glEnableVertexAttribArray(INSTANCE_LAYER_LOCATION)
+        glVertexAttribPointer(INSTANCE_LAYER_LOCATION, 1, GL_FLOAT, False, 4, None)
+        glVertexAttribDivisor(INSTANCE_LAYER_LOCATION, 1)
+        return layer_vbo
+
+    @staticmethod
+    def index_buffer(faces, vertex_count):
+        """
+        Gets the smallest index buffer for a mesh of `vertex_count` vertices: uint16 if
+        every vertex can be numbered in 16 bits, otherwise uint32. Returns the buffer and
+        its GL index type.
+        """
+        if vertex_count <= 1 << 16:
+            return np.asarray(faces).astype(np.uint16), GL_UNSIGNED_SHORT
+        return np.asarray(faces, dtype=np.uint32), GL_UNSIGNED_INT
+
+    @staticmethod
+    def quantize_positions(vertices):
+        """
+        Maps the positions of interleaved vertices into [-1, 1] across their bounding
+        box, for packing as normalized shorts. The scale is the box's largest half-extent
+        on every axis, so the matrix that maps them back scales uniformly and normals
+        drawn with it keep their directions. Returns the new vertices and that matrix.
+        """
+        rows = np.array(vertices, dtype=np.float32).reshape(-1, 8)
+        if len(rows) == 0:
+            return rows.reshape(-1), glm.mat4(1)
+        low, high = rows[:, :3].min(axis=0), rows[:, :3].max(axis=0)
+        center = (low + high) / 2
+        scale = float((high - low).max()) / 2 or 1.0
+        rows[:, :3] = np.clip((rows[:, :3] - center) / scale, -1, 1)
+        dequantization = glm.scale(glm.translate(glm.vec3(*center.tolist())), glm.vec3(scale))
+        return rows.reshape(-1), dequantization
+
+    @staticmethod
+    def bounding_box(positions):
+        """
+        Gets the (min, max) corners of the axis-aligned box around the given (N, 3) positions.
+        """
+        if len(positions) == 0:
+            return glm.vec3(0, 0, 0), glm.vec3(0, 0, 0)
+        return glm.vec3(*positions.min(axis=0).tolist()), glm.vec3(*positions.max(axis=0).tolist())
+
+    @staticmethod
+    def bounding_sphere(positions):
+        """
+        Gets a sphere (center, radius) enclosing every one of the given (N, 3) positions,
+        centered on their axis-aligned bounding box.
+        """
+        if len(positions) == 0:
+            return glm.vec3(0, 0, 0), 0.0
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        radius = float(np.sqrt(((positions - center) ** 2).sum(axis=1).max()))
+        return glm.vec3(*center.tolist()), radius
+
+    @staticmethod
+    def texture_bytes(width, height, channels=3):
+        """
+        Gets the GPU memory used by a mipmapped texture of the given size.
+        """
+        total = 0
+        while True:
+            total += width * height * channels
+            if width == 1 and height == 1:
+                return total
+            width, height = max(1, width // 2), max(1, height // 2)
+
     @staticmethod
     def get_texture(texture):
+        image_data = pygame.image.tostring(texture, "RGB", True)
+        return Mesh3D.upload_texture(image_data, texture.get_width(), texture.get_height())
+
+    @staticmethod
+    def upload_texture(image_data, width, height):
+        """
+        Creates a mipmapped texture from RGB bytes, bottom row first, as
+        pygame.image.tostring(image, "RGB", True) gives them.
+        """
         tex = glGenTextures(1)
         glBindTexture(GL_TEXTURE_2D, tex)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        image_data = pygame.image.tostring(texture, "RGB", True)
+        # The rows are tightly packed, so they needn't start on 4-byte boundaries.
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
         glTexImage2D(
             GL_TEXTURE_2D,
             0,
             GL_RGB,
-            texture.get_width(),
-            texture.get_height(),
+            width,
+            height,
             0,
             GL_RGB,
             GL_UNSIGNED_BYTE,
             image_data,
         )
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
         glGenerateMipmap(GL_TEXTURE_2D)
         glBindTexture(GL_TEXTURE_2D, 0)
         return tex
 
     @staticmethod
-    def get_vao(vertices, faces, texture, usage="GL_STATIC_DRAW"):
+    def upload_mipmaps(levels, internal_format=GL_RGB, compressed=False):
+        """
+        Creates a texture from a precomputed mip chain, as (width, height, bytes) from
+        full size down to 1x1 (see TextureCache). Levels of a block-compressed
+        `internal_format` are uploaded as they are; uncompressed ones are tightly packed
+        RGB or RGBA rows, bottom row first.
+        """
+        tex = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, tex)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+        # Rows of small RGB levels aren't a multiple of 4 bytes long.
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for level, (width, height, data) in enumerate(levels):
+            if compressed:
+                # PyOpenGL passes the image size from the array.
+                glCompressedTexImage2D(GL_TEXTURE_2D, level, internal_format, width, height, 0, data)
+            else:
+                glTexImage2D(
+                    GL_TEXTURE_2D, level, internal_format, width, height, 0, internal_format, GL_UNSIGNED_BYTE, data
+                )
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        return tex
+
+    @staticmethod
+    def get_vao(vertices, faces, texture, usage=GL_STATIC_DRAW, vertex_format=STANDARD_FORMAT):
         """
         Gets a Vertex Array Object for this mesh -- an encapsulation of the mesh's vertices
-        and the indexes forming its triangle faces.
+        and the indexes forming its triangle faces. `vertices` is a vertex buffer already
+        packed in `vertex_format`, which gives the stride and attribute pointers, and
+        `usage` is the vertex buffer's usage hint. Returns the VAO along with its vertex
+        and index buffers, so they can be deleted later.
         """
 
         # Generate and bind a VAO for this mesh, so that all future calls are associated with this VAO.
@@ -66,32 +383,11 @@ class Mesh3D:
         vbo = glGenBuffers(1)
         glBindBuffer(GL_ARRAY_BUFFER, vbo)
 
-        # Each vertex has 12 bytes of data if there is no texture; otherwise it has 20.
-        stride = 24 if texture is None else 32 # Adjust stride to include normal components
-
-        position_location = 0
-        glEnableVertexAttribArray(position_location)
-        glVertexAttribPointer(
-            position_location, 3, GL_FLOAT, False, stride, ctypes.c_void_p(0)
-        )
-
-        if texture is not None:
-            texture_location = 1
-            glEnableVertexAttribArray(texture_location)
-            # Tell OpenGL that the texCorod of each vertex is 2 floats in size,
-            # and is found by skipping 12 bytes at the start of the vertex.
-            glVertexAttribPointer(
-                texture_location, 2, GL_FLOAT, False, stride, ctypes.c_void_p(12)
-            )
-        # Add new vertex attribute for the normal components
-        normal_location = 2
-        glEnableVertexAttribArray(normal_location)
-        glVertexAttribPointer(
-            normal_location, 3, GL_FLOAT, False, stride, ctypes.c_void_p(20)
-        )
+        # Tell OpenGL where each vertex attribute is found within a vertex, and its type.
+        vertex_format.enable()
 
         # Specify the numpy array to use as the source of the vertex data.
-        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, usage)
 
         ebo = glGenBuffers(1)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
@@ -103,36 +399,20 @@ class Mesh3D:
         #glBindBuffer(GL_ARRAY_BUFFER, 0)
         #glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
-        return vao
+        return vao, vbo, ebo
 
     @staticmethod
     def square():
-        return Mesh3D(
-            array(
-                [
-                    0.5,
-                    -0.5,
-                    0.5,
-                    -0.5,
-                    -0.5,
-                    0.5,
-                    0.5,
-                    0.5,
-                    0.5,
-                    -0.5,
-                    0.5,
-                    0.5,
-                    0.5,
-                    0.5,
-                    -0.5,
-                    -0.5,
-                    0.5,
-                    -0.5,
-                ],
-                dtype="float32",
-            ),
-            array([[0, 2, 3], [0, 3, 1]], dtype="uint32"),
-        )
+        # fmt: off
+        positions = [0.5, -0.5, 0.5,
+                     -0.5, -0.5, 0.5,
+                     0.5, 0.5, 0.5,
+                     -0.5, 0.5, 0.5,
+                     0.5, 0.5, -0.5,
+                     -0.5, 0.5, -0.5]
+        tris = [0, 2, 3, 0, 3, 1]
+        # fmt: on
+        return Mesh3D(*Mesh3D.with_normals(positions, tris, crease_angle=0.0))
 
     @staticmethod
     def cube():
@@ -164,44 +444,58 @@ class Mesh3D:
         ]
         tris = [
             0,
-            1,
             2,
+            1,
             0,
-            2,
             3,
+            2,
             4,
-            0,
             3,
+            0,
             4,
-            3,
             7,
+            3,
             5,
-            4,
             7,
+            4,
             5,
-            7,
             6,
+            7,
             1,
-            5,
             6,
+            5,
             1,
-            6,
             2,
+            6,
             4,
-            5,
             1,
+            5,
             4,
-            1,
             0,
+            1,
             2,
-            6,
             7,
+            6,
             2,
-            7,
             3,
+            7,
         ]
 
-        return Mesh3D(array(verts, "float32"), array(tris, "uint32"))
+        # Each face gets its own corners with the face's normal.
+        return Mesh3D(*Mesh3D.with_normals(verts, tris, crease_angle=0.0))
+
+    @staticmethod
+    def with_normals(positions, faces, crease_angle=None):
+        """
+        Turns a flat list of x, y, z positions into an interleaved vertex buffer with
+        generated normals and zero texture coordinates. Returns the vertex and index
+        buffers; with a crease angle (see MeshNormals.generate_normals) vertices on
+        sharper edges are split, so the index buffer changes too.
+        """
+        vertices = np.zeros((len(positions) // 3, 8), dtype=np.float32)
+        vertices[:, :3] = np.reshape(positions, (-1, 3))
+        vertices, faces = generate_normals(vertices, array(faces, "uint32"), crease_angle=crease_angle)
+        return vertices, array(faces, "uint32")
 
     @staticmethod
     def textured_triangle(texture):
@@ -215,161 +509,378 @@ class Mesh3D:
 
     @staticmethod
     def load_obj(file) -> "Mesh3D":
-        verts = []
-        faces = []
-        for line in file:
-            if line[0] == "#":
-                continue
-            sp = line.split(" ")
-            if line[0] == "v":
-                verts.append(float(sp[1]))
-                verts.append(float(sp[2]))
-                verts.append(float(sp[3]))
-            elif line[0] == "f":
-                faces.append(int(sp[1]) - 1)
-                faces.append(int(sp[2]) - 1)
-                faces.append(int(sp[3]) - 1)
-        return Mesh3D(array(verts, "float32"), array(faces, "uint32"))
+        """
+        Loads an untextured OBJ file, with smooth normals generated if it has none.
+        """
+        data = Mesh3D.parse_obj(file)
+        return Mesh3D(data.vertices, data.faces, submeshes=data.submeshes)
 
     @staticmethod
     def load_textured_obj(obj_file, texture) -> "Mesh3D":
-        verts = []
-        faces = []
-        texcoords = []
-        normals = []
-        for line in obj_file:
-            if line[0] == "#":
-                continue
-
-            sp = [x for x in line.split(" ") if x]
-            if line.startswith("v "):
-                verts.append(float(sp[1]))
-                verts.append(float(sp[2]))
-                verts.append(float(sp[3]))
-            elif line.startswith("vt"):
-                texcoords.append(float(sp[1]))
-                texcoords.append(float(sp[2]))
-            elif line.startswith("vn"):
-                normals.append(float(sp[1]))
-                normals.append(float(sp[2]))
-                normals.append(float(sp[3]))
-            elif line.startswith("f"):
-                va, ta, na = sp[1].split("/")
-                faces.append(int(va) - 1)
-                faces.append(int(ta) - 1)
-                faces.append(int(na) - 1)
-
-                vb, tb, nb = sp[2].split("/")
-                faces.append(int(vb) - 1)
-                faces.append(int(tb) - 1)
-                faces.append(int(nb) - 1)
-
-                vc, tc, nc = sp[3].split("/")
-                faces.append(int(vc) - 1)
-                faces.append(int(tc) - 1)
-                faces.append(int(nc) - 1)
-
-        vertex_buffer = []
-        # vertex_buffer will contain 5 values per vertex: x, y, z, nx, ny, nz, u, v
-        # We are not using face normals for now.
-        for i in range(0, len(verts), 3):
-            vertex_buffer.append(verts[i])
-            vertex_buffer.append(verts[i + 1])
-            vertex_buffer.append(verts[i + 2])
-            vertex_buffer.append(0)
-            vertex_buffer.append(0)
-            vertex_buffer.append(0)
-            vertex_buffer.append(0)  # temporary u, v
-            vertex_buffer.append(0)
-
-        face_buffer = []
-        # map from OBJ Vertex Index -> (map from OBJ Texture Index -> vertex_buffer index) 
-        vertex_textures : dict[int, dict[tuple[int, int], int]] = {}
-        
-        for i in range(0, len(faces), 9):
-            v1_index = faces[i]
-            v2_index = faces[i + 3]
-            v3_index = faces[i + 6]
-
-            # Check to see if u, v don't match what we're already recorded for the vertices of
-            # this face.
-            # If they don't, we need to duplicate them.
-            texindex_v1 = faces[i + 1]
-            texindex_v2 = faces[i + 4]
-            texindex_v3 = faces[i + 7]
-
-            nrmindex_v1 = faces[i + 2]
-            nrmindex_v2 = faces[i + 5]
-            nrmindex_v3 = faces[i + 8]
-
-            v1_texindexes = vertex_textures.setdefault(v1_index, {(texindex_v1, nrmindex_v1) : v1_index})
-            v2_texindexes = vertex_textures.setdefault(v2_index, {(texindex_v2, nrmindex_v2) : v2_index})
-            v3_texindexes = vertex_textures.setdefault(v3_index, {(texindex_v3, nrmindex_v3) : v3_index})
-
-            # If we haven't seen this texindex for vertex 1 before, add a duplicate 
-            # of vertex 1 to the vertex buffer, then record the new vertex buffer index
-            # for vertex 1.
-            if (texindex_v1, nrmindex_v1) not in v1_texindexes:
-                vertex_buffer.append(vertex_buffer[v1_index * 8])
-                vertex_buffer.append(vertex_buffer[v1_index * 8+1])
-                vertex_buffer.append(vertex_buffer[v1_index * 8+2])
-                vertex_buffer.append(normals[nrmindex_v1])
-                vertex_buffer.append(normals[nrmindex_v1+1])
-                vertex_buffer.append(normals[nrmindex_v1+2])
-                vertex_buffer.append(texcoords[2 * texindex_v1])
-                vertex_buffer.append(texcoords[2 * texindex_v1+1])
-                v1_index = len(vertex_buffer)//8-1
-                v1_texindexes[(texindex_v1, nrmindex_v1)] = v1_index
-            else:
-                v1_index = v1_texindexes[(texindex_v1, nrmindex_v1)]
-                vertex_buffer[v1_index * 8 + 3] = normals[3 * nrmindex_v1]
-                vertex_buffer[v1_index * 8 + 4] = normals[3 * nrmindex_v1 + 1]
-                vertex_buffer[v1_index * 8 + 5] = normals[3 * nrmindex_v1 + 2]
-                vertex_buffer[v1_index * 8 + 6] = texcoords[2 * texindex_v1]
-                vertex_buffer[v1_index * 8 + 7] = texcoords[2 * texindex_v1 + 1]
-
-            if (texindex_v2, nrmindex_v2) not in v2_texindexes:
-                vertex_buffer.append(vertex_buffer[v2_index * 8])
-                vertex_buffer.append(vertex_buffer[v2_index * 8+1])
-                vertex_buffer.append(vertex_buffer[v2_index * 8+2])
-                vertex_buffer.append(normals[nrmindex_v2])
-                vertex_buffer.append(normals[nrmindex_v2+1])
-                vertex_buffer.append(normals[nrmindex_v2+2])
-                vertex_buffer.append(texcoords[2 * texindex_v2])
-                vertex_buffer.append(texcoords[2 * texindex_v2+1])
-                v2_index = len(vertex_buffer)//8-1
-                v2_texindexes[(texindex_v2, nrmindex_v2)] = v2_index
-            else:
-                v2_index = v2_texindexes[(texindex_v2, nrmindex_v2)]
-                vertex_buffer[v2_index * 8 + 3] = normals[3 * nrmindex_v2]
-                vertex_buffer[v2_index * 8 + 4] = normals[3 * nrmindex_v2 + 1]
-                vertex_buffer[v2_index * 8 + 5] = normals[3 * nrmindex_v2 + 2]
-                vertex_buffer[v2_index * 8 + 6] = texcoords[2 * texindex_v2]
-                vertex_buffer[v2_index * 8 + 7] = texcoords[2 * texindex_v2 + 1]
-            
-            if (texindex_v3, nrmindex_v3) not in v3_texindexes:
-                vertex_buffer.append(vertex_buffer[v3_index * 8])
-                vertex_buffer.append(vertex_buffer[v3_index * 8+1])
-                vertex_buffer.append(vertex_buffer[v3_index * 8+2])
-                vertex_buffer.append(normals[nrmindex_v3])
-                vertex_buffer.append(normals[nrmindex_v3+1])
-                vertex_buffer.append(normals[nrmindex_v3+2])
-                vertex_buffer.append(texcoords[2 * texindex_v3])
-                vertex_buffer.append(texcoords[2 * texindex_v3+1])
-                v3_index = len(vertex_buffer)//8-1
-                v3_texindexes[(texindex_v3, nrmindex_v3)] = v3_index
-            else:
-                v3_index = v3_texindexes[(texindex_v3, nrmindex_v3)]
-                vertex_buffer[v3_index * 8 + 3] = normals[3 * nrmindex_v3]
-                vertex_buffer[v3_index * 8 + 4] = normals[3 * nrmindex_v3 + 1]
-                vertex_buffer[v3_index * 8 + 5] = normals[3 * nrmindex_v3 + 2]
-                vertex_buffer[v3_index * 8 + 6] = texcoords[2 * texindex_v3]
-                vertex_buffer[v3_index * 8 + 7] = texcoords[2 * texindex_v3 + 1]
-
-            face_buffer.append(v1_index)
-            face_buffer.append(v2_index)
-            face_buffer.append(v3_index)
-
-        return Mesh3D(
-            array(vertex_buffer, "float32"), array(face_buffer, "uint32"), texture
+        vertices, faces = Mesh3D.parse_textured_obj(obj_file)
+        return Mesh3D(vertices, faces, texture)
+
+    @staticmethod
+    def parse_textured_obj(obj_file):
+        """
+        Parses an OBJ file into an interleaved vertex buffer (x, y, z, nx, ny, nz, u, v)
+        and a triangle index buffer, without touching OpenGL.
+
+        The whole file is read as one buffer, the lines of each record type are pulled
+        out with one regular expression, and each record type is converted to a NumPy
+        array in a single call. See parse_obj for the OBJ features supported.
+        """
+        builder = _StreamingVertexBuffer()
+        builder.add_text(obj_file.read())
+        return builder.finish()[:2]
+
+    @staticmethod
+    def parse_textured_obj_stream(obj_file, chunk_size=OBJ_CHUNK_SIZE):
+        """
+        Parses an OBJ file into the same buffers as parse_textured_obj, reading it
+        `chunk_size` characters at a time instead of all at once.
+        """
+        return Mesh3D.parse_obj(obj_file, chunk_size)[:2]
+
+    @staticmethod
+    def parse_obj(obj_file, chunk_size=OBJ_CHUNK_SIZE) -> "ObjData":
+        """
+        Parses an OBJ file into ObjData: the buffers of parse_textured_obj, the range of
+        the index buffer drawn with each material, and the MTL files the OBJ names.
+
+        Faces may have any number of corners, which are triangulated as a fan (so faces
+        must be convex), and each corner may be written "v", "v/vt", "v//vn" or
+        "v/vt/vn", with negative indices counting back from the latest element. Faces
+        are grouped by the material of their usemtl line, keeping file order within a
+        material, so each material's faces are one contiguous Submesh. Groups and
+        objects (g and o lines) are merged. Corners without a normal get a smooth
+        one generated from the faces around them (see MeshNormals).
+
+        The file is read `chunk_size` characters at a time. Each chunk is parsed with
+        the same vectorized record parsers and appended to typed arrays that double in
+        size as they fill, and its face corners are deduplicated against the vertices
+        seen so far. Memory use stays close to the size of the finished buffers,
+        however large the file is.
+        """
+        builder = _StreamingVertexBuffer()
+        remainder = ""
+        while True:
+            chunk = obj_file.read(chunk_size)
+            if not chunk:
+                break
+            # Only parse whole lines; the last partial line waits for the next chunk.
+            text = remainder + chunk
+            end = text.rfind("\n") + 1
+            remainder = text[end:]
+            builder.add_text(text[:end])
+        builder.add_text(remainder)
+        return builder.finish()
+
+
+# A range of a mesh's index buffer that is drawn with one material: the material (its
+# usemtl name in parsed OBJ data, or a Material.Material once loaded; None for faces
+# with no material), the first index and the number of indices.
+Submesh = namedtuple("Submesh", ["material", "first", "count"])
+
+# A parsed OBJ file: its vertex and index buffers, a list of Submeshes covering the
+# index buffer, and the file names from its mtllib lines.
+ObjData = namedtuple("ObjData", ["vertices", "faces", "submeshes", "material_libraries"])
+
+
+def _records(text, tag):
+    """
+    Returns the body of every line of the given OBJ text that starts with `tag`, with
+    the tag and any trailing "# comment" removed.
+    """
+    lines = re.findall(r"^" + tag + r"[ \t]+(.*)$", text, re.MULTILINE)
+    if any("#" in line for line in lines):
+        return [line.split("#", 1)[0] for line in lines]
+    return lines
+
+
+def _record_offsets(text, tag):
+    """
+    Returns the offset in `text` of every line that _records(text, tag) returns.
+    """
+    matches = re.finditer(r"^" + tag + r"[ \t]+", text, re.MULTILINE)
+    return np.fromiter((match.start() for match in matches), dtype=np.int64)
+
+
+def _parse_records(lines, components):
+    """
+    Parses the first `components` numbers of each line into a float32 array of shape
+    (len(lines), components).
+    """
+    # Parse every line in one go. This is only valid if every line has the same number
+    # of values, since a total that happens to divide evenly would still shift the
+    # columns; otherwise take the first `components` tokens of each line, like the old
+    # per-line loader did.
+    widths = {len(line.split()) for line in lines}
+    values = np.fromstring(" ".join(lines), dtype=np.float64, sep=" ")
+    if len(widths) == 1 and min(widths) >= components and values.size == len(lines) * min(widths):
+        values = values.reshape(len(lines), -1)[:, :components]
+    else:
+        values = array(
+            [line.split()[:components] for line in lines], dtype=np.float64
+        ).reshape(-1, components)
+    # Parsed as float64 first, exactly like float(), then rounded to float32 once.
+    return values.astype(np.float32)
+
+
+def _parse_faces(lines):
+    """
+    Parses face lines into an int64 array of (v, vt, vn) index triples, one row per
+    corner, and the number of corners of each face. Indices are as written in the file:
+    one-based, or negative to count back from the latest element, with 0 for a missing
+    vt or vn index.
+    """
+    corner_counts = np.array([len(line.split()) for line in lines], dtype=np.int64)
+    tokens = np.char.replace(array(" ".join(lines).split(), dtype=str), "//", "/0/")
+
+    # Corners come as "v", "v/vt" or "v/vt/vn"; parse each shape as one flat list.
+    corners = np.zeros((len(tokens), 3), dtype=np.int64)
+    slashes = np.char.count(tokens, "/")
+    for count in range(3):
+        shaped = slashes == count
+        if shaped.any():
+            body = " ".join(tokens[shaped]).replace("/", " ")
+            values = np.fromstring(body, dtype=np.int64, sep=" ")
+            corners[shaped, :count + 1] = values.reshape(-1, count + 1)
+    return corners, corner_counts
+
+
+def _triangulate(corner_counts):
+    """
+    Gets the (first, i, i + 1) corner triangles that fan out from the first corner of
+    each face, as rows of indices into the faces' concatenated corners.
+    """
+    triangle_counts = corner_counts - 2
+    face = np.repeat(np.arange(len(corner_counts)), triangle_counts)
+    first = (np.cumsum(corner_counts) - corner_counts)[face]
+    # Each face's triangles are numbered from 1.
+    i = np.arange(len(face)) - np.repeat(np.cumsum(triangle_counts) - triangle_counts, triangle_counts) + 1
+    return np.stack([first, first + i, first + i + 1], axis=1)
+
+
+class _GrowableArray:
+    """
+    A NumPy array of rows that can be appended to, doubling its capacity when full.
+    """
+
+    def __init__(self, columns, dtype, capacity=1024):
+        self._data = np.empty((capacity, columns), dtype=dtype)
+        self.size = 0
+
+    @property
+    def array(self):
+        return self._data[:self.size]
+
+    def extend(self, rows):
+        end = self.size + len(rows)
+        self.reserve(end)
+        self._data[self.size:end] = rows
+        self.size = end
+
+    def resize(self, size, fill):
+        """
+        Grows the array to `size` rows, filling the new ones with `fill`.
+        """
+        if size > self.size:
+            self.reserve(size)
+            self._data[self.size:size] = fill
+            self.size = size
+
+    def reserve(self, capacity):
+        if capacity > len(self._data):
+            grown = np.empty((max(capacity, 2 * len(self._data)),) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+
+
+class _StreamingVertexBuffer:
+    """
+    Builds the buffers of an OBJ file one chunk of its text at a time.
+
+    Vertex i of the OBJ file stays at slot i of the vertex buffer, holding the texture
+    coordinate and normal of the first corner to use it (its "primary" triple). Every
+    other distinct (v, vt, vn) triple is appended after the OBJ vertices, in order of
+    first use. Those slots are only known once the whole file has been read, so until
+    then their indices are stored with DUPLICATE_FLAG set. Vertices that no face uses
+    keep zero normals and texture coordinates, and vertices used without a normal get
+    a generated one.
+    """
+
+    DUPLICATE_FLAG = np.uint32(1 << 31)
+    UNCLAIMED = -2
+
+    def __init__(self):
+        self.verts = _GrowableArray(3, np.float32)
+        self.texcoords = _GrowableArray(2, np.float32)
+        self.normals = _GrowableArray(3, np.float32)
+        # The (vt, vn) of each OBJ vertex's primary triple.
+        self.primary = _GrowableArray(2, np.int64)
+        # The (v, vt, vn) of each duplicate, and the sorted raw bytes of those triples
+        # with their duplicate numbers, for finding them again in later chunks.
+        self.duplicates = _GrowableArray(3, np.int64)
+        self.duplicate_keys = np.empty(0, dtype=_TRIPLE_KEY)
+        self.duplicate_numbers = np.empty(0, dtype=np.int64)
+        # Each triangle's corner slots, and the number of its material in material_names.
+        self.faces = _GrowableArray(3, np.uint32)
+        self.face_materials = _GrowableArray(1, np.int32)
+        self.material_names = [None]
+        self.material = 0
+        self.material_libraries = []
+
+    def add_text(self, text):
+        """
+        Parses whole lines of OBJ text.
+        """
+        for line in _records(text, "mtllib"):
+            for library in line.split():
+                if library not in self.material_libraries:
+                    self.material_libraries.append(library)
+
+        start = 0
+        for match in re.finditer(r"^usemtl[ \t]+(.*)$", text, re.MULTILINE):
+            self._add_records(text[start:match.start()])
+            name = match.group(1).split("#", 1)[0].strip()
+            if name not in self.material_names:
+                self.material_names.append(name)
+            self.material = self.material_names.index(name)
+            start = match.end()
+        self._add_records(text[start:])
+
+    def _add_records(self, text):
+        """
+        Parses lines of OBJ text that all use the current material.
+        """
+        counts_before = (self.verts.size, self.texcoords.size, self.normals.size)
+        self.verts.extend(_parse_records(_records(text, "v"), 3))
+        self.texcoords.extend(_parse_records(_records(text, "vt"), 2))
+        self.normals.extend(_parse_records(_records(text, "vn"), 3))
+        face_lines = _records(text, "f")
+        if not face_lines:
+            return
+
+        corners, corner_counts = _parse_faces(face_lines)
+        if (corners < 0).any():
+            self._resolve_relative(text, corners, corner_counts, counts_before)
+        if (corner_counts < 3).any():
+            # Points and lines written as faces have nothing to draw.
+            corners = corners[np.repeat(corner_counts >= 3, corner_counts)]
+            corner_counts = corner_counts[corner_counts >= 3]
+        if not len(corners):
+            return
+
+        # One-based indices become zero-based, and missing ones -1.
+        triangles = self._corner_slots(corners - 1)[_triangulate(corner_counts)]
+        self.faces.extend(triangles)
+        self.face_materials.extend(np.full((len(triangles), 1), self.material))
+
+    @staticmethod
+    def _resolve_relative(text, corners, corner_counts, counts_before):
+        """
+        Turns negative indices, which count back from the latest v, vt or vn line
+        before their face, into one-based ones, in place.
+        """
+        face_offsets = _record_offsets(text, "f")
+        face_of_corner = np.repeat(np.arange(len(corner_counts)), corner_counts)
+        for column, tag in enumerate(("v", "vt", "vn")):
+            negative = corners[:, column] < 0
+            if negative.any():
+                defined = counts_before[column] + np.searchsorted(_record_offsets(text, tag), face_offsets)
+                corners[negative, column] += defined[face_of_corner[negative]] + 1
+
+    def _corner_slots(self, corners):
+        # The chunk's distinct triples in order of first use, as in _build_vertex_buffer.
+        shifted = corners + 1
+        bases = shifted.max(axis=0) + 1
+        keys = (shifted[:, 0] * bases[1] + shifted[:, 1]) * bases[2] + shifted[:, 2]
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        triples = corners[first]
+        order = np.argsort(first)
+
+        # Vertices used for the first time take their first triple as their primary.
+        self.primary.resize(int(triples[:, 0].max()) + 1, self.UNCLAIMED)
+        primary = self.primary.array
+        ordered = triples[order]
+        unclaimed = ordered[primary[ordered[:, 0], 0] == self.UNCLAIMED]
+        _, claims = np.unique(unclaimed[:, 0], return_index=True)
+        primary[unclaimed[claims, 0]] = unclaimed[claims, 1:]
+
+        is_primary = (primary[triples[:, 0]] == triples[:, 1:]).all(axis=1)
+        slots = np.empty(len(triples), dtype=np.uint32)
+        slots[is_primary] = triples[is_primary, 0]
+        duplicates = order[~is_primary[order]]
+        if len(duplicates):
+            slots[duplicates] = self._duplicate_numbers(triples[duplicates]) | self.DUPLICATE_FLAG
+        return slots[inverse.reshape(-1)]
+
+    def _duplicate_numbers(self, triples):
+        """
+        Numbers the given distinct non-primary triples, reusing the number of any seen
+        in an earlier chunk and numbering new ones in the order given.
+        """
+        keys = np.ascontiguousarray(triples, dtype=np.int64).view(_TRIPLE_KEY).reshape(-1)
+        positions = np.searchsorted(self.duplicate_keys, keys)
+        found = positions < len(self.duplicate_keys)
+        found[found] = self.duplicate_keys[positions[found]] == keys[found]
+
+        numbers = np.empty(len(keys), dtype=np.int64)
+        numbers[found] = self.duplicate_numbers[positions[found]]
+        numbers[~found] = self.duplicates.size + np.arange(np.count_nonzero(~found))
+        self.duplicates.extend(triples[~found])
+
+        all_keys = np.concatenate([self.duplicate_keys, keys[~found]])
+        all_numbers = np.concatenate([self.duplicate_numbers, numbers[~found]])
+        by_key = np.argsort(all_keys, kind="stable")
+        self.duplicate_keys, self.duplicate_numbers = all_keys[by_key], all_numbers[by_key]
+        return numbers.astype(np.uint32)
+
+    def finish(self):
+        verts, texcoords, normals = self.verts.array, self.texcoords.array, self.normals.array
+        vertex_count = len(verts)
+        duplicates = self.duplicates.array
+        vertex_buffer = np.zeros((vertex_count + len(duplicates), 8), dtype=np.float32)
+        vertex_buffer[:vertex_count, 0:3] = verts
+        vertex_buffer[vertex_count:, 0:3] = verts[duplicates[:, 0]]
+
+        # Vertices that no face uses keep zero normals and texture coordinates.
+        attributes = (
+            (0, self.primary.array[:, 0], self.primary.array[:, 1]),
+            (vertex_count, duplicates[:, 1], duplicates[:, 2]),
         )
+        for start, vt, vn in attributes:
+            has_normal = np.flatnonzero(vn >= 0)
+            vertex_buffer[start + has_normal, 3:6] = normals[vn[has_normal]]
+            has_texcoord = np.flatnonzero(vt >= 0)
+            vertex_buffer[start + has_texcoord, 6:8] = texcoords[vt[has_texcoord]]
+
+        triangles = self.faces.array
+        is_duplicate = triangles >= self.DUPLICATE_FLAG
+        triangles[is_duplicate] -= self.DUPLICATE_FLAG
+        triangles[is_duplicate] += np.uint32(vertex_count)
+
+        # Corners written without a normal have vn -1 (unused vertices are UNCLAIMED).
+        missing_normal = np.zeros(len(vertex_buffer), dtype=bool)
+        missing_normal[:len(self.primary.array)] = self.primary.array[:, 1] == -1
+        missing_normal[vertex_count:] = duplicates[:, 2] == -1
+        if missing_normal.any():
+            generated = vertex_normals(vertex_buffer[:, :3].astype(np.float64), triangles.astype(np.int64))
+            vertex_buffer[missing_normal, 3:6] = generated[missing_normal]
+
+        # Put each material's triangles together, in order of the materials' first use.
+        materials = self.face_materials.array.reshape(-1)
+        if len(materials) and (materials != materials[0]).any():
+            order = np.argsort(materials, kind="stable")
+            triangles, materials = triangles[order], materials[order]
+        used, firsts, counts = np.unique(materials, return_index=True, return_counts=True)
+        submeshes = [
+            Submesh(self.material_names[material], 3 * int(first), 3 * int(count))
+            for material, first, count in zip(used, firsts, counts)
+        ]
+        return ObjData(vertex_buffer.reshape(-1), triangles.reshape(-1), submeshes, self.material_libraries)
+
+
+# One (v, vt, vn) triple's raw bytes, which sort and compare as a single value.
+_TRIPLE_KEY = np.dtype((np.void, 3 * 8))
@@ -0,0 +1,253 @@
+"""
+On-disk cache of parsed OBJ meshes.
+
+Parsing OBJ text is the slowest part of startup, so the parsed vertex and index buffers
+are saved to a small binary file in a ".meshcache" directory next to the OBJ:
+
+    header (72 bytes) | float32 vertex block | uint32 index block | submesh table
+
+The submesh table is JSON holding the mesh's per-material index ranges and the MTL
+files the OBJ names (see Mesh3D.parse_obj). The header records the SHA-256 of the OBJ
+file and the loader version that produced the buffers, and the version of
+MeshOptimizer that reordered them for the GPU (0 if they weren't). A cache file whose
+hash or version does not match is stale, and is rebuilt the next time the OBJ is
+loaded. Fresh cache files are memory-mapped, so their arrays go straight to
+Mesh3D.get_vao without being parsed or copied.
+
+OBJ files are hashed and parsed a chunk at a time, so even very large ones never have
+to fit in memory as text.
+
+Levels of detail built by MeshSimplifier are cached the same way, one file per level,
+and also record the simplifier version.
+
+Run this module to pre-bake every OBJ in a directory:
+
+    python MeshCache.py models/
+    python MeshCache.py models/ --lods 4
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from Mesh3D_normals import Mesh3D, OBJ_CHUNK_SIZE, OBJ_LOADER_VERSION, ObjData, Submesh
+from MeshOptimizer import OPTIMIZER_VERSION, cache_statistics, optimize
+from MeshSimplifier import SIMPLIFIER_VERSION, simplify
+
+CACHE_DIRECTORY = ".meshcache"
+MAGIC = b"MSH2"
+# magic, loader version, simplifier version (0 for the full mesh), optimizer version (0 if not optimized),
+# OBJ SHA-256, vertex float count, index count, submesh table bytes.
+HEADER = struct.Struct("<4sIII32sQQI")
+HEADER_SIZE = 72
+
+
+def cache_path(obj_filename, level=0):
+    """
+    Gets the path of the cache file for the given OBJ file, or for one of its levels of
+    detail.
+    """
+    directory, name = os.path.split(obj_filename)
+    suffix = f".lod{level}.mesh" if level else ".mesh"
+    return os.path.join(directory, CACHE_DIRECTORY, name + suffix)
+
+
+def load_obj(obj_filename, optimized=True) -> ObjData:
+    """
+    Gets the ObjData that Mesh3D.parse_obj produces for the given OBJ file, from the
+    cache if it is fresh, otherwise by parsing the OBJ and writing a new cache file.
+    If `optimized`, the buffers are reordered for the vertex cache and vertex fetching
+    (see MeshOptimizer) before they are cached; the triangles drawn are the same.
+    """
+    digest = _file_digest(obj_filename)
+    path = cache_path(obj_filename)
+    optimizer_version = OPTIMIZER_VERSION if optimized else 0
+    cached = _read(path, digest, optimizer_version=optimizer_version)
+    if cached is not None:
+        return cached
+
+    # newline="" keeps line endings as they are in the file, as decoding its bytes did.
+    with open(obj_filename, encoding="utf-8", newline="") as f:
+        data = Mesh3D.parse_obj(f)
+    if optimized:
+        data = _optimize_submeshes(data)
+    _write(path, digest, data, optimizer_version=optimizer_version)
+    return data
+
+
+def load_textured_obj(obj_filename, optimized=True):
+    """
+    Gets the (vertices, faces) buffers that Mesh3D.parse_textured_obj produces for the
+    given OBJ file (reordered as load_obj does if `optimized`), through the cache.
+    """
+    return load_obj(obj_filename, optimized)[:2]
+
+
+def load_lods(obj_filename, levels=4, ratio=0.5, optimized=True) -> list[ObjData]:
+    """
+    Gets a chain of `levels` levels of detail for the given OBJ file, starting with the
+    full mesh, where each level has about `ratio` times the triangles of the one before.
+    Levels come from the cache when it is fresh, otherwise each is simplified from the
+    previous level, one submesh at a time so materials keep their faces, (optionally)
+    optimized like load_obj, and cached.
+    """
+    digest = _file_digest(obj_filename)
+    optimizer_version = OPTIMIZER_VERSION if optimized else 0
+    lods = [load_obj(obj_filename, optimized)]
+    for level in range(1, levels):
+        # The ratio changes every level's output, so it is part of the cache key.
+        level_digest = hashlib.sha256(digest + f"{level}:{ratio!r}".encode()).digest()
+        path = cache_path(obj_filename, level)
+        cached = _read(path, level_digest, SIMPLIFIER_VERSION, optimizer_version)
+        if cached is None:
+            cached = _simplify_submeshes(lods[-1], ratio)
+            if optimized:
+                cached = _optimize_submeshes(cached)
+            _write(path, level_digest, cached, SIMPLIFIER_VERSION, optimizer_version)
+        lods.append(cached)
+    return lods
+
+
+def _optimize_submeshes(data):
+    """
+    Reorders an ObjData's buffers with MeshOptimizer.optimize, keeping each submesh's
+    triangles within its own index range.
+    """
+    vertices, faces = optimize(data.vertices, data.faces, [(s.first, s.count) for s in data.submeshes])
+    return ObjData(vertices, faces, data.submeshes, data.material_libraries)
+
+
+def _simplify_submeshes(data, ratio):
+    """
+    Simplifies each submesh of `data` to about `ratio` times its triangles, and joins
+    the results into one ObjData with the same submeshes.
+    """
+    vertex_blocks, index_blocks, submeshes = [], [], []
+    vertex_count = index_count = 0
+    for submesh in data.submeshes:
+        faces = data.faces[submesh.first:submesh.first + submesh.count]
+        vertices, faces = simplify(data.vertices, faces, int(submesh.count // 3 * ratio))
+        vertex_blocks.append(vertices)
+        index_blocks.append(faces + np.uint32(vertex_count))
+        submeshes.append(Submesh(submesh.material, index_count, len(faces)))
+        vertex_count += vertices.size // 8
+        index_count += len(faces)
+    return ObjData(
+        np.concatenate(vertex_blocks or [np.zeros(0, dtype=np.float32)]),
+        np.concatenate(index_blocks or [np.zeros(0, dtype=np.uint32)]),
+        submeshes,
+        data.material_libraries,
+    )
+
+
+def _file_digest(filename):
+    """
+    Gets the SHA-256 of a file, reading it a chunk at a time.
+    """
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(OBJ_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.digest()
+
+
+def _read(path, digest, simplifier_version=0, optimizer_version=0):
+    """
+    Memory-maps the buffers of the given cache file and reads its submesh table into an
+    ObjData, or returns None if the file is missing or was not built from the same OBJ
+    contents by the same loader (and simplifier and optimizer) version.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    if len(header) != HEADER_SIZE:
+        return None
+
+    magic, version, simplifier, optimizer, cached_digest, vertex_count, index_count, table_size = (
+        HEADER.unpack_from(header)
+    )
+    if magic != MAGIC or version != OBJ_LOADER_VERSION or cached_digest != digest:
+        return None
+    if simplifier != simplifier_version or optimizer != optimizer_version:
+        return None
+    table_offset = HEADER_SIZE + 4 * (vertex_count + index_count)
+    if os.path.getsize(path) != table_offset + table_size:
+        return None
+
+    vertices = np.memmap(path, dtype=np.float32, mode="r", offset=HEADER_SIZE, shape=(vertex_count,))
+    faces = np.memmap(
+        path,
+        dtype=np.uint32,
+        mode="r",
+        offset=HEADER_SIZE + vertices.nbytes,
+        shape=(index_count,),
+    )
+    with open(path, "rb") as f:
+        f.seek(table_offset)
+        table = json.loads(f.read(table_size))
+    submeshes = [Submesh(*submesh) for submesh in table["submeshes"]]
+    return ObjData(vertices, faces, submeshes, table["material_libraries"])
+
+
+def _write(path, digest, data, simplifier_version=0, optimizer_version=0):
+    """
+    Writes a cache file for the given ObjData. The file is written under a temporary
+    name and then renamed, so a crash never leaves a truncated cache behind. The name is
+    unique to the writing process and thread, so background loads of the same OBJ
+    (see AssetLoader) can't interleave their writes.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    vertices, faces = data.vertices, data.faces
+    table = json.dumps({
+        "submeshes": [list(submesh) for submesh in data.submeshes],
+        "material_libraries": data.material_libraries,
+    }).encode()
+    header = HEADER.pack(
+        MAGIC,
+        OBJ_LOADER_VERSION,
+        simplifier_version,
+        optimizer_version,
+        digest,
+        vertices.size,
+        faces.size,
+        len(table),
+    )
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(np.ascontiguousarray(vertices, dtype=np.float32).tobytes())
+        f.write(np.ascontiguousarray(faces, dtype=np.uint32).tobytes())
+        f.write(table)
+    os.replace(temp_path, path)
+
+
+def bake(directory, levels=1):
+    """
+    Builds or refreshes the cache file of every OBJ file in the given directory, and of
+    its first `levels` levels of detail.
+    """
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(".obj"):
+            filename = os.path.join(directory, name)
+            for level, data in enumerate(load_lods(filename, levels)):
+                label = f" lod{level}" if levels > 1 else ""
+                acmr, _ = cache_statistics(data.faces)
+                print(
+                    f"{filename}{label}: {data.vertices.size // 8} vertices, {data.faces.size // 3} triangles, "
+                    f"{len(data.submeshes)} materials, ACMR {acmr:.3f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-bake the mesh cache for OBJ files.")
+    parser.add_argument("directories", nargs="*", default=["models"])
+    parser.add_argument("--lods", type=int, default=1, help="levels of detail to bake per mesh")
+    args = parser.parse_args()
+    for directory in args.directories:
+        bake(directory, args.lods)
@@ -0,0 +1,146 @@
+"""
+Vertex normals for meshes whose files or constructors don't provide any, computed from
+the interleaved vertex/index buffers that Mesh3D uses.
+
+Each triangle's unit normal is added to its corners' vertices, weighted either by the
+triangle's area or by its angle at the corner, with one np.add.at call over every
+corner. Vertices that share a position (such as the copies the OBJ loader makes along
+texture seams) share one normal, so seams don't show in the shading.
+
+With a crease angle, each corner only averages the triangles around its position whose
+normals are within that angle of its own triangle's, and a vertex is split wherever its
+corners end up with different normals. Edges sharper than the crease angle then stay
+hard, and a crease angle of 0 gives flat shading.
+"""
+import numpy as np
+
+# Unit normals this close to each other count as the same direction for creases.
+_COSINE_TOLERANCE = 1e-6
+
+
+def generate_normals(vertices, faces, stride=8, weighting="angle", crease_angle=None):
+    """
+    Computes the normals (floats 3-5) of an interleaved vertex buffer with `stride`
+    floats per vertex, starting with x, y, z, from its triangle index buffer.
+    `weighting` is "angle" or "area", and `crease_angle` (in radians) turns on crease
+    splitting. Returns new (vertices, faces) buffers; without a crease angle the index
+    buffer is the one given.
+    """
+    vertex_data = np.array(vertices, dtype=np.float32).reshape(-1, stride)
+    triangles = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    positions = vertex_data[:, :3].astype(np.float64)
+    if crease_angle is None:
+        vertex_data[:, 3:6] = vertex_normals(positions, triangles, weighting)
+        return vertex_data.reshape(-1), faces
+
+    normals = _creased_corner_normals(positions, triangles, weighting, crease_angle)
+    # One vertex per distinct (vertex, normal) pair among the corners.
+    corners = triangles.reshape(-1)
+    normals = normals.astype(np.float32)
+    remapped, first = _weld(np.column_stack([corners, normals]))
+    split = vertex_data[corners[first]]
+    split[:, 3:6] = normals[first]
+    return split.reshape(-1), remapped.astype(np.uint32)
+
+
+def vertex_normals(positions, triangles, weighting="angle"):
+    """
+    Gets a smooth unit normal for each of the given (n, 3) positions from the (m, 3)
+    triangles that use them, or zero for positions that no triangle uses.
+    """
+    welded, _ = _weld(positions)
+    sums = np.zeros((welded.max(initial=-1) + 1, 3))
+    _, contributions = _corner_contributions(positions, triangles, weighting)
+    np.add.at(sums, welded[triangles].reshape(-1), contributions.reshape(-1, 3))
+    return _normalize(sums)[welded].astype(np.float32)
+
+
+def face_normals(positions, triangles):
+    """
+    Gets the unit normal and the area of each of the given triangles, with a zero
+    normal for degenerate ones.
+    """
+    a, b, c = (positions[triangles[:, i]] for i in range(3))
+    cross = np.cross(b - a, c - a)
+    return _normalize(cross), np.linalg.norm(cross, axis=1) / 2
+
+
+def _corner_contributions(positions, triangles, weighting):
+    """
+    Gets the triangles' unit normals, and each corner's weighted share of its
+    triangle's normal as an (m, 3, 3) array.
+    """
+    normals, areas = face_normals(positions, triangles)
+    if weighting == "area":
+        weights = np.repeat(areas[:, None], 3, axis=1)
+    elif weighting == "angle":
+        weights = _corner_angles(positions, triangles)
+    else:
+        raise ValueError(f"weighting must be 'angle' or 'area', not {weighting!r}")
+    return normals, normals[:, None, :] * weights[:, :, None]
+
+
+def _corner_angles(positions, triangles):
+    """
+    Gets the interior angle of each triangle at each of its three corners.
+    """
+    corners = positions[triangles]
+    # Edge i runs from corner i to corner i + 1.
+    edges = _normalize(np.roll(corners, -1, axis=1) - corners)
+    cosines = -(edges * np.roll(edges, 1, axis=1)).sum(axis=2)
+    return np.arccos(np.clip(cosines, -1, 1))
+
+
+def _creased_corner_normals(positions, triangles, weighting, crease_angle):
+    """
+    Gets a unit normal for every corner (as an (m * 3, 3) array) averaging only the
+    triangles around its position that meet its own triangle at less than
+    `crease_angle`.
+    """
+    unit_normals, contributions = _corner_contributions(positions, triangles, weighting)
+    contributions = contributions.reshape(-1, 3)
+    welded, _ = _weld(positions)
+    corner_positions = welded[triangles.reshape(-1)]
+
+    # Pair every corner with every corner at the same position, itself included: sorted
+    # by position, corner k of a group of n starting at s pairs with s, ..., s + n - 1.
+    order = np.argsort(corner_positions, kind="stable")
+    group_sizes = np.bincount(corner_positions)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    sizes = group_sizes[corner_positions[order]]
+    corners = np.repeat(order, sizes)
+    within = np.arange(len(corners)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    others = order[np.repeat(group_starts[corner_positions[order]], sizes) + within]
+
+    corner_normals = np.repeat(unit_normals.astype(np.float32), 3, axis=0)
+    cosines = np.einsum("ij,ij->i", corner_normals[corners], corner_normals[others])
+    smooth = cosines >= np.cos(crease_angle) - _COSINE_TOLERANCE
+    corners, others = corners[smooth], others[smooth]
+    # Summing a column at a time with bincount is several times quicker than
+    # np.add.at for the million or so pairs of a large mesh.
+    sums = np.column_stack([
+        np.bincount(corners, contributions[others, axis], minlength=len(corner_positions))
+        for axis in range(3)
+    ])
+    return _normalize(sums)
+
+
+def _weld(rows):
+    """
+    Numbers the distinct rows of an (n, k) array in sorted order (by the first column,
+    then the second, ...). Returns each row's number and, for each number, the index of
+    a row with it. Sorting the columns with lexsort is much quicker than
+    np.unique(axis=0).
+    """
+    order = np.lexsort(rows.T[::-1])
+    ordered = rows[order]
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+    numbers = np.empty(len(order), dtype=np.int64)
+    numbers[order] = np.cumsum(new) - 1
+    return numbers, order[new]
+
+
+def _normalize(vectors):
+    lengths = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
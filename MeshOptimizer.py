@@ -0,0 +1,244 @@
+"""
+Reorders the interleaved vertex/index buffers that Mesh3D uses so the GPU does less
+work drawing them, without changing what is drawn.
+
+- Triangle order for the post-transform vertex cache: Tipsify (Sander, Nehab &
+  Barczak, "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw", 2007)
+  fans out from each vertex in turn, emitting all of its remaining triangles, and
+  picks the next vertex among the ones just emitted that will still be in the cache.
+  Its vertex shader runs per triangle (ACMR) drop close to the 0.5-0.7 a cache can
+  reach, from about 1.0 or more in OBJ face order. Identical vertices (such as the
+  copies the OBJ loader makes for corners whose texture coordinate indices differ
+  but whose values don't) are merged first, since the cache can only reuse a vertex
+  that has one index.
+- Overdraw: the paper's second step cuts the Tipsify order into clusters wherever
+  the cache would have been cold anyway (and where cutting costs less than
+  `overdraw_threshold` times the cluster's ACMR), then draws clusters that face
+  outward from the mesh's center first, so they tend to occlude the rest.
+- Vertex fetch: vertices are renumbered in the order the triangles first use them,
+  so the GPU reads the vertex buffer mostly front to back. Vertices no triangle uses
+  are dropped.
+
+cache_statistics simulates a FIFO cache to measure ACMR and ATVR (vertex shader runs
+per vertex), where 1.0 is ideal. Everything runs on the CPU with NumPy and the
+standard library.
+"""
+import numpy as np
+
+# Bump whenever optimize() changes its output, so cached meshes get rebuilt.
+OPTIMIZER_VERSION = 1
+
+# Post-transform cache entries to optimize for. Most GPUs hold at least this many.
+CACHE_SIZE = 16
+
+# How much worse than its cluster's ACMR the order may get to make overdraw clusters.
+OVERDRAW_THRESHOLD = 1.05
+
+
+def optimize(vertices, faces, ranges=None, stride=8, cache_size=CACHE_SIZE, overdraw_threshold=None):
+    """
+    Merges identical vertices, then reorders a mesh's triangles for the vertex cache
+    (and for overdraw, if given an `overdraw_threshold` such as OVERDRAW_THRESHOLD)
+    and its vertices for fetching. `vertices` holds
+    `stride` floats per vertex, starting with x, y, z; `faces` holds three indices per
+    triangle. `ranges` is a list of (first, count) index ranges, such as submeshes,
+    whose triangles are only reordered within their range; by default the whole index
+    buffer is one range. Returns new (vertices, faces) buffers in the same format.
+    """
+    vertex_data, faces = merge_duplicate_vertices(vertices, faces, stride)
+    if ranges is None:
+        ranges = [(0, len(faces))]
+    blocks = []
+    for first, count in ranges:
+        triangles = faces[first:first + count].reshape(-1, 3)
+        order, clusters = tipsify(triangles, len(vertex_data), cache_size)
+        if overdraw_threshold is not None:
+            order = sort_clusters(vertex_data[:, :3], triangles, order, clusters, cache_size, overdraw_threshold)
+        blocks.append(triangles[order].reshape(-1))
+    faces = np.concatenate(blocks or [np.zeros(0, dtype=np.uint32)])
+    return optimize_vertex_fetch(vertex_data, faces)
+
+
+def tipsify(triangles, vertex_count, cache_size=CACHE_SIZE):
+    """
+    Gets a cache-friendly order for an (n, 3) array of triangles, as indices into it,
+    and the start of each cluster: each point in the order where no neighbor was left
+    in the cache and Tipsify had to jump elsewhere in the mesh.
+    """
+    corners = np.asarray(triangles, dtype=np.int64).reshape(-1)
+    uses = np.bincount(corners, minlength=vertex_count)
+    # The triangles around each vertex, as one list with each vertex's slice in offsets.
+    adjacency = (np.argsort(corners, kind="stable") // 3).tolist()
+    offsets = np.concatenate([[0], np.cumsum(uses)]).tolist()
+    live = uses.tolist()
+    triangle_list = np.asarray(triangles).tolist()
+
+    # A vertex is in the cache while fewer than cache_size vertices came in after it.
+    timestamps = [0] * vertex_count
+    time = cache_size + 1
+    emitted = [False] * len(triangle_list)
+    dead_ends = []
+    order = []
+    clusters = [0] if triangle_list else []
+    cursor = 0
+    fanning = int(corners[0]) if len(corners) else -1
+    while fanning >= 0:
+        candidates = []
+        for triangle in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[triangle]:
+                continue
+            emitted[triangle] = True
+            order.append(triangle)
+            for vertex in triangle_list[triangle]:
+                dead_ends.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time - timestamps[vertex] > cache_size:
+                    timestamps[vertex] = time
+                    time += 1
+
+        # Prefer the candidate that has been in the cache longest but will still be
+        # there after its remaining triangles are emitted.
+        fanning, best = -1, -1
+        for vertex in candidates:
+            if live[vertex] > 0:
+                age = time - timestamps[vertex]
+                priority = age if age + 2 * live[vertex] <= cache_size else 0
+                if priority > best:
+                    fanning, best = vertex, priority
+        if fanning >= 0:
+            continue
+
+        # A dead end: go back to a recent vertex, or failing that, the next one in the
+        # buffer that still has triangles. Either way the cache is cold from here.
+        while dead_ends:
+            vertex = dead_ends.pop()
+            if live[vertex] > 0:
+                fanning = vertex
+                break
+        else:
+            while cursor < vertex_count and live[cursor] == 0:
+                cursor += 1
+            if cursor < vertex_count:
+                fanning = cursor
+        if fanning >= 0 and len(order) < len(triangle_list):
+            clusters.append(len(order))
+    return np.array(order, dtype=np.int64), clusters
+
+
+def sort_clusters(positions, triangles, order, clusters, cache_size=CACHE_SIZE, threshold=OVERDRAW_THRESHOLD):
+    """
+    Reorders the clusters of a Tipsify order (see tipsify) to reduce overdraw. Each
+    cluster is first split wherever the triangles so far already have an ACMR within
+    `threshold` times the whole cluster's, then the pieces are sorted so those facing
+    away from the mesh's center come first. Returns the new order.
+    """
+    ordered = np.asarray(triangles, dtype=np.int64)[order]
+    starts = _split_clusters(ordered, clusters, cache_size, threshold)
+    if len(starts) < 2:
+        return order
+
+    corners = np.asarray(positions, dtype=np.float64)[ordered]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    centroids = corners.mean(axis=1)
+    mesh_center = (centroids * areas[:, None]).sum(axis=0) / max(areas.sum(), 1e-30)
+
+    # Area-weighted centroid and summed normal (whose length is twice the area) of
+    # each cluster.
+    cluster_areas = np.add.reduceat(areas, starts)
+    cluster_centers = np.add.reduceat(centroids * areas[:, None], starts) / np.maximum(cluster_areas, 1e-30)[:, None]
+    cluster_normals = np.add.reduceat(normals, starts)
+    lengths = np.maximum(np.linalg.norm(cluster_normals, axis=1), 1e-30)
+    facing = ((cluster_centers - mesh_center) * cluster_normals).sum(axis=1) / lengths
+
+    sizes = np.diff(np.append(starts, len(order)))
+    by_facing = np.argsort(-facing, kind="stable")
+    triangle_starts = np.repeat(np.asarray(starts)[by_facing], sizes[by_facing])
+    within = np.arange(len(order)) - np.repeat(np.cumsum(sizes[by_facing]) - sizes[by_facing], sizes[by_facing])
+    return np.asarray(order)[triangle_starts + within]
+
+
+def _split_clusters(ordered, clusters, cache_size, threshold):
+    """
+    Gets the starts of the pieces the given clusters of ordered triangles split into.
+    """
+    corner_list = ordered.tolist()
+    bounds = list(clusters) + [len(corner_list)]
+    starts = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        target = _acmr(corner_list[start:end], cache_size) * threshold
+        starts.append(start)
+        stamps, misses, count = {}, 0, 0
+        for i in range(start, end):
+            for vertex in corner_list[i]:
+                if misses - stamps.get(vertex, -cache_size) >= cache_size:
+                    misses += 1
+                    stamps[vertex] = misses
+            count += 1
+            # A piece whose locality is already as good as the cluster's can end here,
+            # and the next starts with a cold cache.
+            if misses <= target * count and i + 1 < end:
+                starts.append(i + 1)
+                stamps, misses, count = {}, 0, 0
+    return np.array(starts, dtype=np.int64)
+
+
+def merge_duplicate_vertices(vertices, faces, stride=8):
+    """
+    Merges vertices whose attributes are bit-for-bit identical. Returns the (n, stride)
+    float32 vertices left and the remapped faces, with vertices in their original order.
+    """
+    vertex_data = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, stride)
+    # Each vertex's bytes as one value, so rows sort and compare in one step.
+    keys = vertex_data.view(np.dtype((np.void, 4 * stride))).reshape(-1)
+    _, first, remap = np.unique(keys, return_index=True, return_inverse=True)
+    # Keep the survivors in their original order.
+    kept = np.argsort(first)
+    renumber = np.empty(len(kept), dtype=np.uint32)
+    renumber[kept] = np.arange(len(kept), dtype=np.uint32)
+    return vertex_data[first[kept]], renumber[remap.reshape(-1)][np.asarray(faces, dtype=np.int64)]
+
+
+def optimize_vertex_fetch(vertices, faces, stride=8):
+    """
+    Renumbers a mesh's vertices in the order its triangles first use them, dropping
+    vertices no triangle uses. Returns new (vertices, faces) buffers.
+    """
+    vertex_data = np.asarray(vertices, dtype=np.float32).reshape(-1, stride)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1)
+    used, first_use = np.unique(faces, return_index=True)
+    by_first_use = used[np.argsort(first_use)]
+    remap = np.zeros(len(vertex_data), dtype=np.uint32)
+    remap[by_first_use] = np.arange(len(by_first_use), dtype=np.uint32)
+    return vertex_data[by_first_use].reshape(-1), remap[faces]
+
+
+def cache_statistics(faces, vertex_count=None, cache_size=CACHE_SIZE):
+    """
+    Simulates drawing an index buffer through a FIFO post-transform cache of
+    `cache_size` vertices. Returns the ACMR (vertex shader runs per triangle) and ATVR
+    (runs per vertex used, or per vertex of `vertex_count` if given).
+    """
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1)
+    if not len(faces):
+        return 0.0, 0.0
+    misses = _misses(faces.tolist(), cache_size)
+    if vertex_count is None:
+        vertex_count = len(np.unique(faces))
+    return misses / (len(faces) // 3), misses / vertex_count
+
+
+def _acmr(triangle_list, cache_size):
+    return _misses([vertex for triangle in triangle_list for vertex in triangle], cache_size) / max(len(triangle_list), 1)
+
+
+def _misses(indices, cache_size):
+    # A vertex is cached while fewer than cache_size misses came after its own.
+    stamps = {}
+    misses = 0
+    for vertex in indices:
+        if misses - stamps.get(vertex, -cache_size) >= cache_size:
+            misses += 1
+            stamps[vertex] = misses
+    return misses
@@ -0,0 +1,266 @@
+"""
+Quadric error metric mesh simplification (Garland & Heckbert, 1997), for building
+levels of detail of the interleaved vertex/index buffers that Mesh3D uses.
+
+Vertices that share a position (such as the copies the OBJ loader makes along texture
+seams) are welded into one node of the collapse graph, so seams don't tear open. Each
+edge collapse merges two nodes into one at the position that minimizes the summed
+squared distance to the planes of their original faces; the cheapest collapses are
+applied first until the triangle budget is met. Collapses that would flip a triangle
+or pinch the surface into a non-manifold shape are skipped, and open boundaries are
+held in place by extra perpendicular planes.
+
+Everything runs on the CPU with NumPy and the standard library.
+"""
+import heapq
+
+import numpy as np
+
+# Bump whenever simplify() changes its output, so cached levels of detail get rebuilt.
+SIMPLIFIER_VERSION = 1
+
+# How strongly open boundary edges resist moving, relative to ordinary surface error.
+BOUNDARY_WEIGHT = 100.0
+
+
+def simplify(vertices, faces, target_triangles, stride=8):
+    """
+    Simplifies a mesh down to at most `target_triangles` triangles (or as close as the
+    mesh allows). `vertices` holds `stride` floats per vertex, starting with x, y, z;
+    `faces` holds three indices per triangle. Returns new (vertices, faces) buffers in
+    the same format. Surviving vertices keep their other attributes.
+    """
+    vertex_data = np.asarray(vertices, dtype=np.float32).reshape(-1, stride)
+    triangles = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+
+    # Weld vertices that share a position into nodes of the collapse graph.
+    node_positions, welded = np.unique(
+        vertex_data[:, :3].astype(np.float64), axis=0, return_inverse=True
+    )
+    welded = welded.reshape(-1)
+    node_faces = welded[triangles]
+    keep = (
+        (node_faces[:, 0] != node_faces[:, 1])
+        & (node_faces[:, 1] != node_faces[:, 2])
+        & (node_faces[:, 0] != node_faces[:, 2])
+    )
+    triangles, node_faces = triangles[keep], node_faces[keep]
+
+    collapser = _Collapser(node_positions, welded, node_faces, triangles, vertex_data[:, 3:])
+    collapser.run(target_triangles)
+    triangles = collapser.surviving_triangles()
+
+    # Write back the moved positions and drop the vertices no triangle uses any more.
+    used, remapped = np.unique(triangles, return_inverse=True)
+    out_vertices = vertex_data[used].copy()
+    out_vertices[:, :3] = collapser.positions[welded[used]]
+    return out_vertices.reshape(-1), remapped.reshape(-1).astype(np.uint32)
+
+
+def build_lods(vertices, faces, levels=4, ratio=0.5, stride=8):
+    """
+    Builds a chain of `levels` levels of detail, starting with the given mesh itself,
+    where each level has about `ratio` times the triangles of the one before.
+    """
+    lods = [(vertices, faces)]
+    for _ in range(levels - 1):
+        previous_vertices, previous_faces = lods[-1]
+        target = int(len(previous_faces) // 3 * ratio)
+        lods.append(simplify(previous_vertices, previous_faces, target, stride))
+    return lods
+
+
+def _plane_quadrics(planes, weights):
+    """
+    Gets the weighted (N, 4, 4) fundamental error quadrics of (N, 4) planes.
+    """
+    return planes[:, :, None] * planes[:, None, :] * weights[:, None, None]
+
+
+class _Collapser:
+    """
+    The mutable state of one simplification: node positions and quadrics, and which
+    triangles touch each node.
+    """
+
+    def __init__(self, positions, welded, node_faces, triangles, attributes):
+        self.positions = positions
+        self.node_faces = node_faces.tolist()
+        self.triangles = triangles.tolist()
+        self.attributes = attributes
+        node_count = len(positions)
+
+        self.alive_faces = [True] * len(self.node_faces)
+        self.face_count = len(self.node_faces)
+        self.faces_of = [set() for _ in range(node_count)]
+        for f, face in enumerate(self.node_faces):
+            for node in face:
+                self.faces_of[node].add(f)
+        self.alive = [True] * node_count
+        self.version = [0] * node_count
+
+        # The original vertices welded into each node, and where each vertex's uses
+        # were redirected to when its node was collapsed away.
+        self.members = [[] for _ in range(node_count)]
+        for vertex, node in enumerate(welded):
+            self.members[node].append(vertex)
+        self.redirect = {}
+
+        self.quadrics = self._initial_quadrics(node_faces)
+
+    def _initial_quadrics(self, node_faces):
+        p0, p1, p2 = (self.positions[node_faces[:, k]] for k in range(3))
+        normals = np.cross(p1 - p0, p2 - p0)
+        double_areas = np.linalg.norm(normals, axis=1)
+        normals = normals / np.maximum(double_areas, 1e-30)[:, None]
+        planes = np.hstack([normals, -(normals * p0).sum(axis=1, keepdims=True)])
+        face_quadrics = _plane_quadrics(planes, double_areas / 2)
+
+        quadrics = np.zeros((len(self.positions), 4, 4))
+        for k in range(3):
+            np.add.at(quadrics, node_faces[:, k], face_quadrics)
+
+        # Edges used by only one triangle are on an open boundary. Pin them with a plane
+        # through the edge, perpendicular to its triangle.
+        edges = np.concatenate(
+            [node_faces[:, [0, 1]], node_faces[:, [1, 2]], node_faces[:, [2, 0]]]
+        )
+        edge_normals = np.tile(normals, (3, 1))
+        keys = np.sort(edges, axis=1)
+        _, index, counts = np.unique(keys, axis=0, return_index=True, return_counts=True)
+        boundary = index[counts == 1]
+        if len(boundary):
+            a, b = edges[boundary, 0], edges[boundary, 1]
+            along = self.positions[b] - self.positions[a]
+            perpendicular = np.cross(along, edge_normals[boundary])
+            lengths = np.linalg.norm(perpendicular, axis=1)
+            perpendicular = perpendicular / np.maximum(lengths, 1e-30)[:, None]
+            d = -(perpendicular * self.positions[a]).sum(axis=1, keepdims=True)
+            weights = BOUNDARY_WEIGHT * (along * along).sum(axis=1)
+            boundary_quadrics = _plane_quadrics(np.hstack([perpendicular, d]), weights)
+            np.add.at(quadrics, a, boundary_quadrics)
+            np.add.at(quadrics, b, boundary_quadrics)
+        return quadrics
+
+    def _collapse_costs(self, a, b):
+        """
+        Gets the cost and best merged position of collapsing each edge (a[i], b[i]).
+        Candidates are the point minimizing the combined quadric, when it is well
+        defined, and the two endpoints and their midpoint.
+        """
+        q = self.quadrics[a] + self.quadrics[b]
+        pa, pb = self.positions[a], self.positions[b]
+        candidates = [pa, pb, (pa + pb) / 2]
+
+        linear = q[:, :3, :3]
+        # A condition number test, unlike a determinant one, doesn't depend on model scale.
+        with np.errstate(divide="ignore", invalid="ignore"):
+            solvable = np.linalg.cond(linear) < 1e6
+        if solvable.any():
+            optimal = candidates[2].copy()
+            optimal[solvable] = np.linalg.solve(linear[solvable], -q[solvable, :3, 3:])[:, :, 0]
+            # Ill-conditioned solutions can land far away; don't trust those.
+            edge_lengths = np.linalg.norm(pb - pa, axis=1)
+            stray = np.linalg.norm(optimal - candidates[2], axis=1) > 2 * edge_lengths
+            optimal[stray] = candidates[2][stray]
+            candidates.append(optimal)
+
+        points = np.stack(candidates, axis=1)
+        homogeneous = np.concatenate([points, np.ones(points.shape[:2] + (1,))], axis=2)
+        costs = np.einsum("nci,nij,ncj->nc", homogeneous, q, homogeneous)
+        best = costs.argmin(axis=1)
+        rows = np.arange(len(a))
+        return np.maximum(costs[rows, best], 0), points[rows, best]
+
+    def _push_edges(self, heap, a, b):
+        if len(a) == 0:
+            return
+        a, b = np.asarray(a), np.asarray(b)
+        costs, points = self._collapse_costs(a, b)
+        for cost, x, y, point in zip(costs.tolist(), a.tolist(), b.tolist(), points.tolist()):
+            heapq.heappush(heap, (cost, x, y, self.version[x], self.version[y], point))
+
+    def _neighbors(self, node):
+        return {other for f in self.faces_of[node] for other in self.node_faces[f]} - {node}
+
+    def _folds(self, a, b, point):
+        """
+        Checks whether moving a and b to `point` would flip any triangle that survives
+        the collapse, or fold two of them onto each other (as collapsing a tetrahedron
+        would).
+        """
+        moved = (self.faces_of[a] | self.faces_of[b]) - (self.faces_of[a] & self.faces_of[b])
+        if not moved:
+            return False
+        merged = [frozenset(a if node == b else node for node in self.node_faces[f]) for f in moved]
+        if len(set(merged)) != len(merged):
+            return True
+        corners = np.array([self.node_faces[f] for f in moved])
+        before = self.positions[corners]
+        after = before.copy()
+        after[(corners == a) | (corners == b)] = point
+        normal_before = np.cross(before[:, 1] - before[:, 0], before[:, 2] - before[:, 0])
+        normal_after = np.cross(after[:, 1] - after[:, 0], after[:, 2] - after[:, 0])
+        return bool(((normal_before * normal_after).sum(axis=1) <= 0).any())
+
+    def run(self, target_triangles):
+        faces = np.asarray(self.node_faces, dtype=np.int64).reshape(-1, 3)
+        edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+        edges = np.unique(np.sort(edges, axis=1), axis=0)
+        heap = []
+        self._push_edges(heap, edges[:, 0], edges[:, 1])
+
+        while self.face_count > target_triangles and heap:
+            _, a, b, version_a, version_b, point = heapq.heappop(heap)
+            if not (self.alive[a] and self.alive[b]):
+                continue
+            if self.version[a] != version_a or self.version[b] != version_b:
+                continue
+            shared = self.faces_of[a] & self.faces_of[b]
+            if not shared or len(shared) >= self.face_count:
+                continue
+            # Link condition: a and b may only share the neighbors across their shared
+            # triangles, or the collapse would pinch the surface.
+            if len(self._neighbors(a) & self._neighbors(b)) != len(shared):
+                continue
+            if self._folds(a, b, point):
+                continue
+            self._collapse(a, b, point, shared)
+            neighbors = sorted(self._neighbors(a))
+            self._push_edges(heap, [a] * len(neighbors), neighbors)
+
+    def _collapse(self, a, b, point, shared):
+        """
+        Merges node b into node a at `point`, dropping the triangles they share.
+        """
+        self.positions[a] = point
+        self.quadrics[a] += self.quadrics[b]
+        self.alive[b] = False
+        self.version[a] += 1
+
+        for f in shared:
+            self.alive_faces[f] = False
+            self.face_count -= 1
+            for node in self.node_faces[f]:
+                self.faces_of[node].discard(f)
+
+        # Each vertex of b is replaced by the vertex of a with the closest attributes
+        # (normal and texture coordinates), so texture seams stay intact.
+        targets = np.array(self.members[a])
+        for vertex in self.members[b]:
+            distances = ((self.attributes[targets] - self.attributes[vertex]) ** 2).sum(axis=1)
+            self.redirect[vertex] = int(targets[distances.argmin()])
+        self.members[b] = []
+
+        for f in self.faces_of[b]:
+            face, triangle = self.node_faces[f], self.triangles[f]
+            for k in range(3):
+                if face[k] == b:
+                    face[k] = a
+                    triangle[k] = self.redirect[triangle[k]]
+            self.faces_of[a].add(f)
+        self.faces_of[b] = set()
+
+    def surviving_triangles(self):
+        alive = [t for t, keep in zip(self.triangles, self.alive_faces) if keep]
+        return np.array(alive, dtype=np.int64).reshape(-1, 3)
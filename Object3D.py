@@ -1,10 +1,19 @@
 from OpenGL.GL import *
 import glm
 import math
+import numpy as np
+
+from Culling import world_boxes
+from SceneNode import SceneNode
+
+# Fraction by which an object's screen size must pass a LOD threshold before the LOD
+# changes, so objects hovering around a threshold don't flicker between levels.
+LOD_HYSTERESIS = 0.15
 
 # An object in 3D space, with a mesh, position, orientation (yaw/pitch/roll),
-# and scale.
-class Object3D:
+# and scale. Objects are scene nodes, so they can be attached to other nodes and
+# move along with them.
+class Object3D(SceneNode):
     def __init__(
         self,
         mesh,
@@ -13,57 +22,84 @@ class Object3D:
         scale: glm.vec3 = glm.vec3(1.0, 1.0, 1.0),
         center: glm.vec3 = glm.vec3(0, 0, 0)
     ):
+        super().__init__(position, orientation, scale, center)
         self.mesh = mesh
-        self.position = position
-        self.orientation = orientation
-        self.scale = scale
-        self.center = center
-        self._refresh_model_matrix()
+        self.lods = [mesh]
+        self.lod_thresholds = []
+        self.lod = 0
+        # The layer of a TextureArray to draw with, in place of the mesh's own texture,
+        # when drawn with one (see RenderProgram.render_instanced).
+        self.texture_layer = 0
 
-    def move(self, offset: glm.vec3):
+    def get_bounding_sphere(self):
         """
-        Moves the object along the given vector.
+        Gets the world-space (center, radius) of a sphere enclosing the object's mesh.
         """
-        self.position = self.position + offset
-        self._refresh_model_matrix()
+        m = self.get_model_matrix()
+        center = glm.vec3(m * glm.vec4(self.mesh.bounding_center, 1))
+        # The longest axis of the model matrix, which includes any parents' scaling.
+        radius = self.mesh.bounding_radius * max(glm.length(glm.vec3(m[i])) for i in range(3))
+        return center, radius
 
-    def rotate(self, rot: glm.vec3):
+    def get_aabb(self):
         """
-        Adds the given yaw,pitch,roll values to the object's current orientation.
+        Gets the world-space (min, max) corners of an axis-aligned box enclosing the
+        object's mesh.
         """
-        self.orientation = self.orientation + rot
-        self._refresh_model_matrix()
+        mins, maxs = world_boxes(
+            np.frombuffer(self.get_model_matrix().to_bytes(), dtype=np.float32).reshape(1, 16),
+            np.array([self.mesh.aabb_min]),
+            np.array([self.mesh.aabb_max]),
+        )
+        return glm.vec3(*mins[0].tolist()), glm.vec3(*maxs[0].tolist())
 
-    def grow(self, sc: glm.vec3):
+    def set_lods(self, meshes, thresholds=None):
         """
-        Multiplies the object's current scale by the given x,y,z scale values.
+        Gives the object a chain of levels of detail, from full detail down. Level i + 1
+        is drawn once the object is less than thresholds[i] pixels tall on screen; by
+        default the thresholds start at 256 pixels and halve at each level.
         """
-        self.scale = self.scale * sc
-        self._refresh_model_matrix()
-
-    def center_point(self, center: glm.vec3):
-        self.center = center
-        self._refresh_model_matrix()
+        if thresholds is None:
+            thresholds = [256 / 2**i for i in range(len(meshes) - 1)]
+        if len(thresholds) != len(meshes) - 1:
+            raise ValueError(f"{len(meshes)} levels of detail need {len(meshes) - 1} thresholds")
+        self.lods = list(meshes)
+        self.lod_thresholds = list(thresholds)
+        self.lod = 0
+        self.mesh = self.lods[0]
 
-    def get_position(self):
-        return self.position
-
-    def get_model_matrix(self):
+    def screen_size(self, projection_matrix: glm.mat4, view_matrix: glm.mat4, viewport_height):
         """
-        Retrieve the object's current Model transformation matrix.
+        Gets the approximate height in pixels of the object's bounding sphere on screen.
         """
-        return self.model_matrix
-
-    def _refresh_model_matrix(self):
-        m = glm.translate(glm.mat4(1), self.position)
-        m = glm.translate(m, self.center * self.scale)
-        m = glm.scale(m, self.scale)
-        m = glm.rotate(m, self.orientation[2], glm.vec3(0, 0, 1))
-        m = glm.rotate(m, self.orientation[0], glm.vec3(1, 0, 0))
-        m = glm.rotate(m, self.orientation[1], glm.vec3(0, 1, 0))
-        m = glm.translate(m, -self.center)
+        center, radius = self.get_bounding_sphere()
+        distance = glm.length(glm.vec3(view_matrix * glm.vec4(center, 1)))
+        if distance <= radius:
+            return math.inf
+        # projection[1][1] is cot(fov / 2), which maps view-space height to clip space.
+        return radius * projection_matrix[1][1] * viewport_height / distance
 
-        self.model_matrix = m
+    def select_lod(
+        self,
+        projection_matrix: glm.mat4,
+        view_matrix: glm.mat4,
+        viewport_height,
+        hysteresis=LOD_HYSTERESIS,
+    ):
+        """
+        Picks the level of detail to draw from the object's size on screen, and makes it
+        the object's mesh. Returns the chosen level.
+        """
+        if len(self.lods) > 1:
+            size = self.screen_size(projection_matrix, view_matrix, viewport_height)
+            lod = self.lod
+            while lod < len(self.lod_thresholds) and size < self.lod_thresholds[lod] * (1 - hysteresis):
+                lod += 1
+            while lod > 0 and size > self.lod_thresholds[lod - 1] * (1 + hysteresis):
+                lod -= 1
+            self.lod = lod
+            self.mesh = self.lods[lod]
+        return self.lod
 
     def draw(self):
         self.mesh.draw()
@@ -0,0 +1,316 @@
+"""
+A lightweight frame profiler: scoped CPU and GPU timers, a ring-buffered history of
+per-frame times with percentiles, an optional on-screen overlay, and export to the
+Chrome trace event format.
+
+    from Profiler import profiler
+
+    profiler.enabled = True
+    with profiler.scope("update"):        # CPU time, from time.perf_counter_ns
+        ...
+    profiler.lap("input")                 # CPU time since the last lap or frame start
+    with profiler.gpu_scope("render"):    # GPU time, from GL_TIMESTAMP queries
+        ...
+    profiler.end_frame()
+    print(profiler.stats("frame"))        # {"mean": ..., "p50": ..., "p95": ..., "p99": ...}
+    profiler.export_chrome_trace("trace.json")
+
+While the profiler is disabled (the default), scope() and gpu_scope() return one shared
+do-nothing context manager, so instrumentation left in hot code costs about a method
+call per scope. GPU results are collected a few frames late, once the GPU has finished
+with them, so timing never stalls the pipeline.
+
+Open exported traces in chrome://tracing or https://ui.perfetto.dev.
+"""
+import contextlib
+import ctypes
+import json
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+from OpenGL.GL import *
+# PyOpenGL's wrapped glGetQueryObjectui64v can't convert its 64-bit output.
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+
+from ShaderManager import ShaderManager
+
+_NULL_SCOPE = contextlib.nullcontext()
+
+# Chrome trace thread ids of the CPU and GPU tracks.
+_CPU_TRACK = 0
+_GPU_TRACK = 1
+
+
+class _CpuScope:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info):
+        self.profiler._record(self.name, self.start, time.perf_counter_ns(), _CPU_TRACK)
+
+
+class _GpuScope:
+    __slots__ = ("profiler", "name", "begin")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.begin = self.profiler._timestamp()
+
+    def __exit__(self, *exc_info):
+        profiler = self.profiler
+        profiler._pending.append((profiler.frame, self.name, self.begin, profiler._timestamp()))
+
+
+class Profiler:
+    """
+    Collects the time spent in named scopes. Each scope's total per frame is kept for
+    the last `history` frames, along with the whole frame's time (as "frame") and GPU
+    scope times (as "gpu:<name>"). The last `max_events` individual scopes are kept for
+    trace export.
+    """
+
+    def __init__(self, enabled=False, history=240, max_events=100_000):
+        self.enabled = enabled
+        self.frame = 0
+        self.samples = defaultdict(lambda: deque(maxlen=history))
+        self.events = deque(maxlen=max_events)
+        self._origin = time.perf_counter_ns()
+        self._frame_start = None
+        self._lap_start = None
+        self._frame_totals = defaultdict(float)
+        self._free_queries = []
+        self._pending = deque()
+        # GPU timestamp minus CPU time, for putting GPU scopes on the CPU timeline.
+        self._gpu_offset = None
+
+    def scope(self, name):
+        """
+        Times the CPU work inside a `with` block.
+        """
+        if not self.enabled:
+            return _NULL_SCOPE
+        return _CpuScope(self, name)
+
+    def gpu_scope(self, name):
+        """
+        Times the GPU work issued inside a `with` block. GPU scopes may nest.
+        """
+        if not self.enabled:
+            return _NULL_SCOPE
+        return _GpuScope(self, name)
+
+    def lap(self, name):
+        """
+        Records the CPU time since the previous lap (or the start of the frame) under
+        `name`, for splitting a main loop into sections without indenting it.
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        if self._lap_start is not None:
+            self._record(name, self._lap_start, now, _CPU_TRACK)
+        self._lap_start = now
+
+    def end_frame(self):
+        """
+        Ends the current frame: records the frame's time and each scope's total in it,
+        and collects the GPU timings that have become available.
+        """
+        if not self.enabled:
+            self._frame_start = self._lap_start = None
+            return
+        now = time.perf_counter_ns()
+        self._lap_start = now
+        if self._frame_start is not None:
+            self._frame_totals["frame"] = (now - self._frame_start) / 1e6
+            for name, total in self._frame_totals.items():
+                self.samples[name].append(total)
+        self._frame_totals.clear()
+        self._frame_start = now
+        self._collect_gpu()
+        self.frame += 1
+
+    def stats(self, name="frame"):
+        """
+        Gets the mean and 50th, 95th and 99th percentile per-frame times in milliseconds
+        of the named scope over the recorded history, or None if it has no samples.
+        """
+        samples = self.samples.get(name)
+        if not samples:
+            return None
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return {"mean": float(np.mean(samples)), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+    def report_lines(self):
+        """
+        Gets one line of text per scope with its percentile times, frame time first.
+        """
+        names = sorted(self.samples, key=lambda name: (name != "frame", name))
+        width = max(map(len, names), default=5)
+        lines = [f"{'scope':<{width}} {'p50':>7} {'p95':>7} {'p99':>7} ms"]
+        for name in names:
+            stats = self.stats(name)
+            if stats is not None:
+                lines.append(f"{name:<{width}} {stats['p50']:7.2f} {stats['p95']:7.2f} {stats['p99']:7.2f}")
+        return lines
+
+    def export_chrome_trace(self, filename):
+        """
+        Writes the recorded scopes as a Chrome trace event JSON file.
+        """
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": 0, "tid": track, "args": {"name": name}}
+            for track, name in ((_CPU_TRACK, "CPU"), (_GPU_TRACK, "GPU"))
+        ]
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": metadata + list(self.events), "displayTimeUnit": "ms"}, f)
+
+    def _record(self, name, start_ns, end_ns, track):
+        self._frame_totals[name if track == _CPU_TRACK else "gpu:" + name] += (end_ns - start_ns) / 1e6
+        self.events.append({
+            "name": name,
+            "ph": "X",
+            "ts": (start_ns - self._origin) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": 0,
+            "tid": track,
+        })
+
+    def _timestamp(self):
+        """
+        Issues a GL_TIMESTAMP query and returns it.
+        """
+        if self._gpu_offset is None:
+            self._calibrate()
+        query = self._free_queries.pop() if self._free_queries else glGenQueries(1)[0]
+        glQueryCounter(query, GL_TIMESTAMP)
+        return query
+
+    def _calibrate(self):
+        query = glGenQueries(1)[0]
+        cpu_time = time.perf_counter_ns()
+        glQueryCounter(query, GL_TIMESTAMP)
+        self._gpu_offset = _query_result(query) - cpu_time
+        self._free_queries.append(query)
+
+    def _collect_gpu(self):
+        """
+        Records the GPU scopes of every finished frame. Queries complete in order, so
+        a frame is done once its last query is.
+        """
+        current_totals = self._frame_totals
+        while self._pending:
+            frame = self._pending[0][0]
+            count = 0
+            while count < len(self._pending) and self._pending[count][0] == frame:
+                count += 1
+            if not glGetQueryObjectiv(self._pending[count - 1][3], GL_QUERY_RESULT_AVAILABLE):
+                break
+            # _record adds to _frame_totals, which must be the finished frame's totals.
+            self._frame_totals = defaultdict(float)
+            for _ in range(count):
+                _, name, begin, end = self._pending.popleft()
+                start_ns = _query_result(begin) - self._gpu_offset
+                end_ns = _query_result(end) - self._gpu_offset
+                self._record(name, start_ns, end_ns, _GPU_TRACK)
+                self._free_queries += (begin, end)
+            for name, total in self._frame_totals.items():
+                self.samples[name].append(total)
+        self._frame_totals = current_totals
+
+
+def _query_result(query):
+    result = ctypes.c_uint64()
+    glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(result))
+    return result.value
+
+
+class ProfilerOverlay:
+    """
+    Draws a profiler's report_lines() as text in the top left corner of the window.
+    The text is re-rendered every `refresh` seconds, not every frame. Its program is
+    built by `shader_manager`, so it is cached and hot-reloaded like the others.
+    """
+
+    def __init__(self, profiler, shader_manager: ShaderManager, font_size=16, refresh=0.5):
+        import pygame
+
+        pygame.font.init()
+        self.profiler = profiler
+        self.font = pygame.font.SysFont("monospace", font_size)
+        self.refresh = refresh
+        self._updated = -refresh
+        self._size = (0, 0)
+
+        self.program = shader_manager.program("overlay.vert", "overlay.frag")
+        self.vao = glGenVertexArrays(1)
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def _update_texture(self):
+        import pygame
+
+        lines = self.profiler.report_lines()
+        height = self.font.get_linesize()
+        width = max(self.font.size(line)[0] for line in lines)
+        surface = pygame.Surface((width + 8, height * len(lines) + 8), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 160))
+        for i, line in enumerate(lines):
+            surface.blit(self.font.render(line, True, (255, 255, 255)), (4, 4 + i * height))
+        self._size = surface.get_size()
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexImage2D(
+            GL_TEXTURE_2D, 0, GL_RGBA, *self._size, 0, GL_RGBA, GL_UNSIGNED_BYTE,
+            pygame.image.tostring(surface, "RGBA", True),
+        )
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def draw(self):
+        """
+        Draws the overlay over everything, restoring the GL state it changes.
+        """
+        now = time.perf_counter()
+        if now - self._updated >= self.refresh:
+            self._updated = now
+            self._update_texture()
+        if self._size == (0, 0):
+            return
+
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        previous_program = glGetIntegerv(GL_CURRENT_PROGRAM)
+        depth_test = glIsEnabled(GL_DEPTH_TEST)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+
+        # The text's rectangle in normalized device coordinates: left, top, width, height.
+        width, height = self._size
+        glUseProgram(self.program)
+        # Looked up every draw, since a hot reload may move it.
+        glUniform4f(glGetUniformLocation(self.program, "rect"), -1, 1, 2 * width / viewport[2], 2 * height / viewport[3])
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+        glBindVertexArray(0)
+
+        glUseProgram(previous_program)
+        glDisable(GL_BLEND)
+        if depth_test:
+            glEnable(GL_DEPTH_TEST)
+
+
+# The profiler that the renderer and demo are instrumented with.
+profiler = Profiler()
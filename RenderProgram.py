@@ -1,58 +1,250 @@
 from OpenGL.GL import *
+from Culling import frustum_planes, objects_visible
+from Light import Light, MAX_OBJECT_LIGHTS, cull_lights, light_bounds, pack_lights
+from Material import DEFAULT_MATERIAL
 from Object3D import Object3D
+from Profiler import profiler
+from TransformStore import model_matrices
+from UniformBlocks import frame_block, lights_block
+from collections import Counter
 import glm
+import numpy as np
 
 
 class RenderProgram:
     """
     Encapsulates a shader program (vertex + fragment shaders) and its bound
     uniform values. Can render a list of objects with a given projection and view matrix.
+
+    Uniforms that belong to a shared uniform block (the camera state in Frame and the
+    lighting in Lights) are written to that block instead, and each block is uploaded
+    once whenever it changes, for every program at once.
+
+    Uniform locations are looked up once per shader program, and each program remembers
+    the values it was last sent, so start_program only uploads uniforms whose values have
+    changed since that program last ran.
+
+    The first time a program draws a mesh with a given VertexFormat, the format is
+    checked against the program's vertex attributes, so a layout mismatch raises
+    ValueError instead of drawing garbage.
+
+    Objects entirely outside the view frustum are skipped while `frustum_culling` is on.
+    `gl_calls` counts the GL calls issued, and `visibility` the objects drawn and culled,
+    since the last end_frame().
     """
 
     def __init__(self):
         self.uniforms = {}
+        self.shader_program = None
+        # Per shader program: {uniform name: location} for its active uniforms, and
+        # {uniform name: value} as of the last upload.
+        self.locations = {}
+        self.uploaded = {}
+        # The (program, VertexFormat) pairs already checked to match.
+        self.checked_formats = set()
+        self._bound_program = None
+        self.gl_calls = Counter()
+        self.frustum_culling = True
+        self.visibility = Counter()
+        self.frame_block = frame_block()
+        self.lights_block = lights_block()
+        self.blocks = [self.frame_block, self.lights_block]
+        self.lights = []
+        self._light_positions, self._light_ranges = light_bounds([])
 
     def use_program(self, program):
         self.shader_program = program
-        glUseProgram(self.shader_program)
+        if program not in self.locations:
+            self._resolve_locations(program)
+        self._bind(program)
+
+    def _bind(self, program):
+        if self._bound_program != program:
+            glUseProgram(program)
+            self._bound_program = program
+            self.gl_calls["glUseProgram"] += 1
+
+    def _resolve_locations(self, program):
+        """
+        Caches the location of every active uniform of a newly linked program.
+        """
+        for block in self.blocks:
+            block.bind_program(program)
+
+        locations = {}
+        for i in range(glGetProgramiv(program, GL_ACTIVE_UNIFORMS)):
+            name = glGetActiveUniform(program, i)[0].decode()
+            # Arrays are reported as "name[0]"; set_uniform uses the plain name.
+            name = name.removesuffix("[0]")
+            location = glGetUniformLocation(program, name)
+            self.gl_calls["glGetUniformLocation"] += 1
+            # Members of uniform blocks are active uniforms without a location.
+            if location != -1:
+                locations[name] = location
+        self.locations[program] = locations
+        self.uploaded[program] = {}
+
+    def forget_program(self, program):
+        """
+        Drops the cached locations and values of a deleted or relinked program.
+        """
+        self.locations.pop(program, None)
+        self.uploaded.pop(program, None)
+        self.checked_formats = {pair for pair in self.checked_formats if pair[0] != program}
+        if self._bound_program == program:
+            self._bound_program = None
+
+    def delete(self):
+        """
+        Deletes the renderer's uniform buffers and unbinds its program, leaving the GL
+        state as it was before the renderer drew anything.
+        """
+        for block in self.blocks:
+            block.delete()
+        glUseProgram(0)
+        self._bound_program = None
+
+    def check_vertex_format(self, mesh):
+        """
+        Checks, once per program and vertex format, that the current program reads the
+        mesh's vertex attributes where the mesh puts them.
+        """
+        pair = (self.shader_program, mesh.vertex_format)
+        if pair not in self.checked_formats:
+            mesh.check_program(self.shader_program)
+            self.checked_formats.add(pair)
 
     def set_uniform(self, name:str, value, value_type):
         """
         Saves a value to assign to the given uniform name when the program runs.
         """
+        for block in self.blocks:
+            if name in block:
+                block[name] = value
+                return
         self.uniforms[name] = (value, value_type)
 
+    def set_lights(self, lights: list[Light]):
+        """
+        Sets the lights of the scene. Call this again whenever a light changes.
+        """
+        self.lights = list(lights)
+        positions, directions, colors, attenuations = pack_lights(self.lights)
+        self.lights_block["lightPositions"] = positions
+        self.lights_block["lightDirections"] = directions
+        self.lights_block["lightColors"] = colors
+        self.lights_block["lightAttenuations"] = attenuations
+        self._light_positions, self._light_ranges = light_bounds(self.lights)
+
+    def _set_object_lights(self, indexes):
+        """
+        Tells the lighting shaders which of the scene's lights to evaluate.
+        """
+        padded = tuple(indexes) + (0,) * (MAX_OBJECT_LIGHTS - len(indexes))
+        self.set_uniform("lightIndices", padded, list[int])
+        self.set_uniform("lightCount", len(indexes), int)
+
     def start_program(self):
-        glUseProgram(self.shader_program)
-        for name in self.uniforms:
-            value, value_type = self.uniforms[name]
-            if value_type == glm.mat4:
-                glUniformMatrix4fv(
-                    glGetUniformLocation(self.shader_program, name),
-                    1,
-                    GL_FALSE,
-                    value,
-                )
-            elif value_type == glm.vec4:
-                glUniform4f(
-                    glGetUniformLocation(self.shader_program, name),
-                    value[0], value[1], value[2], value[3]
-                )
-            elif value_type == glm.vec3:
-                glUniform3f(
-                    glGetUniformLocation(self.shader_program, name),
-                    value[0], value[1], value[2]
-                )
-            elif value_type == float:
-                glUniform1f(
-                    glGetUniformLocation(self.shader_program, name),
-                    value
-                )
-            elif value_type == int:
-                glUniform1i(
-                    glGetUniformLocation(self.shader_program, name),
-                    value
-                )
+        with profiler.scope("RenderProgram.start_program"):
+            self._bind(self.shader_program)
+            for block in self.blocks:
+                if block.upload():
+                    self.gl_calls["glBufferSubData"] += 1
+
+            locations = self.locations[self.shader_program]
+            uploaded = self.uploaded[self.shader_program]
+            for name in self.uniforms:
+                location = locations.get(name)
+                if location is None:
+                    # The program doesn't use this uniform.
+                    continue
+                value, value_type = self.uniforms[name]
+                if name in uploaded and uploaded[name] == value:
+                    continue
+                uploaded[name] = _snapshot(value)
+                self.gl_calls["glUniform"] += 1
+
+                if value_type == glm.mat4:
+                    if isinstance(value, glm.mat4):
+                        value = glm.value_ptr(value)
+                    glUniformMatrix4fv(location, 1, GL_FALSE, value)
+                elif value_type == glm.vec4:
+                    glUniform4f(location, value[0], value[1], value[2], value[3])
+                elif value_type == glm.vec3:
+                    glUniform3f(location, value[0], value[1], value[2])
+                elif value_type == float:
+                    glUniform1f(location, value)
+                elif value_type == int:
+                    glUniform1i(location, value)
+                elif value_type == list[int]:
+                    glUniform1iv(location, len(value), value)
+
+    def end_frame(self):
+        """
+        Returns the GL call counts and the "visible" and "culled" object counts for the
+        frame that just ended, and starts new counts.
+        """
+        counts = self.gl_calls + self.visibility
+        self.gl_calls = Counter()
+        self.visibility = Counter()
+        return counts
+
+    def cull(self, projection_matrix: glm.mat4, view_matrix: glm.mat4, objects: list[Object3D]):
+        """
+        Gets the objects that are at least partly inside the view frustum, testing all of
+        their bounding boxes at once.
+        """
+        if not self.frustum_culling:
+            return objects
+        planes = frustum_planes(projection_matrix, view_matrix)
+        visible = objects_visible(planes, objects)
+        self.count_visibility(visible)
+        return [o for o, v in zip(objects, visible) if v]
+
+    def count_visibility(self, visible):
+        """
+        Adds a boolean visibility mask to this frame's visible and culled counts.
+        """
+        drawn = int(np.count_nonzero(visible))
+        self.visibility["visible"] += drawn
+        self.visibility["culled"] += len(visible) - drawn
+
+    def set_camera(self, projection_matrix: glm.mat4, view_matrix: glm.mat4):
+        """
+        Sets the projection and view matrices for the following draws.
+        """
+        # Set uniform values for the projection and view matrices.
+        self.set_uniform("projection", projection_matrix, glm.mat4)
+        self.set_uniform("view", view_matrix, glm.mat4)
+
+        # Set the camera position uniform value
+        camera_position = (0.0, 0.0, 0.0)
+        self.set_uniform("cameraPosition", camera_position, glm.vec3)
+
+    def set_object(self, model_matrix: glm.mat4, bounding_sphere):
+        """
+        Sets the uniforms for drawing one object with the current program: its model
+        matrix and, for lighting shaders, the lights that reach its (center, radius)
+        bounding sphere.
+        """
+        self.set_uniform("model", model_matrix, glm.mat4)
+        # Only lighting shaders need to know which lights reach each object.
+        if "lightCount" in self.locations[self.shader_program]:
+            center, radius = bounding_sphere
+            self._set_object_lights(
+                cull_lights(self._light_positions, self._light_ranges, center, radius)
+            )
+
+    def set_material(self, material):
+        """
+        Sets the material uniforms of the lighting shaders for the following draws, or
+        resets them to the defaults if `material` is None.
+        """
+        if material is None:
+            material = DEFAULT_MATERIAL
+        self.set_uniform("materialDiffuse", material.diffuse, glm.vec3)
+        self.set_uniform("materialSpecular", material.specular, glm.vec3)
+        self.set_uniform("shininess", material.shininess, float)
 
     def render(
         self,
@@ -63,20 +255,84 @@ class RenderProgram:
         """
         Renders each of the given objects using the given projection and view matrices.
         """
+        with profiler.scope("RenderProgram.render"):
+            self.set_camera(projection_matrix, view_matrix)
 
-        # Set uniform values for the projection and view matrices.
-        self.set_uniform("projection", glm.value_ptr(projection_matrix), glm.mat4)
-        self.set_uniform("view", glm.value_ptr(view_matrix), glm.mat4)
+            # Iterate the list to draw.
+            for o in self.cull(projection_matrix, view_matrix, objects):
+                self.check_vertex_format(o.mesh)
+                # Set uniforms for this object's model matrix and lights.
+                self.set_object(o.mesh.model_matrix(o.get_model_matrix()), o.get_bounding_sphere())
+                for submesh in o.mesh.submeshes:
+                    # Initialize the shader programs with the bound uniform values.
+                    self.set_material(submesh.material)
+                    self.start_program()
+                    # Draw the object's part with this material.
+                    o.mesh.draw(submesh=submesh)
+                    self.gl_calls["glDrawElements"] += 1
+
+    def render_instanced(
+        self,
+        projection_matrix: glm.mat4,
+        view_matrix: glm.mat4,
+        objects: list[Object3D],
+        texture_array=None,
+    ):
+        """
+        Renders the given objects like render(), but with one instanced draw per distinct
+        mesh. The current program must take its model matrix from the per-instance
+        attribute, as normal_perspective.vert does with INSTANCED defined. Lights are
+        not culled per instance: every instance is lit by the first MAX_OBJECT_LIGHTS
+        lights.
+
+        With a TextureArray, every object is drawn with its texture_layer of the array
+        instead of its mesh's textures, so objects drawing the same mesh share one draw
+        whatever their textures. The program must then take the layer from the
+        per-instance attribute too, as it does with TEXTURE_ARRAY also defined.
+        """
+        with profiler.scope("RenderProgram.render_instanced"):
+            self.set_camera(projection_matrix, view_matrix)
+            self._set_object_lights(range(min(len(self.lights), MAX_OBJECT_LIGHTS)))
+
+            # Group the visible objects by the mesh they draw, keeping first-seen order.
+            groups = {}
+            for o in self.cull(projection_matrix, view_matrix, objects):
+                groups.setdefault(id(o.mesh), []).append(o)
+
+            if texture_array is not None:
+                texture_array.bind()
+            for group in groups.values():
+                mesh = group[0].mesh
+                self.check_vertex_format(mesh)
+                # The column-major model matrices, straight from the transform store.
+                layers = None
+                if texture_array is not None:
+                    layers = np.array([o.texture_layer for o in group], dtype=np.float32)
+                mesh.upload_instances(model_matrices(group), layers)
+                for submesh in mesh.submeshes:
+                    self.set_material(submesh.material)
+                    self.start_program()
+                    texture = mesh.submesh_texture(submesh)
+                    if texture is not None and texture_array is None:
+                        glBindTexture(GL_TEXTURE_2D, texture)
+                    mesh.draw_instances(len(group), submesh=submesh)
+                    self.gl_calls["glDrawElementsInstanced"] += 1
+                glBindVertexArray(0)
+
+
+def _snapshot(value):
+    """
+    Copies a uniform value so that later in-place changes to it are noticed. Values that
+    can't be compared (such as raw glm.value_ptr pointers) compare unequal to everything,
+    so they are always re-sent.
+    """
+    if isinstance(value, (glm.mat4, glm.vec4, glm.vec3)):
+        return type(value)(value)
+    if isinstance(value, (int, float, tuple)):
+        return value
+    return _AlwaysChanged()
 
-        # Set the camera position uniform value
-        camera_position = (0.0, 0.0, 0.0)
-        self.set_uniform("cameraPosition", camera_position, glm.vec3)
 
-        # Iterate the list to draw.
-        for o in objects:
-            # Set uniform for this object's model matrix.
-            self.set_uniform("model", glm.value_ptr(o.get_model_matrix()), glm.mat4)
-            # Initialize the shader programs with the bound uniform values.
-            self.start_program()
-            # Draw the object.
-            o.draw()
+class _AlwaysChanged:
+    def __eq__(self, other):
+        return False
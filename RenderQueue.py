@@ -0,0 +1,102 @@
+from OpenGL.GL import *
+from collections import Counter
+import glm
+import numpy as np
+
+from Culling import frustum_planes, spheres_visible
+from Object3D import Object3D
+from Profiler import profiler
+from RenderProgram import RenderProgram
+
+# Bits of the sort key given to each of (program, texture, VAO), most significant first.
+_KEY_BITS = 20
+_KEY_MASK = (1 << _KEY_BITS) - 1
+
+
+class RenderQueue:
+    """
+    Collects the draws of a frame, then issues them sorted by shader program, texture and
+    VAO, so that each of those is only bound when it differs from the previous draw's.
+    `switches` counts program, texture and VAO changes and draws since the last
+    end_frame().
+    """
+
+    def __init__(self, renderer: RenderProgram):
+        self.renderer = renderer
+        self.items = []
+        self.switches = Counter()
+
+    def submit(self, program, mesh, model_matrix: glm.mat4, bounding_sphere, texture=None):
+        """
+        Queues one draw of `mesh` with `program`. `texture` defaults to the mesh's own,
+        and is used for the submeshes whose materials have no texture of their own.
+        """
+        if texture is None:
+            texture = mesh.texture
+        key = (
+            (int(program) & _KEY_MASK) << (2 * _KEY_BITS)
+            | (int(texture or 0) & _KEY_MASK) << _KEY_BITS
+            | (int(mesh.vao) & _KEY_MASK)
+        )
+        self.items.append((key, program, mesh, texture, model_matrix, bounding_sphere))
+
+    def submit_object(self, program, o: Object3D):
+        """
+        Queues one draw of the given object with `program`.
+        """
+        self.submit(program, o.mesh, o.get_model_matrix(), o.get_bounding_sphere())
+
+    def flush(self, projection_matrix: glm.mat4, view_matrix: glm.mat4):
+        """
+        Draws everything submitted since the last flush that is inside the view frustum,
+        in state order.
+        """
+        with profiler.scope("RenderQueue.flush"):
+            renderer = self.renderer
+            renderer.set_camera(projection_matrix, view_matrix)
+            if renderer.frustum_culling and self.items:
+                # Test every queued bounding sphere against the frustum at once.
+                planes = frustum_planes(projection_matrix, view_matrix)
+                centers = np.array([item[5][0] for item in self.items], dtype=np.float32)
+                radii = np.array([item[5][1] for item in self.items], dtype=np.float32)
+                visible = spheres_visible(planes, centers, radii)
+                renderer.count_visibility(visible)
+                self.items = [item for item, v in zip(self.items, visible) if v]
+
+            # The sort is stable, so draws with the same state stay in submission order.
+            self.items.sort(key=lambda item: item[0])
+
+            program = vao = texture = None
+            for _, item_program, mesh, item_texture, model_matrix, bounding_sphere in self.items:
+                if item_program != program:
+                    program = item_program
+                    renderer.use_program(program)
+                    self.switches["program"] += 1
+                if mesh.vao != vao:
+                    vao = mesh.vao
+                    glBindVertexArray(vao)
+                    self.switches["vao"] += 1
+
+                renderer.check_vertex_format(mesh)
+                renderer.set_object(mesh.model_matrix(model_matrix), bounding_sphere)
+                for submesh in mesh.submeshes:
+                    submesh_texture = mesh.submesh_texture(submesh, item_texture)
+                    if submesh_texture is not None and submesh_texture != texture:
+                        texture = submesh_texture
+                        glBindTexture(GL_TEXTURE_2D, texture)
+                        self.switches["texture"] += 1
+                    renderer.set_material(submesh.material)
+                    renderer.start_program()
+                    mesh.draw_elements(submesh=submesh)
+                    renderer.gl_calls["glDrawElements"] += 1
+                    self.switches["draw"] += 1
+
+            glBindVertexArray(0)
+            self.items.clear()
+
+    def end_frame(self):
+        """
+        Returns the state switch counts for the frame that just ended, and starts a new count.
+        """
+        switches, self.switches = self.switches, Counter()
+        return switches
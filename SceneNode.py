@@ -0,0 +1,130 @@
+import glm
+
+from TransformStore import claim_row, default_store
+
+
+def _transform_property(array_name, doc):
+    """
+    A glm.vec3 property backed by the node's row of one of its store's arrays. Reading
+    returns a copy, so change a transform by assigning it (or with move, rotate, ...).
+    """
+
+    def get(self):
+        return glm.vec3(getattr(self.store, array_name)[self.row])
+
+    def set(self, value: glm.vec3):
+        getattr(self.store, array_name)[self.row] = value
+        self.store.mark_dirty(self.row)
+
+    return property(get, set, doc=doc)
+
+
+class SceneNode:
+    """
+    A node in a transform hierarchy, with a position, orientation (yaw/pitch/roll) and
+    scale around a center point, relative to its parent node.
+
+    The transform itself lives in a row of a TransformStore (the shared default one
+    unless another is given). Changing it only marks the row dirty; the next
+    get_model_matrix() call brings every dirty row of the store, and the rows below
+    them in the hierarchy, up to date in one batch. So moving and rotating nodes several
+    times per frame costs one vectorized rebuild per frame.
+    """
+
+    position = _transform_property("positions", "The node's position relative to its parent.")
+    orientation = _transform_property("orientations", "The node's (pitch, yaw, roll) in radians.")
+    scale = _transform_property("scales", "The node's scale along x, y and z.")
+    center = _transform_property("centers", "The point the node rotates and scales around.")
+
+    def __init__(
+        self,
+        position: glm.vec3 = glm.vec3(0.0, 0.0, 0.0),
+        orientation: glm.vec3 = glm.vec3(0.0, 0.0, 0.0),
+        scale: glm.vec3 = glm.vec3(1.0, 1.0, 1.0),
+        center: glm.vec3 = glm.vec3(0, 0, 0),
+        store=None,
+    ):
+        self.store = store if store is not None else default_store
+        self.row = claim_row(self, self.store, position, orientation, scale, center)
+        self.parent = None
+        self.children = []
+        self._matrix = None
+        self._matrix_version = -1
+
+    def move(self, offset: glm.vec3):
+        """
+        Moves the node along the given vector.
+        """
+        store, row = self.store, self.row
+        # Assigning a glm result is quicker than NumPy's in-place + with a glm.vec3.
+        store.positions[row] = glm.vec3(store.positions[row]) + offset
+        store.mark_dirty(row)
+
+    def rotate(self, rot: glm.vec3):
+        """
+        Adds the given yaw,pitch,roll values to the node's current orientation.
+        """
+        store, row = self.store, self.row
+        store.orientations[row] = glm.vec3(store.orientations[row]) + rot
+        store.mark_dirty(row)
+
+    def grow(self, sc: glm.vec3):
+        """
+        Multiplies the node's current scale by the given x,y,z scale values.
+        """
+        store, row = self.store, self.row
+        store.scales[row] = glm.vec3(store.scales[row]) * sc
+        store.mark_dirty(row)
+
+    def center_point(self, center: glm.vec3):
+        self.center = center
+
+    def get_position(self):
+        return self.position
+
+    def add_child(self, child: "SceneNode"):
+        """
+        Attaches `child` below this node, detaching it from any previous parent. Its
+        transform becomes relative to this node's.
+        """
+        if child.store is not self.store:
+            raise ValueError("a node's children must share its TransformStore")
+        node = self
+        while node is not None:
+            if node is child:
+                raise ValueError("a node can't be attached below itself")
+            node = node.parent
+        if child.parent is not None:
+            child.parent.remove_child(child)
+        child.parent = self
+        self.children.append(child)
+        child._update_depths()
+
+    def remove_child(self, child: "SceneNode"):
+        self.children.remove(child)
+        child.parent = None
+        child._update_depths()
+
+    def _update_depths(self):
+        self.store.set_parent(self.row, -1 if self.parent is None else self.parent.row)
+        for child in self.children:
+            child._update_depths()
+
+    def get_local_matrix(self):
+        """
+        Gets the node's transformation relative to its parent.
+        """
+        self.store.update()
+        return glm.mat4.from_bytes(self.store.local[self.row].tobytes())
+
+    def get_model_matrix(self):
+        """
+        Retrieve the node's current Model (local to world) transformation matrix.
+        """
+        store = self.store
+        store.update()
+        if self._matrix_version != store.version:
+            # The stored block holds columns, as glm's bytes do.
+            self._matrix = glm.mat4.from_bytes(store.matrices[self.row].tobytes())
+            self._matrix_version = store.version
+        return self._matrix
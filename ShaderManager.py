@@ -0,0 +1,313 @@
+"""
+Compiles and links shader programs at most once each, keeps their linked binaries on
+disk, and reloads them when their source files change.
+
+A program is a vertex shader file, a fragment shader file and a set of #defines that
+picks a permutation of them (see the comment at the top of each shader), so variants
+such as lit and unlit, or instanced and not, don't each need a file of their own. The
+defines are written into the source after its #version line.
+
+Each shader stage is compiled once per distinct source text, so permutations that only
+differ in defines a stage doesn't use share its compiled stage, and each (vertex,
+fragment, defines) program is linked once. Linked programs are saved with
+glGetProgramBinary into a ".shadercache" directory next to the shaders, under a hash of
+their sources and the GL renderer and version:
+
+    magic (4 bytes) | binary format (4 bytes) | program binary
+
+On the next launch the program is created with glProgramBinary and nothing is
+compiled. A binary the driver rejects, say after a driver update, is rebuilt from
+source.
+
+poll() checks the source files for changes, at most every POLL_INTERVAL seconds, and
+relinks the programs that use a changed file in place, so their program names stay
+valid. A change that doesn't compile or link is printed and the old program is kept,
+so a typo in a shader being edited doesn't end the demo.
+"""
+import hashlib
+import os
+import re
+import struct
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+from OpenGL.error import GLError
+
+CACHE_DIRECTORY = ".shadercache"
+MAGIC = b"PRG1"
+# The magic and the driver's format of the program binary that follows.
+HEADER = struct.Struct("<4sI")
+
+# Seconds between checks of the source files in poll().
+POLL_INTERVAL = 0.5
+
+
+def preprocess(source, defines=()):
+    """
+    Writes (name, value) `defines` into GLSL source, after its #version line. Defines
+    the source never mentions are left out, so a stage that doesn't depend on them is
+    shared between permutations. A #line directive keeps compiler errors at the line
+    numbers of the file.
+    """
+    defines = [(name, value) for name, value in defines if re.search(rf"\b{re.escape(name)}\b", source)]
+    if not defines:
+        return source
+    lines = source.split("\n")
+    # #version must come before anything but comments and blank lines.
+    first = 0
+    if lines[0].lstrip().startswith("#version"):
+        first = 1
+    header = [f"#define {name} {value}".rstrip() for name, value in defines]
+    header.append(f"#line {first + 1}")
+    return "\n".join(lines[:first] + header + lines[first:])
+
+
+def _defines(defines):
+    """
+    Turns defines given as names or as {name: value} into sorted (name, value) pairs.
+    """
+    if isinstance(defines, dict):
+        pairs = defines.items()
+    else:
+        pairs = ((name, "") for name in defines)
+    return tuple(sorted((str(name), str(value)) for name, value in pairs))
+
+
+class _Program:
+    """
+    A linked program, the files and defines it was built from, and their sources as
+    last compiled.
+    """
+
+    def __init__(self, vertex, fragment, defines, program, sources):
+        self.vertex = vertex
+        self.fragment = fragment
+        self.defines = defines
+        self.program = program
+        self.sources = sources
+
+
+class ShaderManager:
+    """
+    Builds shader programs from the files in `directory`: see the module docstring.
+    Without `cache`, program binaries are neither read nor written. `defines` are
+    given to every program, under the program's own, such as Light.SHADER_DEFINES
+    for the lit shaders.
+
+    `counts` counts the stages "compiled", the programs "linked" and the programs
+    "loaded" from binaries.
+    """
+
+    def __init__(self, directory="shaders", cache=True, defines=()):
+        self.directory = directory
+        self.defines = _defines(defines)
+        self.cache_directory = os.path.join(directory, CACHE_DIRECTORY) if cache else None
+        # {(stage type, SHA-256 of the source): shader} for every stage compiled.
+        self._stages = {}
+        self._programs = {}
+        # {file name: modification time} of the sources as last read.
+        self._mtimes = {}
+        self._next_poll = 0.0
+        self._binaries_supported = None
+        self.counts = Counter()
+
+    def program(self, vertex, fragment, defines=()):
+        """
+        Gets the program linked from the given vertex and fragment shader files, named
+        relative to the manager's directory, with the given #defines: names, or
+        {name: value}. Raises shaders.ShaderCompilationError or RuntimeError if the
+        shaders don't compile or link.
+        """
+        defines = tuple(sorted({**dict(self.defines), **dict(_defines(defines))}.items()))
+        key = (vertex, fragment, defines)
+        entry = self._programs.get(key)
+        if entry is None:
+            sources = self._sources(vertex, fragment, defines)
+            program = self._load_binary(sources)
+            if program is None:
+                program = glCreateProgram()
+                try:
+                    self._link(program, sources)
+                except RuntimeError:
+                    glDeleteProgram(program)
+                    raise
+                self._save_binary(program, sources)
+            entry = self._programs[key] = _Program(vertex, fragment, defines, program, sources)
+        return entry.program
+
+    def _sources(self, vertex, fragment, defines):
+        """
+        Reads the vertex and fragment shader files, with the defines written in.
+        """
+        sources = []
+        for name in (vertex, fragment):
+            path = os.path.join(self.directory, name)
+            self._mtimes[name] = os.stat(path).st_mtime_ns
+            with open(path) as f:
+                sources.append(preprocess(f.read(), defines))
+        return tuple(sources)
+
+    def _stage(self, stage_type, source):
+        """
+        Gets the compiled shader for the given stage source, compiling it on first use.
+        """
+        key = (stage_type, hashlib.sha256(source.encode()).digest())
+        shader = self._stages.get(key)
+        if shader is None:
+            shader = self._stages[key] = shaders.compileShader(source, stage_type)
+            self.counts["compiled"] += 1
+        return shader
+
+    def _link(self, program, sources):
+        """
+        Links (or relinks) a program from vertex and fragment shader sources.
+        """
+        stages = [self._stage(GL_VERTEX_SHADER, sources[0]), self._stage(GL_FRAGMENT_SHADER, sources[1])]
+        for shader in stages:
+            glAttachShader(program, shader)
+        if self._supports_binaries():
+            glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(program)
+        # The compiled stages stay cached for other programs.
+        for shader in stages:
+            glDetachShader(program, shader)
+        if not glGetProgramiv(program, GL_LINK_STATUS):
+            raise RuntimeError(f"Link failure: {glGetProgramInfoLog(program)}")
+        self.counts["linked"] += 1
+
+    def _binary_path(self, sources):
+        sha = hashlib.sha256()
+        for text in (glGetString(GL_RENDERER), glGetString(GL_VERSION)) + tuple(s.encode() for s in sources):
+            sha.update(text)
+            sha.update(b"\0")
+        return os.path.join(self.cache_directory, sha.hexdigest() + ".bin")
+
+    def _supports_binaries(self):
+        if self.cache_directory is None:
+            return False
+        if self._binaries_supported is None:
+            # Drivers without the entry points, or without any binary format, get every
+            # program compiled.
+            self._binaries_supported = (
+                bool(glProgramBinary)
+                and bool(glGetProgramBinary)
+                and glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+            )
+        return self._binaries_supported
+
+    def _load_binary(self, sources):
+        """
+        Creates a program from the cached binary of the given sources, or returns None
+        if there is none or the driver rejects it.
+        """
+        if not self._supports_binaries():
+            return None
+        try:
+            with open(self._binary_path(sources), "rb") as f:
+                contents = f.read()
+        except FileNotFoundError:
+            return None
+        if len(contents) <= HEADER.size:
+            return None
+        magic, binary_format = HEADER.unpack_from(contents)
+        if magic != MAGIC:
+            return None
+        binary = np.frombuffer(contents, dtype=np.uint8, offset=HEADER.size)
+        program = glCreateProgram()
+        try:
+            # A format the driver no longer lists is an error rather than a failed link.
+            glProgramBinary(program, binary_format, binary, len(binary))
+        except GLError:
+            glDeleteProgram(program)
+            return None
+        if not glGetProgramiv(program, GL_LINK_STATUS):
+            glDeleteProgram(program)
+            return None
+        self.counts["loaded"] += 1
+        return program
+
+    def _save_binary(self, program, sources):
+        """
+        Writes the binary of a linked program to the cache, under a temporary name that
+        is then renamed, as TextureCache does.
+        """
+        if not self._supports_binaries():
+            return
+        length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        binary = np.empty(length, dtype=np.uint8)
+        written = GLsizei()
+        binary_format = GLenum()
+        glGetProgramBinary(program, length, written, binary_format, binary)
+        path = self._binary_path(sources)
+        os.makedirs(self.cache_directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, binary_format.value))
+            f.write(binary[:written.value].tobytes())
+        os.replace(temp_path, path)
+
+    def poll(self):
+        """
+        Relinks the programs whose source files have changed since they were built, if
+        POLL_INTERVAL has passed since the last check. Returns the programs relinked;
+        callers that cache per-program state (such as RenderProgram.forget_program)
+        should drop it for them.
+        """
+        now = time.perf_counter()
+        if now < self._next_poll:
+            return []
+        self._next_poll = now + POLL_INTERVAL
+        changed = set()
+        for name, mtime in self._mtimes.items():
+            try:
+                if os.stat(os.path.join(self.directory, name)).st_mtime_ns != mtime:
+                    changed.add(name)
+            except FileNotFoundError:
+                # Editors may replace a file by deleting it first; check it next time.
+                pass
+        reloaded = []
+        for entry in self._programs.values():
+            if (entry.vertex in changed or entry.fragment in changed) and self._reload(entry):
+                reloaded.append(entry.program)
+        return reloaded
+
+    def _reload(self, entry: _Program):
+        """
+        Rebuilds a program from its files in place, keeping the old program if the new
+        sources don't compile or link. Returns whether it was rebuilt.
+        """
+        try:
+            sources = self._sources(entry.vertex, entry.fragment, entry.defines)
+            if sources == entry.sources:
+                return False
+            # Link a scratch program first, since a failed link would break the old one.
+            scratch = glCreateProgram()
+            try:
+                self._link(scratch, sources)
+            finally:
+                glDeleteProgram(scratch)
+        except (OSError, RuntimeError) as error:
+            if isinstance(error, shaders.ShaderCompilationError):
+                # Leave out the sources, which follow the compiler's log.
+                error = error.args[0]
+            print(f"{entry.vertex} + {entry.fragment} {list(entry.defines)}: {error}")
+            return False
+        self._link(entry.program, sources)
+        entry.sources = sources
+        self._save_binary(entry.program, sources)
+        return True
+
+    def delete(self):
+        """
+        Deletes every program and compiled stage.
+        """
+        for entry in self._programs.values():
+            glDeleteProgram(entry.program)
+        for shader in self._stages.values():
+            glDeleteShader(shader)
+        self._programs = {}
+        self._stages = {}
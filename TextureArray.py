@@ -0,0 +1,113 @@
+"""
+Texture arrays: many textures in one GL_TEXTURE_2D_ARRAY, so that objects with
+different textures can be drawn without binding a texture between them.
+
+Every layer of an array has the same size, so each image is scaled to the array's
+square layer size and baked through TextureCache, which caches the scaled mip chain
+like any other. Layers keep their own texture coordinates and wrap on their own, so
+meshes whose UVs repeat past [0, 1] need no remapping, unlike in a 2D atlas, and mip
+levels never bleed between neighbouring textures.
+
+Shaders sample the array with a layer number as the third texture coordinate. For
+instanced draws it comes from a per-instance attribute (see Object3D.texture_layer
+and RenderProgram.render_instanced), so one glDrawElementsInstanced draws every copy of
+a mesh whatever its texture:
+
+    forest = TextureArray(["models/icon.png", "models/woodbox.png"])
+    tree.texture_layer = forest.layer("models/woodbox.png")
+    renderer.render_instanced(perspective, camera, trees, texture_array=forest)
+"""
+from OpenGL.GL import *
+import os
+
+import numpy as np
+
+import TextureCache
+
+# The width and height every layer is scaled to by default.
+LAYER_SIZE = 512
+
+
+def prepare_layers(filenames, size=LAYER_SIZE, texture_format="rgb") -> list[TextureCache.TextureData]:
+    """
+    Does the CPU side of building a texture array, without a GL context: gets each
+    image scaled to `size` x `size` and baked in `texture_format`.
+    """
+    return [TextureCache.load_texture(filename, texture_format, size=(size, size)) for filename in filenames]
+
+
+class TextureArray:
+    """
+    A GL_TEXTURE_2D_ARRAY holding one layer per image file, in the order given. Images
+    are scaled to `size` texels square and baked in `texture_format`; a compressed
+    format the GPU doesn't support falls back to the uncompressed one. `prepared` is
+    what prepare_layers returned for the same files, size and format, if it was
+    already called.
+    """
+
+    def __init__(self, filenames, size=LAYER_SIZE, texture_format="rgb", prepared=None):
+        if texture_format not in TextureCache.FORMATS:
+            raise ValueError(f"texture format must be one of {sorted(TextureCache.FORMATS)}, not {texture_format!r}")
+        self.filenames = list(filenames)
+        self.size = size
+        layers = prepared or prepare_layers(self.filenames, size, texture_format)
+        if not TextureCache.gl_supports(texture_format):
+            texture_format = TextureCache.UNCOMPRESSED_FORMATS[texture_format]
+            layers = prepare_layers(self.filenames, size, texture_format)
+        self.format = texture_format
+        self.nbytes = sum(layer.nbytes for layer in layers)
+        self.texture = TextureArray.upload(layers)
+        self._layers = {os.path.normpath(filename): i for i, filename in enumerate(self.filenames)}
+
+    def layer(self, filename):
+        """
+        Gets the layer number of the given image file, raising KeyError if it isn't in
+        the array.
+        """
+        return self._layers[os.path.normpath(filename)]
+
+    def bind(self):
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture)
+
+    def delete(self):
+        glDeleteTextures([self.texture])
+        self.texture = None
+
+    @staticmethod
+    def upload(layers):
+        """
+        Creates a GL_TEXTURE_2D_ARRAY from TextureDatas of the same size and format, one
+        layer each. Each mip level of every layer is uploaded in one call, since the
+        layers of a level are contiguous in the array's storage.
+        """
+        internal_format, compressed = layers[0].internal_format, layers[0].compressed
+        tex = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, tex)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_LEVEL, len(layers[0].levels) - 1)
+        # Rows of small RGB levels aren't a multiple of 4 bytes long.
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        for level, (width, height, _) in enumerate(layers[0].levels):
+            data = np.concatenate([layer.levels[level][2] for layer in layers])
+            if compressed:
+                # PyOpenGL passes the image size from the array.
+                glCompressedTexImage3D(GL_TEXTURE_2D_ARRAY, level, internal_format, width, height, len(layers), 0, data)
+            else:
+                glTexImage3D(
+                    GL_TEXTURE_2D_ARRAY,
+                    level,
+                    internal_format,
+                    width,
+                    height,
+                    len(layers),
+                    0,
+                    internal_format,
+                    GL_UNSIGNED_BYTE,
+                    data,
+                )
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+        return tex
@@ -0,0 +1,404 @@
+"""
+On-disk cache of baked textures.
+
+Decoding a PNG or JPEG and building its mipmaps is slow for large images, so each image
+is baked once into a binary file in a ".texcache" directory next to it:
+
+    header (64 bytes) | level table (24 bytes per level) | level data
+
+The header records the SHA-256 of the image file, the baker version, the texel format
+and the size limit the texture was baked with. Each level of the mip chain, from full
+size down to 1x1, is stored ready to upload: rows bottom first, as OpenGL expects. A
+cache file whose hash, version, format or size limit does not match is stale, and is
+rebuilt the next time the image is loaded. Fresh cache files are memory-mapped, so
+their levels go straight to Mesh3D.upload_mipmaps without being decoded or copied.
+
+Formats:
+
+- "rgb" and "rgba": 8 bits per channel, uncompressed.
+- "bc1" (DXT1): 4x4 blocks of two RGB565 colors and 2-bit indices, 8 bytes per block,
+  so 1/6 the memory of "rgb". Best for opaque color textures.
+- "bc3" (DXT5): "bc1" colors plus a block of two alpha values and 3-bit indices, 16
+  bytes per block, so 1/4 the memory of "rgba".
+
+The block encoders are NumPy: each block's endpoints are the ends of its colors along
+their principal axis, and each texel takes the nearest of the block's palette. The
+GPU must support GL_EXT_texture_compression_s3tc (see gl_supports), as desktop GPUs do.
+
+A `max_size` drops the mip levels larger than that many texels on a side, so big
+textures can be shrunk for lower memory use without editing the image files.
+
+Run this module to pre-bake every image in a directory:
+
+    python TextureCache.py models/
+    python TextureCache.py models/ --format bc1 --max-size 1024
+"""
+import argparse
+import hashlib
+import os
+import struct
+import threading
+
+import numpy as np
+import pygame
+from OpenGL.GL import GL_EXTENSIONS, GL_NUM_EXTENSIONS, GL_RGB, GL_RGBA, glGetIntegerv, glGetStringi
+from OpenGL.GL.EXT.texture_compression_s3tc import (
+    GL_COMPRESSED_RGB_S3TC_DXT1_EXT,
+    GL_COMPRESSED_RGBA_S3TC_DXT5_EXT,
+)
+
+# Bump whenever baking changes its output, so cached textures get rebuilt.
+BAKER_VERSION = 1
+
+CACHE_DIRECTORY = ".texcache"
+MAGIC = b"TEX1"
+# magic, baker version, format number, max size (0 for none), image SHA-256, width,
+# height, level count.
+HEADER = struct.Struct("<4sIII32sIII")
+HEADER_SIZE = 64
+# width, height, byte offset and byte size of each level.
+LEVEL = struct.Struct("<IIQQ")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tga")
+
+# Each format's number in the header, GL internal format, source channels, bytes per
+# texel (uncompressed) or per 4x4 block (compressed), and whether it is compressed.
+FORMATS = {
+    "rgb": (1, GL_RGB, 3, 3, False),
+    "rgba": (2, GL_RGBA, 4, 4, False),
+    "bc1": (3, GL_COMPRESSED_RGB_S3TC_DXT1_EXT, 3, 8, True),
+    "bc3": (4, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT, 4, 16, True),
+}
+
+# The uncompressed format to fall back to for each compressed one the GPU can't use.
+UNCOMPRESSED_FORMATS = {"bc1": "rgb", "bc3": "rgba"}
+
+
+class TextureData:
+    """
+    A baked texture: its format name (a key of FORMATS) and its mip levels, as
+    (width, height, uint8 array) from full size down to 1x1.
+    """
+
+    def __init__(self, texture_format, levels):
+        self.format = texture_format
+        self.levels = levels
+
+    @property
+    def width(self):
+        return self.levels[0][0]
+
+    @property
+    def height(self):
+        return self.levels[0][1]
+
+    @property
+    def internal_format(self):
+        return FORMATS[self.format][1]
+
+    @property
+    def compressed(self):
+        return FORMATS[self.format][4]
+
+    @property
+    def nbytes(self):
+        """
+        The GPU memory the texture takes, every level included.
+        """
+        return sum(data.nbytes for _, _, data in self.levels)
+
+
+def cache_path(image_filename, texture_format="rgb", max_size=None, size=None):
+    """
+    Gets the path of the cache file for the given image, format, size limit and
+    (width, height) the image is scaled to, if any.
+    """
+    directory, name = os.path.split(image_filename)
+    suffix = f".{texture_format}.{max_size}.tex" if max_size else f".{texture_format}.tex"
+    if size is not None:
+        suffix = f".{size[0]}x{size[1]}{suffix}"
+    return os.path.join(directory, CACHE_DIRECTORY, name + suffix)
+
+
+def load_texture(image_filename, texture_format="rgb", max_size=None, size=None) -> TextureData:
+    """
+    Gets the baked TextureData for the given image file, from the cache if it is fresh,
+    otherwise by decoding and baking the image and writing a new cache file. With a
+    (width, height) `size`, the image is scaled to that size before baking.
+    """
+    if texture_format not in FORMATS:
+        raise ValueError(f"texture format must be one of {sorted(FORMATS)}, not {texture_format!r}")
+    digest = _file_digest(image_filename)
+    path = cache_path(image_filename, texture_format, max_size, size)
+    cached = _read(path, digest, texture_format, max_size, size)
+    if cached is not None:
+        return cached
+    data = bake_image(image_filename, texture_format, max_size, size)
+    _write(path, digest, data, max_size)
+    return data
+
+
+def bake_image(image_filename, texture_format="rgb", max_size=None, size=None) -> TextureData:
+    """
+    Decodes an image and builds its mip chain in the given format, without the
+    levels larger than `max_size` texels on a side. With a (width, height) `size`, the
+    image is first scaled to that size.
+    """
+    channels = FORMATS[texture_format][2]
+    image = pygame.image.load(image_filename)
+    if size is not None and image.get_size() != tuple(size):
+        # smoothscale only takes 24 and 32-bit images.
+        scale = pygame.transform.smoothscale if image.get_bitsize() >= 24 else pygame.transform.scale
+        image = scale(image, size)
+    pixels = np.frombuffer(
+        pygame.image.tostring(image, "RGB" if channels == 3 else "RGBA", True), dtype=np.uint8
+    ).reshape(image.get_height(), image.get_width(), channels)
+
+    levels = []
+    texels = pixels.astype(np.float32)
+    while True:
+        height, width = texels.shape[:2]
+        if max_size is None or max(width, height) <= max_size:
+            level = np.clip(np.rint(texels), 0, 255).astype(np.uint8)
+            if texture_format == "bc1":
+                level = encode_bc1(level)
+            elif texture_format == "bc3":
+                level = encode_bc3(level)
+            levels.append((width, height, level.reshape(-1)))
+        if width == 1 and height == 1:
+            return TextureData(texture_format, levels)
+        texels = _downsample(_downsample(texels, 0), 1)
+
+
+def _downsample(texels, axis):
+    """
+    Halves an image along one axis (rounding down, to at least 1) with a box filter,
+    or, for odd sizes, a 3-tap tent filter so no texel is skipped.
+    """
+    size = texels.shape[axis]
+    if size == 1:
+        return texels
+    half = size // 2
+    take = lambda start: np.take(texels, np.arange(start, start + 2 * half, 2), axis=axis)
+    if size % 2 == 0:
+        return (take(0) + take(1)) / 2
+    return take(0) * 0.25 + take(1) * 0.5 + take(2) * 0.25
+
+
+def _blocks(texels):
+    """
+    Splits an (h, w, c) image into 4x4 blocks, repeating its last row and column to fill
+    the blocks at the edges. Returns an (n, 16, c) float32 array, blocks in row order.
+    """
+    height, width, channels = texels.shape
+    padded = np.pad(texels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="edge")
+    rows, columns = padded.shape[0] // 4, padded.shape[1] // 4
+    blocks = padded.reshape(rows, 4, columns, 4, channels).swapaxes(1, 2)
+    return blocks.reshape(-1, 16, channels).astype(np.float32)
+
+
+def encode_bc1(texels):
+    """
+    Compresses an (h, w, 3) or (h, w, 4) uint8 image to BC1 blocks (alpha is ignored).
+    Returns a uint8 array of 8 bytes per block.
+    """
+    return _encode_colors(_blocks(texels)[:, :, :3]).view(np.uint8).reshape(-1)
+
+
+def encode_bc3(texels):
+    """
+    Compresses an (h, w, 4) uint8 image to BC3 blocks. Returns a uint8 array of 16 bytes
+    per block: the alpha block, then the color block.
+    """
+    blocks = _blocks(texels)
+    alpha = _encode_alpha(blocks[:, :, 3]).view(np.uint8).reshape(-1, 8)
+    colors = _encode_colors(blocks[:, :, :3]).view(np.uint8).reshape(-1, 8)
+    return np.concatenate([alpha, colors], axis=1).reshape(-1)
+
+
+def _encode_colors(blocks):
+    """
+    Encodes (n, 16, 3) blocks of colors as BC1 blocks, as an (n, 2) uint32 array: the
+    two RGB565 endpoints, then sixteen 2-bit palette indices.
+    """
+    # Channels first, so the reductions over each block's texels run along rows.
+    texels = np.ascontiguousarray(blocks.transpose(0, 2, 1))
+    mean = texels.mean(axis=2)
+    centered = texels - mean[:, :, None]
+    # The principal axis of each block's colors, by power iteration on its covariance.
+    covariance = centered @ centered.transpose(0, 2, 1)
+    axis = texels.max(axis=2) - texels.min(axis=2) + 1e-3
+    for _ in range(8):
+        axis = (covariance @ axis[:, :, None])[:, :, 0]
+        axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+    projections = (axis[:, None, :] @ centered)[:, 0, :]
+    high = mean + axis * projections.max(axis=1, keepdims=True)
+    low = mean + axis * projections.min(axis=1, keepdims=True)
+
+    color0, color1 = _to_565(high), _to_565(low)
+    # color0 > color1 selects the four-color palette, so swap endpoints that aren't.
+    swap = color0 < color1
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+    end0, end1 = _from_565(color0), _from_565(color1)
+    # The palette lies on the line between the endpoints, so the nearest entry to a
+    # texel is the nearest to its projection on that line: thirds of the way from end1
+    # (palette index 1) through indices 3 and 2 to end0 (index 0).
+    direction = end0 - end1
+    along = (direction[:, None, :] @ (texels - end1[:, :, None]))[:, 0, :]
+    along /= np.maximum((direction * direction).sum(axis=1), 1e-12)[:, None]
+    thirds = np.clip(np.rint(along * 3), 0, 3).astype(np.intp)
+    indices = np.array([1, 3, 2, 0], dtype=np.uint32)[thirds]
+    # Blocks of one color have color0 == color1, which is the three-color mode, so
+    # every texel must use the first endpoint.
+    indices[color0 == color1] = 0
+    packed = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+    return np.stack([color0.astype(np.uint32) | color1.astype(np.uint32) << 16, packed], axis=1)
+
+
+def _encode_alpha(alpha):
+    """
+    Encodes (n, 16) blocks of alpha values as BC3 alpha blocks, as an (n,) uint64
+    array: the two endpoints, then sixteen 3-bit palette indices.
+    """
+    alpha0 = alpha.max(axis=1).round()
+    alpha1 = alpha.min(axis=1).round()
+    # With alpha0 > alpha1, index 0 is alpha0, 1 is alpha1, and 2-7 blend from one to
+    # the other in sevenths.
+    weights = np.array([0, 7, 1, 2, 3, 4, 5, 6]) / 7
+    palette = alpha0[:, None] * (1 - weights) + alpha1[:, None] * weights
+    indices = np.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=2).astype(np.uint64)
+    indices[alpha0 == alpha1] = 0
+    packed = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    return alpha0.astype(np.uint64) | alpha1.astype(np.uint64) << np.uint64(8) | packed << np.uint64(16)
+
+
+def _to_565(colors):
+    """
+    Rounds (n, 3) colors in [0, 255] to RGB565.
+    """
+    colors = np.clip(colors, 0, 255)
+    red = np.rint(colors[:, 0] * 31 / 255).astype(np.uint16)
+    green = np.rint(colors[:, 1] * 63 / 255).astype(np.uint16)
+    blue = np.rint(colors[:, 2] * 31 / 255).astype(np.uint16)
+    return red << 11 | green << 5 | blue
+
+
+def _from_565(colors):
+    """
+    Expands RGB565 colors back to (n, 3) floats in [0, 255], as the GPU does.
+    """
+    colors = colors.astype(np.uint32)
+    return np.stack(
+        [(colors >> 11 & 31) * 255 / 31, (colors >> 5 & 63) * 255 / 63, (colors & 31) * 255 / 31], axis=1
+    ).astype(np.float32)
+
+
+def gl_supports(texture_format):
+    """
+    Checks whether the current OpenGL context can upload textures in the given format.
+    """
+    if not FORMATS[texture_format][4]:
+        return True
+    extensions = {
+        glGetStringi(GL_EXTENSIONS, i).decode() for i in range(glGetIntegerv(GL_NUM_EXTENSIONS))
+    }
+    return "GL_EXT_texture_compression_s3tc" in extensions
+
+
+def _file_digest(filename):
+    """
+    Gets the SHA-256 of a file, reading it a chunk at a time.
+    """
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.digest()
+
+
+def _read(path, digest, texture_format, max_size, size=None):
+    """
+    Memory-maps the levels of the given cache file into a TextureData, or returns None
+    if the file is missing or was not baked from the same image contents, by the same
+    baker version, in the same format and size limit, and to the same `size`.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+            magic, version, number, cached_max_size, cached_digest, width, height, level_count = HEADER.unpack_from(
+                header.ljust(HEADER_SIZE, b"\0")
+            )
+            table = f.read(LEVEL.size * level_count)
+    except FileNotFoundError:
+        return None
+    if magic != MAGIC or version != BAKER_VERSION or cached_digest != digest:
+        return None
+    if number != FORMATS[texture_format][0] or cached_max_size != (max_size or 0):
+        return None
+    if size is not None and (width, height) != tuple(size):
+        return None
+    if len(table) != LEVEL.size * level_count:
+        return None
+
+    end = HEADER_SIZE + len(table)
+    entries = [LEVEL.unpack_from(table, i * LEVEL.size) for i in range(level_count)]
+    end += sum(size for _, _, _, size in entries)
+    if level_count == 0 or os.path.getsize(path) != end:
+        return None
+    contents = np.memmap(path, dtype=np.uint8, mode="r")
+    levels = [(width, height, contents[offset:offset + size]) for width, height, offset, size in entries]
+    return TextureData(texture_format, levels)
+
+
+def _write(path, digest, data, max_size=None):
+    """
+    Writes a cache file for the given TextureData, under a temporary name that is then
+    renamed, as MeshCache does.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = HEADER.pack(
+        MAGIC,
+        BAKER_VERSION,
+        FORMATS[data.format][0],
+        max_size or 0,
+        digest,
+        data.width,
+        data.height,
+        len(data.levels),
+    )
+    offset = HEADER_SIZE + LEVEL.size * len(data.levels)
+    table = b""
+    for width, height, level in data.levels:
+        table += LEVEL.pack(width, height, offset, level.nbytes)
+        offset += level.nbytes
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(table)
+        for _, _, level in data.levels:
+            f.write(np.ascontiguousarray(level).tobytes())
+    os.replace(temp_path, path)
+
+
+def bake(directory, texture_format="rgb", max_size=None):
+    """
+    Builds or refreshes the cache file of every image in the given directory.
+    """
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            filename = os.path.join(directory, name)
+            data = load_texture(filename, texture_format, max_size)
+            print(
+                f"{filename}: {data.width}x{data.height} {data.format}, {len(data.levels)} levels, "
+                f"{data.nbytes / 1024:.1f} KiB on the GPU"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-bake the texture cache for images.")
+    parser.add_argument("directories", nargs="*", default=["models"])
+    parser.add_argument("--format", default="rgb", choices=sorted(FORMATS))
+    parser.add_argument("--max-size", type=int, help="largest width or height to keep")
+    args = parser.parse_args()
+    for directory in args.directories:
+        bake(directory, args.format, args.max_size)
@@ -0,0 +1,213 @@
+"""
+Structure-of-arrays storage for the transforms of many scene nodes.
+
+Each SceneNode owns one row of a TransformStore, which keeps every node's position,
+Euler angles (yaw, pitch, roll), scale, center and parent in NumPy arrays, and computes
+the model matrices of all changed rows together with a few array operations instead of
+a chain of glm calls per node.
+
+Matrices are stored as an (N, 4, 4) float32 array in which each (4, 4) block holds one
+matrix's columns, which is the memory layout OpenGL expects. A slice of rows can go
+straight to an instance buffer (see Mesh3D.draw_instanced) with no repacking.
+"""
+import weakref
+from collections import Counter
+
+import glm
+import numpy as np
+
+from Profiler import profiler
+
+# How many local and world matrices have been built, for measuring how much work the
+# dirty flags save.
+matrix_builds = Counter()
+
+
+def local_matrices(positions, orientations, scales, centers):
+    """
+    Computes the (N, 4, 4) column-major model matrices of N transforms at once: a
+    rotation by orientation around Z (roll), then X (pitch), then Y (yaw), and a scale,
+    both around `center`, then a translation to `position`. This is the same matrix as
+    the chain of glm calls in SceneNode's original implementation:
+
+        translate(position) * translate(center * scale) * scale(scale)
+            * rotate(z) * rotate(x) * rotate(y) * translate(-center)
+    """
+    pitch, yaw, roll = orientations[:, 0], orientations[:, 1], orientations[:, 2]
+    cx, sx = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cz, sz = np.cos(roll), np.sin(roll)
+
+    # Rows of Rz @ Rx @ Ry, written out.
+    rotation = np.empty((len(positions), 3, 3), dtype=np.float64)
+    rotation[:, 0, 0] = cz * cy - sz * sx * sy
+    rotation[:, 0, 1] = -sz * cx
+    rotation[:, 0, 2] = cz * sy + sz * sx * cy
+    rotation[:, 1, 0] = sz * cy + cz * sx * sy
+    rotation[:, 1, 1] = cz * cx
+    rotation[:, 1, 2] = sz * sy - cz * sx * cy
+    rotation[:, 2, 0] = -cx * sy
+    rotation[:, 2, 1] = sx
+    rotation[:, 2, 2] = cx * cy
+
+    linear = scales[:, :, None] * rotation
+    translation = positions + centers * scales - np.einsum("nij,nj->ni", linear, centers)
+
+    matrices = np.zeros((len(positions), 4, 4), dtype=np.float32)
+    # Column-major: block[column, row].
+    matrices[:, :3, :3] = linear.transpose(0, 2, 1)
+    matrices[:, 3, :3] = translation
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+class TransformStore:
+    """
+    The transforms of up to `capacity` scene nodes (growing as needed), one row each.
+    Writing a row's position, orientation, scale or center marks it dirty; update()
+    then recomputes the local matrices of dirty rows, and the world matrices of dirty
+    rows and everything below them, in one batch.
+    """
+
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.version = 0
+        self._free = []
+        self._changed = False
+        self._allocate_arrays(capacity)
+
+    def _allocate_arrays(self, capacity):
+        old = self.__dict__.get("positions")
+        arrays = {
+            "positions": np.zeros((capacity, 3), dtype=np.float32),
+            "orientations": np.zeros((capacity, 3), dtype=np.float32),
+            "scales": np.ones((capacity, 3), dtype=np.float32),
+            "centers": np.zeros((capacity, 3), dtype=np.float32),
+            "parents": np.full(capacity, -1, dtype=np.int64),
+            "depths": np.zeros(capacity, dtype=np.int64),
+            "dirty": np.zeros(capacity, dtype=bool),
+            "local": np.zeros((capacity, 4, 4), dtype=np.float32),
+            "matrices": np.zeros((capacity, 4, 4), dtype=np.float32),
+        }
+        for name, array in arrays.items():
+            if old is not None:
+                array[:len(old)] = getattr(self, name)
+            setattr(self, name, array)
+
+    @property
+    def capacity(self):
+        return len(self.positions)
+
+    def allocate(self, position, orientation, scale, center):
+        """
+        Claims a row for a new transform and returns its index.
+        """
+        if self._free:
+            row = self._free.pop()
+        else:
+            if self.count == self.capacity:
+                self._allocate_arrays(2 * self.capacity)
+            row = self.count
+            self.count += 1
+        self.positions[row] = position
+        self.orientations[row] = orientation
+        self.scales[row] = scale
+        self.centers[row] = center
+        self.parents[row] = -1
+        self.depths[row] = 0
+        self.mark_dirty(row)
+        return row
+
+    def release(self, row):
+        """
+        Frees a row for reuse.
+        """
+        self.parents[row] = -1
+        self.depths[row] = 0
+        self.dirty[row] = False
+        self._free.append(row)
+
+    def mark_dirty(self, rows):
+        """
+        Marks rows (an index, or an array of them) whose transforms were written directly.
+        """
+        self.dirty[rows] = True
+        self._changed = True
+
+    def set_parent(self, row, parent):
+        """
+        Makes `row`'s transform relative to row `parent`'s, or to the world if parent is
+        -1. The caller updates the depths of row's descendants.
+        """
+        self.parents[row] = parent
+        self.depths[row] = 0 if parent < 0 else self.depths[parent] + 1
+        self.mark_dirty(row)
+
+    def update(self):
+        """
+        Brings every matrix up to date, if anything changed since the last update.
+        """
+        if not self._changed:
+            return
+        with profiler.scope("TransformStore.update"):
+            self._update()
+
+    def _update(self):
+        n = self.count
+        dirty = np.flatnonzero(self.dirty[:n])
+        self.local[dirty] = local_matrices(
+            self.positions[dirty], self.orientations[dirty], self.scales[dirty], self.centers[dirty]
+        )
+        matrix_builds["local"] += len(dirty)
+
+        roots = dirty[self.parents[dirty] < 0]
+        self.matrices[roots] = self.local[roots]
+        # Children follow their parents level by level, so each parent's world matrix is
+        # final before its children use it.
+        world_dirty = self.dirty[:n].copy()
+        depths = self.depths[:n]
+        for depth in range(1, int(depths.max(initial=0)) + 1):
+            rows = np.flatnonzero(depths == depth)
+            rows = rows[world_dirty[rows] | world_dirty[self.parents[rows]]]
+            world_dirty[rows] = True
+            # With column-major blocks, parent @ local is computed as local_t @ parent_t.
+            self.matrices[rows] = self.local[rows] @ self.matrices[self.parents[rows]]
+            matrix_builds["world"] += len(rows)
+
+        self.dirty[:n] = False
+        self._changed = False
+        self.version += 1
+
+
+# The store that SceneNodes use unless given another.
+default_store = TransformStore()
+
+
+def model_matrices(nodes):
+    """
+    Gets the (N, 16) float32 column-major world matrices of the given scene nodes, ready
+    for an instance buffer, gathering them from the nodes' store in one operation.
+    """
+    if not nodes:
+        return np.zeros((0, 16), dtype=np.float32)
+    store = nodes[0].store
+    if all(node.store is store for node in nodes):
+        store.update()
+        rows = np.fromiter((node.row for node in nodes), dtype=np.int64, count=len(nodes))
+        return store.matrices[rows].reshape(-1, 16)
+    return np.frombuffer(
+        b"".join(node.get_model_matrix().to_bytes() for node in nodes), dtype=np.float32
+    ).reshape(-1, 16)
+
+
+def _release_row(store, row):
+    store.release(row)
+
+
+def claim_row(node, store, position, orientation, scale, center):
+    """
+    Allocates a row in `store` for `node`, freed again when the node is garbage collected.
+    """
+    row = store.allocate(position, orientation, scale, center)
+    weakref.finalize(node, _release_row, store, row)
+    return row
@@ -0,0 +1,139 @@
+from OpenGL.GL import *
+import glm
+import numpy as np
+
+from Light import MAX_LIGHTS
+
+# Size and alignment in bytes of each supported GLSL type under the std140 layout rules.
+_STD140 = {
+    "float": (4, 4),
+    "int": (4, 4),
+    "vec3": (12, 16),
+    "vec4": (16, 16),
+    "mat4": (64, 16),
+}
+
+
+def _std140(glsl_type):
+    """
+    Gets the size and alignment of a member type, including vec4 arrays like "vec4[8]".
+    """
+    if glsl_type.startswith("vec4["):
+        return 16 * int(glsl_type[5:-1]), 16
+    return _STD140[glsl_type]
+
+
+class UniformBlock:
+    """
+    A std140 uniform block shared by every shader program that declares it, e.g.
+
+        layout (std140) uniform Frame {
+            mat4 projection;
+            mat4 view;
+            vec3 cameraPosition;
+        };
+
+    Member values are kept in a NumPy structured array laid out exactly like the block,
+    and upload() copies the whole struct to the uniform buffer in one call, only when a
+    member has changed since the last upload.
+    """
+
+    def __init__(self, name: str, binding: int, members: list[tuple[str, str]]):
+        self.name = name
+        self.binding = binding
+        self.members = dict(members)
+
+        names, formats, offsets = [], [], []
+        offset = 0
+        for member, glsl_type in members:
+            size, alignment = _std140(glsl_type)
+            offset = -(-offset // alignment) * alignment
+            names.append(member)
+            formats.append(("<i4" if glsl_type == "int" else "<f4", (size // 4,)))
+            offsets.append(offset)
+            offset += size
+        # A block's size is rounded up to the alignment of a vec4.
+        itemsize = -(-offset // 16) * 16
+        self.dtype = np.dtype(
+            {"names": names, "formats": formats, "offsets": offsets, "itemsize": itemsize}
+        )
+        self.data = np.zeros(1, dtype=self.dtype)
+        self.buffer = None
+        self.dirty = True
+
+    def __contains__(self, member):
+        return member in self.members
+
+    def __setitem__(self, member, value):
+        if isinstance(value, (glm.mat4, glm.vec3, glm.vec4)):
+            # glm stores matrices column-major, which is also what std140 expects.
+            value = np.frombuffer(value.to_bytes(), dtype=np.float32)
+        field = self.data[member][0]
+        value = np.asarray(value, dtype=field.dtype).reshape(field.shape)
+        if not np.array_equal(field, value):
+            field[...] = value
+            self.dirty = True
+
+    def bind_program(self, program):
+        """
+        Points the given program's copy of this block (if it declares one) at the block's
+        binding point.
+        """
+        index = glGetUniformBlockIndex(program, self.name)
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(program, index, self.binding)
+
+    def upload(self):
+        """
+        Copies the block to its uniform buffer if it changed. Returns whether it did.
+        """
+        if not self.dirty:
+            return False
+        if self.buffer is None:
+            self.buffer = glGenBuffers(1)
+            glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+            glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, GL_DYNAMIC_DRAW)
+            glBindBufferBase(GL_UNIFORM_BUFFER, self.binding, self.buffer)
+        else:
+            glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        self.dirty = False
+        return True
+
+    def delete(self):
+        """
+        Deletes the block's uniform buffer. The next upload() creates a new one.
+        """
+        if self.buffer is not None:
+            glDeleteBuffers(1, [self.buffer])
+            self.buffer = None
+        self.dirty = True
+
+
+def frame_block():
+    """
+    Per-frame camera state, declared as the Frame block in the bundled shaders.
+    """
+    return UniformBlock(
+        "Frame", 0, [("projection", "mat4"), ("view", "mat4"), ("cameraPosition", "vec3")]
+    )
+
+
+def lights_block():
+    """
+    Scene lighting, declared as the Lights block in the bundled shaders. See
+    Light.pack_lights for the layout of the light arrays.
+    """
+    array = f"vec4[{MAX_LIGHTS}]"
+    return UniformBlock(
+        "Lights",
+        1,
+        [
+            ("ambientColor", "vec3"),
+            ("lightPositions", array),
+            ("lightDirections", array),
+            ("lightColors", array),
+            ("lightAttenuations", array),
+        ],
+    )
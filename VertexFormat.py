@@ -0,0 +1,257 @@
+"""
+Vertex buffer layouts: where each shader attribute of a vertex lives, in what type.
+
+Meshes are parsed and built as interleaved float32 vertices (x, y, z, nx, ny, nz, u,
+v). A VertexFormat turns those into the bytes of one vertex buffer (pack), sets up the
+attribute pointers that read them back (enable), and checks that a linked shader
+program declares the same attributes at the same locations (check_program), so a
+layout and a shader can't silently disagree.
+
+Compact formats shrink vertex buffers by storing attributes in fewer bits, which the
+GPU expands back to floats as it reads them: half floats, signed 10-10-10-2 packed
+normals, and texture coordinates as normalized unsigned shorts. Quantized formats store
+positions as normalized shorts, which Mesh3D first maps into [-1, 1] across the mesh's
+bounding box (see Mesh3D.quantize_positions).
+"""
+import ctypes
+from collections import namedtuple
+
+import numpy as np
+from OpenGL.GL import *
+
+# One attribute of a vertex format: the name and location of the shader input it feeds,
+# its number of components, their GL type, whether integers are normalized to [0, 1]
+# or [-1, 1], and its byte offset within a vertex.
+VertexAttribute = namedtuple(
+    "VertexAttribute", ["name", "location", "components", "type", "normalized", "offset"]
+)
+
+# The columns of the interleaved float32 vertices that each shader input is packed from.
+SOURCE_COLUMNS = {
+    "vPosition": slice(0, 3),
+    "vNormal": slice(3, 6),
+    "vTexCoord": slice(6, 8),
+}
+SOURCE_STRIDE = 8
+
+# Bytes per component of each supported GL type. A packed type's components share 4 bytes.
+_COMPONENT_BYTES = {
+    GL_FLOAT: 4,
+    GL_HALF_FLOAT: 2,
+    GL_UNSIGNED_SHORT: 2,
+    GL_SHORT: 2,
+    GL_UNSIGNED_BYTE: 1,
+    GL_BYTE: 1,
+}
+_PACKED_TYPES = {GL_INT_2_10_10_10_REV}
+
+# Components of each shader input type.
+_SHADER_COMPONENTS = {
+    GL_FLOAT: 1,
+    GL_FLOAT_VEC2: 2,
+    GL_FLOAT_VEC3: 3,
+    GL_FLOAT_VEC4: 4,
+}
+
+
+def attribute_bytes(attribute: VertexAttribute):
+    """
+    Gets the number of bytes an attribute takes in each vertex.
+    """
+    if attribute.type in _PACKED_TYPES:
+        return 4
+    return attribute.components * _COMPONENT_BYTES[attribute.type]
+
+
+class VertexFormat:
+    """
+    A vertex buffer layout, made of VertexAttributes. The stride is the end of the last
+    attribute, rounded up so every vertex starts on a 4-byte boundary.
+    """
+
+    def __init__(self, name, attributes: list[VertexAttribute]):
+        self.name = name
+        self.attributes = sorted(attributes, key=lambda attribute: attribute.offset)
+        end = 0
+        for attribute in self.attributes:
+            if attribute.type not in _COMPONENT_BYTES and attribute.type not in _PACKED_TYPES:
+                raise ValueError(f"{name}: unsupported type {attribute.type!r} for {attribute.name}")
+            if attribute.type in _PACKED_TYPES and attribute.components != 4:
+                raise ValueError(f"{name}: packed {attribute.name} must have 4 components")
+            if attribute.offset % 4:
+                raise ValueError(f"{name}: {attribute.name} is not 4-byte aligned")
+            if attribute.offset < end:
+                raise ValueError(f"{name}: {attribute.name} overlaps the attribute before it")
+            end = attribute.offset + attribute_bytes(attribute)
+        self.stride = -(-end // 4) * 4
+        # Float32 attributes at their source columns need no repacking.
+        self._is_source_layout = self.stride == 4 * SOURCE_STRIDE and all(
+            attribute.type == GL_FLOAT
+            and SOURCE_COLUMNS[attribute.name] == slice(attribute.offset // 4, attribute.offset // 4 + attribute.components)
+            for attribute in self.attributes
+        )
+
+    @property
+    def quantizes_positions(self):
+        """
+        Whether positions are stored as normalized integers, so they must be mapped into
+        [-1, 1] before packing and back by the model matrix.
+        """
+        return any(
+            attribute.name == "vPosition" and attribute.normalized and attribute.type != GL_FLOAT
+            for attribute in self.attributes
+        )
+
+    def __repr__(self):
+        return f"VertexFormat({self.name!r}, stride={self.stride})"
+
+    def pack(self, vertices):
+        """
+        Converts interleaved float32 vertices (x, y, z, nx, ny, nz, u, v) into this
+        format's vertex buffer: the vertices themselves if the format is that layout,
+        otherwise a uint8 array of stride bytes per vertex.
+        """
+        if self._is_source_layout:
+            return vertices
+        rows = np.asarray(vertices, dtype=np.float32).reshape(-1, SOURCE_STRIDE)
+        packed = np.zeros((len(rows), self.stride), dtype=np.uint8)
+        for attribute in self.attributes:
+            values = _encode(attribute, rows[:, SOURCE_COLUMNS[attribute.name]])
+            size = attribute_bytes(attribute)
+            packed[:, attribute.offset:attribute.offset + size] = values.view(np.uint8).reshape(len(rows), size)
+        return packed.reshape(-1)
+
+    def enable(self):
+        """
+        Points each attribute at the vertex buffer bound to GL_ARRAY_BUFFER, in the
+        currently bound VAO.
+        """
+        for attribute in self.attributes:
+            glEnableVertexAttribArray(attribute.location)
+            glVertexAttribPointer(
+                attribute.location,
+                attribute.components,
+                attribute.type,
+                attribute.normalized,
+                self.stride,
+                ctypes.c_void_p(attribute.offset),
+            )
+
+    def check_program(self, program, other_attributes=None):
+        """
+        Checks that every active attribute of a linked program is fed by an attribute
+        of this format with the same name and location and enough components, or is one
+        of `other_attributes` ({name: location}, for inputs that come from other buffers,
+        such as per-instance matrices). Raises ValueError listing any mismatches.
+        """
+        other_attributes = other_attributes or {}
+        by_location = {attribute.location: attribute for attribute in self.attributes}
+        problems = []
+        for i in range(glGetProgramiv(program, GL_ACTIVE_ATTRIBUTES)):
+            name, _, shader_type = glGetActiveAttrib(program, i)
+            name = name.decode()
+            if name.startswith("gl_"):
+                continue
+            location = glGetAttribLocation(program, name)
+            if other_attributes.get(name) == location:
+                continue
+            attribute = by_location.get(location)
+            if attribute is None:
+                problems.append(f"{name} (location {location}) has no attribute")
+            elif attribute.name != name:
+                problems.append(f"location {location} is {name} in the shader but {attribute.name} in the format")
+            # A missing fourth component defaults to 1, so vec4 positions can read vec3s.
+            elif attribute.components < min(_SHADER_COMPONENTS.get(shader_type, 1), 3):
+                problems.append(f"{name} has {attribute.components} components, too few for the shader")
+        if problems:
+            raise ValueError(f"{self.name} doesn't match program {program}: " + "; ".join(problems))
+
+
+def _encode(attribute: VertexAttribute, values):
+    """
+    Converts an (n, k) float32 array of attribute values to the attribute's type, as an
+    (n, components) array (or (n,) for packed types).
+    """
+    if attribute.type == GL_INT_2_10_10_10_REV:
+        return _pack_2_10_10_10(values)
+    if attribute.components > values.shape[1]:
+        padding = np.zeros((len(values), attribute.components - values.shape[1]), dtype=np.float32)
+        values = np.concatenate([values, padding], axis=1)
+    values = values[:, :attribute.components]
+    if attribute.type == GL_FLOAT:
+        return np.ascontiguousarray(values)
+    if attribute.type == GL_HALF_FLOAT:
+        if np.abs(values).max(initial=0) > np.finfo(np.float16).max:
+            raise ValueError(f"{attribute.name} values are too large for half floats")
+        return values.astype(np.float16)
+
+    dtype = {
+        GL_UNSIGNED_SHORT: np.uint16,
+        GL_SHORT: np.int16,
+        GL_UNSIGNED_BYTE: np.uint8,
+        GL_BYTE: np.int8,
+    }[attribute.type]
+    info = np.iinfo(dtype)
+    if not attribute.normalized:
+        if values.min(initial=0) < info.min or values.max(initial=0) > info.max:
+            raise ValueError(f"{attribute.name} values don't fit in {np.dtype(dtype).name}")
+        return np.rint(values).astype(dtype)
+    # Normalized unsigned integers cover [0, 1], and signed ones [-1, 1].
+    low = 0.0 if info.min == 0 else -1.0
+    if values.min(initial=0) < low or values.max(initial=0) > 1:
+        raise ValueError(f"{attribute.name} values are outside [{low:g}, 1], so can't be normalized")
+    return np.rint(values * info.max).astype(dtype)
+
+
+def _pack_2_10_10_10(values):
+    """
+    Packs (n, 3) values in [-1, 1] into signed normalized 10-bit x, y and z fields of
+    one uint32 each, leaving the 2-bit w field zero.
+    """
+    fields = np.rint(np.clip(values, -1, 1) * 511).astype(np.int32) & 0x3FF
+    return (fields[:, 0] | fields[:, 1] << 10 | fields[:, 2] << 20).astype(np.uint32)
+
+
+# 32 bytes per vertex: float32 position, normal and texture coordinates, as parsed.
+STANDARD_FORMAT = VertexFormat(
+    "standard",
+    [
+        VertexAttribute("vPosition", 0, 3, GL_FLOAT, False, 0),
+        VertexAttribute("vNormal", 1, 3, GL_FLOAT, False, 12),
+        VertexAttribute("vTexCoord", 2, 2, GL_FLOAT, False, 24),
+    ],
+)
+
+# 16 bytes per vertex: half-float positions (about 3 significant digits, so best for
+# models within a few units of their origin), 10-10-10-2 normals and unsigned-short
+# texture coordinates, which must lie in [0, 1].
+COMPACT_FORMAT = VertexFormat(
+    "compact",
+    [
+        VertexAttribute("vPosition", 0, 3, GL_HALF_FLOAT, False, 0),
+        VertexAttribute("vNormal", 1, 4, GL_INT_2_10_10_10_REV, True, 8),
+        VertexAttribute("vTexCoord", 2, 2, GL_UNSIGNED_SHORT, True, 12),
+    ],
+)
+
+# 28 bytes per vertex: positions as normalized shorts across the mesh's bounding box
+# (1/32767 of its largest half-extent apart), with float32 normals and texture coordinates.
+QUANTIZED_FORMAT = VertexFormat(
+    "quantized",
+    [
+        VertexAttribute("vPosition", 0, 3, GL_SHORT, True, 0),
+        VertexAttribute("vNormal", 1, 3, GL_FLOAT, False, 8),
+        VertexAttribute("vTexCoord", 2, 2, GL_FLOAT, False, 20),
+    ],
+)
+
+# 16 bytes per vertex, like COMPACT_FORMAT but with quantized positions, which are
+# more precise than half floats for meshes of any size.
+QUANTIZED_COMPACT_FORMAT = VertexFormat(
+    "quantized compact",
+    [
+        VertexAttribute("vPosition", 0, 3, GL_SHORT, True, 0),
+        VertexAttribute("vNormal", 1, 4, GL_INT_2_10_10_10_REV, True, 8),
+        VertexAttribute("vTexCoord", 2, 2, GL_UNSIGNED_SHORT, True, 12),
+    ],
+)
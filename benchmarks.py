@@ -0,0 +1,965 @@
+"""
+Micro-benchmarks for the demo's hot paths. Run from the repository root, e.g.
+
+    python benchmarks.py obj_loader
+"""
+import argparse
+import io
+import math
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import glm
+import numpy as np
+
+from AssetLoader import AssetLoader
+from AssetManager import AssetManager
+import MeshCache
+from Mesh3D_normals import Mesh3D
+from MeshNormals import generate_normals
+import MeshOptimizer
+from MeshSimplifier import build_lods
+from Object3D import Object3D
+import SceneNode
+import TextureCache
+import TransformStore
+from VertexFormat import COMPACT_FORMAT, QUANTIZED_COMPACT_FORMAT, QUANTIZED_FORMAT, STANDARD_FORMAT
+
+
+def _time(function, repeat):
+    """
+    Returns the best wall-clock time of `repeat` calls to `function`, and its last result.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _gl_context(width=800, height=800):
+    """
+    Opens a hidden pygame window with the same OpenGL context settings as light_demo.py.
+    """
+    import pygame
+    from OpenGL.GL import glEnable, GL_DEPTH_TEST
+
+    pygame.init()
+    pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MAJOR_VERSION, 4)
+    pygame.display.gl_set_attribute(pygame.GL_CONTEXT_MINOR_VERSION, 1)
+    pygame.display.gl_set_attribute(pygame.GL_CONTEXT_FORWARD_COMPATIBLE_FLAG, True)
+    pygame.display.gl_set_attribute(pygame.GL_CONTEXT_PROFILE_MASK, pygame.GL_CONTEXT_PROFILE_CORE)
+    pygame.display.set_mode((width, height), pygame.DOUBLEBUF | pygame.OPENGL | pygame.HIDDEN)
+    glEnable(GL_DEPTH_TEST)
+
+
+def _shader_program(defines=()):
+    """
+    Builds the demo's lighting program, in the permutation with the given #defines.
+    """
+    from Light import SHADER_DEFINES
+    from ShaderManager import ShaderManager
+
+    manager = ShaderManager(defines=SHADER_DEFINES)
+    return manager.program("normal_perspective.vert", "specular_light.frag", defines)
+
+
+def _forest(mesh, count):
+    """
+    Lays out `count` objects sharing `mesh` on a square grid in front of the camera.
+    """
+    side = math.ceil(math.sqrt(count))
+    objects = []
+    for i in range(count):
+        o = Object3D(mesh)
+        o.move(glm.vec3((i % side - side / 2) * 0.5, -1, -5 - (i // side) * 0.5))
+        o.grow(glm.vec3(0.2, 0.2, 0.2))
+        objects.append(o)
+    return objects
+
+
+def _legacy_parse_textured_obj(obj_file):
+    """
+    The original per-line, per-face loop from Mesh3D.load_textured_obj, kept as the
+    baseline for the loader benchmark. Faces without texture or normal indices are
+    padded with -1, and duplicated vertices read their normal at 3 * index.
+    """
+    verts = []
+    faces = []
+    texcoords = []
+    normals = []
+    for line in obj_file:
+        if line[0] == "#":
+            continue
+
+        sp = [x for x in line.split() if x]
+        if line.startswith("v "):
+            verts.extend(float(x) for x in sp[1:4])
+        elif line.startswith("vt"):
+            texcoords.extend(float(x) for x in sp[1:3])
+        elif line.startswith("vn"):
+            normals.extend(float(x) for x in sp[1:4])
+        elif line.startswith("f"):
+            for corner in sp[1:4]:
+                parts = (corner.split("/") + ["", ""])[:3]
+                faces.extend(int(p or 0) - 1 for p in parts)
+
+    vertex_buffer = []
+    for i in range(0, len(verts), 3):
+        vertex_buffer.extend([verts[i], verts[i + 1], verts[i + 2], 0, 0, 0, 0, 0])
+
+    def attributes(texindex, nrmindex):
+        normal = normals[3 * nrmindex:3 * nrmindex + 3] if nrmindex >= 0 else [0, 0, 0]
+        uv = texcoords[2 * texindex:2 * texindex + 2] if texindex >= 0 else [0, 0]
+        return normal + uv
+
+    face_buffer = []
+    vertex_textures = {}
+    for i in range(0, len(faces), 3):
+        v_index, texindex, nrmindex = faces[i], faces[i + 1], faces[i + 2]
+        texindexes = vertex_textures.setdefault(v_index, {(texindex, nrmindex): v_index})
+        if (texindex, nrmindex) not in texindexes:
+            vertex_buffer.extend(vertex_buffer[v_index * 8:v_index * 8 + 3])
+            vertex_buffer.extend(attributes(texindex, nrmindex))
+            v_index = len(vertex_buffer) // 8 - 1
+            texindexes[(texindex, nrmindex)] = v_index
+        else:
+            v_index = texindexes[(texindex, nrmindex)]
+            vertex_buffer[v_index * 8 + 3:v_index * 8 + 8] = attributes(texindex, nrmindex)
+        face_buffer.append(v_index)
+
+    return np.array(vertex_buffer, "float32"), np.array(face_buffer, "uint32")
+
+
+class _EagerTransform:
+    """
+    The original Object3D transform, which rebuilt its model matrix on every change,
+    kept as the baseline for the scene graph benchmark.
+    """
+
+    builds = 0
+
+    def __init__(self):
+        self.position = glm.vec3(0, 0, 0)
+        self.orientation = glm.vec3(0, 0, 0)
+        self.scale = glm.vec3(1, 1, 1)
+        self.center = glm.vec3(0, 0, 0)
+        self._refresh_model_matrix()
+
+    def move(self, offset):
+        self.position = self.position + offset
+        self._refresh_model_matrix()
+
+    def rotate(self, rot):
+        self.orientation = self.orientation + rot
+        self._refresh_model_matrix()
+
+    def get_model_matrix(self):
+        return self.model_matrix
+
+    def _refresh_model_matrix(self):
+        m = glm.translate(glm.mat4(1), self.position)
+        m = glm.translate(m, self.center * self.scale)
+        m = glm.scale(m, self.scale)
+        m = glm.rotate(m, self.orientation[2], glm.vec3(0, 0, 1))
+        m = glm.rotate(m, self.orientation[0], glm.vec3(1, 0, 0))
+        m = glm.rotate(m, self.orientation[1], glm.vec3(0, 1, 0))
+        m = glm.translate(m, -self.center)
+        self.model_matrix = m
+        _EagerTransform.builds += 1
+
+
+def bench_obj_loader(repeat):
+    """
+    Compares the vectorized OBJ parser against the original loop on the bundled models,
+    and checks that both produce identical vertex and index buffers. Models without
+    normals get generated ones from the new parser, where the original loop left zeros,
+    so only the normals the file provides are compared.
+
+    Also checks that records with different numbers of values, such as vertices with
+    and without colors, keep their columns apart.
+    """
+    mixed = Mesh3D.parse_textured_obj(io.StringIO("v 1 2 3\nv 4 5 6 0.5 0.5\nf 1 2 1\n"))[0]
+    print(f"mixed-width v lines parsed correctly: {mixed.reshape(-1, 8)[:, :3].tolist() == [[1, 2, 3], [4, 5, 6]]}")
+    models = [
+        "models/cube.obj",
+        "models/dice.obj",
+        "models/square.obj",
+        "models/bunny.obj",
+        "models/goose.OBJ",
+        "models/GULL.OBJ",
+    ]
+    print(f"{'model':<20} {'legacy ms':>10} {'numpy ms':>10} {'speedup':>8}  identical")
+    for filename in models:
+        def legacy():
+            with open(filename) as f:
+                return _legacy_parse_textured_obj(f)
+
+        def vectorized():
+            with open(filename) as f:
+                return Mesh3D.parse_textured_obj(f)
+
+        legacy_time, (legacy_verts, legacy_faces) = _time(legacy, repeat)
+        numpy_time, (verts, faces) = _time(vectorized, repeat)
+        legacy_rows, rows = legacy_verts.reshape(-1, 8), verts.reshape(-1, 8)
+        has_normal = legacy_rows[:, 3:6].any(axis=1)
+        identical = (
+            legacy_rows[:, [0, 1, 2, 6, 7]].tobytes() == rows[:, [0, 1, 2, 6, 7]].tobytes()
+            and legacy_rows[has_normal].tobytes() == rows[has_normal].tobytes()
+            and legacy_faces.tobytes() == faces.tobytes()
+        )
+        print(
+            f"{filename:<20} {legacy_time * 1000:>10.2f} {numpy_time * 1000:>10.2f} "
+            f"{legacy_time / numpy_time:>7.1f}x  {identical}"
+        )
+
+
+def bench_mesh_cache(repeat):
+    """
+    Compares parsing each bundled model against loading it from a warm mesh cache.
+    """
+    models = ["models/bunny.obj", "models/goose.OBJ", "models/GULL.OBJ"]
+    print(f"{'model':<20} {'parse ms':>10} {'cache ms':>10} {'speedup':>8}")
+    for filename in models:
+        def parse():
+            with open(filename) as f:
+                return Mesh3D.parse_textured_obj(f)
+
+        MeshCache.load_textured_obj(filename)
+        parse_time, _ = _time(parse, repeat)
+        cache_time, _ = _time(lambda: MeshCache.load_textured_obj(filename), repeat)
+        print(
+            f"{filename:<20} {parse_time * 1000:>10.2f} {cache_time * 1000:>10.2f} "
+            f"{parse_time / cache_time:>7.1f}x"
+        )
+
+
+def _write_grid_obj(filename, side):
+    """
+    Writes a side x side grid of textured vertices, and the two triangles of each cell,
+    as an OBJ file.
+    """
+    u, v = np.meshgrid(np.linspace(0, 1, side), np.linspace(0, 1, side))
+    u, v = u.reshape(-1), v.reshape(-1)
+    corner = (np.arange(side - 1)[:, None] * side + np.arange(side - 1)).reshape(-1) + 1
+    quads = np.stack([corner, corner + 1, corner + side + 1, corner + side], axis=1)
+    triangles = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+    with open(filename, "w") as f:
+        np.savetxt(f, np.stack([u, np.sin(6 * u) * np.cos(6 * v) / 10, v], axis=1), "v %.6f %.6f %.6f")
+        np.savetxt(f, np.stack([u, v], axis=1), "vt %.6f %.6f")
+        f.write("vn 0 1 0\n")
+        np.savetxt(f, np.repeat(triangles, 2, axis=1), "f %d/%d/1 %d/%d/1 %d/%d/1")
+
+
+def _peak_memory(function):
+    """
+    Calls `function` and returns its result, its wall-clock time, and the peak memory
+    allocated by Python and NumPy during the call.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_obj_memory(repeat):
+    """
+    Compares the peak memory and time of parsing an OBJ file whole against streaming it
+    in chunks, on the largest bundled model and on a generated OBJ of about 70 MB. Times
+    include tracemalloc's overhead, which is large.
+    """
+    def whole(filename):
+        with open(filename) as f:
+            return Mesh3D.parse_textured_obj(f)
+
+    def streamed(filename):
+        with open(filename) as f:
+            return Mesh3D.parse_textured_obj_stream(f)
+
+    print(f"{'model':<20} {'file MB':>8} {'parser':<9} {'s':>7} {'peak MB':>8} {'output MB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        grid = os.path.join(directory, "grid.obj")
+        _write_grid_obj(grid, 700)
+        for label, filename in (("models/GULL.OBJ", "models/GULL.OBJ"), ("grid (490k vertices)", grid)):
+            size = os.path.getsize(filename) / 2**20
+            outputs = []
+            for name, parse in (("whole", whole), ("streamed", streamed)):
+                (vertices, faces), elapsed, peak = _peak_memory(lambda: parse(filename))
+                outputs.append((vertices, faces))
+                output = (vertices.nbytes + faces.nbytes) / 2**20
+                print(f"{label:<20} {size:>8.1f} {name:<9} {elapsed:>7.2f} {peak / 2**20:>8.1f} {output:>10.1f}")
+                del vertices, faces
+            (whole_vertices, whole_faces), (vertices, faces) = outputs
+            assert np.array_equal(whole_vertices, vertices) and np.array_equal(whole_faces, faces)
+            del outputs, whole_vertices, whole_faces, vertices, faces
+
+
+def bench_lods(repeat):
+    """
+    Times building a four-level LOD chain for each heavy model, and shows the triangles
+    and vertices of each level.
+    """
+    models = ["models/bunny.obj", "models/goose.OBJ", "models/GULL.OBJ"]
+    print(f"{'model':<20} {'build s':>8}  triangles (vertices) per level")
+    for filename in models:
+        with open(filename) as f:
+            vertices, faces = Mesh3D.parse_textured_obj(f)
+        build_time, lods = _time(lambda: build_lods(vertices, faces), repeat)
+        levels = "  ".join(f"{f.size // 3} ({v.size // 8})" for v, f in lods)
+        print(f"{filename:<20} {build_time:>8.2f}  {levels}")
+
+
+def bench_mesh_optimizer(repeat):
+    """
+    Shows the vertex cache efficiency (ACMR and ATVR, simulated with a 16-entry FIFO
+    cache) of each heavy model's triangles in OBJ order, after MeshOptimizer, and after
+    MeshOptimizer with overdraw clusters, with the time each optimization takes.
+    """
+    meshes = []
+    for filename in ["models/bunny.obj", "models/goose.OBJ", "models/GULL.OBJ"]:
+        with open(filename) as f:
+            meshes.append((filename, *Mesh3D.parse_textured_obj(f)))
+    meshes.append(("grid (70k triangles)", *_heightfield(188)))
+
+    print(f"{'model':<20} {'order':<9} {'vertices':>8} {'ACMR':>6} {'ATVR':>6} {'ms':>8}")
+    for label, vertices, faces in meshes:
+        acmr, atvr = MeshOptimizer.cache_statistics(faces)
+        print(f"{label:<20} {'obj':<9} {vertices.size // 8:>8} {acmr:>6.3f} {atvr:>6.3f} {'':>8}")
+        for name, threshold in (("cache", None), ("overdraw", MeshOptimizer.OVERDRAW_THRESHOLD)):
+            elapsed, (optimized_vertices, optimized_faces) = _time(
+                lambda: MeshOptimizer.optimize(vertices, faces, overdraw_threshold=threshold), repeat
+            )
+            acmr, atvr = MeshOptimizer.cache_statistics(optimized_faces)
+            print(
+                f"{'':<20} {name:<9} {optimized_vertices.size // 8:>8} {acmr:>6.3f} {atvr:>6.3f} "
+                f"{elapsed * 1000:>8.1f}"
+            )
+
+
+def _unpack_compact(packed):
+    """
+    Decodes COMPACT_FORMAT vertices back to (positions, normals, texcoords), as the GPU
+    reads them.
+    """
+    rows = packed.reshape(-1, COMPACT_FORMAT.stride)
+    positions = rows[:, 0:6].copy().view(np.float16).astype(np.float32)
+    words = rows[:, 8:12].copy().view(np.uint32).reshape(-1)
+    # Sign-extend each 10-bit field, then map [-511, 511] back to [-1, 1].
+    fields = np.stack([(words >> shift) & 0x3FF for shift in (0, 10, 20)], axis=1).astype(np.int32)
+    normals = np.maximum(np.where(fields >= 512, fields - 1024, fields) / 511, -1)
+    texcoords = rows[:, 12:16].copy().view(np.uint16).astype(np.float32) / 65535
+    return positions, normals, texcoords
+
+
+def bench_vertex_formats(repeat):
+    """
+    Compares the vertex buffer size of the standard and compact vertex formats for each
+    bundled model, with the time to pack the compact one and its largest errors.
+    """
+    models = ["models/cube.obj", "models/bunny.obj", "models/goose.OBJ", "models/GULL.OBJ"]
+    print(
+        f"{'model':<20} {'standard KiB':>12} {'compact KiB':>12} {'pack ms':>8} "
+        f"{'position err':>12} {'normal err deg':>14} {'uv err':>8}"
+    )
+    for filename in models:
+        with open(filename) as f:
+            vertices, _ = Mesh3D.parse_textured_obj(f)
+        rows = vertices.reshape(-1, 8)
+        pack_time, packed = _time(lambda: COMPACT_FORMAT.pack(vertices), repeat)
+        positions, normals, texcoords = _unpack_compact(packed)
+        # Unit normals only; vertices no face uses have zero normals.
+        unit = np.linalg.norm(rows[:, 3:6], axis=1) > 0.5
+        cosines = (normals[unit] * rows[unit, 3:6]).sum(axis=1) / np.linalg.norm(normals[unit], axis=1)
+        print(
+            f"{filename:<20} {STANDARD_FORMAT.pack(vertices).nbytes / 1024:>12.1f} {packed.nbytes / 1024:>12.1f} "
+            f"{pack_time * 1000:>8.2f} {np.abs(positions - rows[:, 0:3]).max():>12.6f} "
+            f"{math.degrees(np.arccos(np.clip(cosines, -1, 1)).max(initial=0)):>14.3f} "
+            f"{np.abs(texcoords - rows[:, 6:8]).max():>8.6f}"
+        )
+
+
+def bench_mesh_memory(repeat):
+    """
+    Shows the GPU memory (vertex + index buffer bytes) of every model in models/, as
+    MeshCache loads it: with float32 vertices and uint32 indices, with the index type
+    Mesh3D picks, and with quantized positions, along with the bytes saved and the
+    largest position error quantizing adds.
+    """
+    models = sorted(
+        os.path.join("models", name) for name in os.listdir("models") if name.lower().endswith(".obj")
+    )
+    formats = [STANDARD_FORMAT, QUANTIZED_FORMAT, QUANTIZED_COMPACT_FORMAT]
+    print(
+        f"{'model':<20} {'vertices':>8} {'index':>6} {'uint32 KiB':>10} "
+        + " ".join(f"{vertex_format.name + ' KiB':>22}" for vertex_format in formats)
+        + f" {'position err':>12}"
+    )
+    totals = np.zeros(len(formats) + 1)
+    for filename in models:
+        data = MeshCache.load_obj(filename)
+        rows = data.vertices.reshape(-1, 8)
+        index_buffer, _ = Mesh3D.index_buffer(data.faces, len(rows))
+        quantized, dequantization = Mesh3D.quantize_positions(data.vertices)
+        sizes = [STANDARD_FORMAT.pack(data.vertices).nbytes + 4 * data.faces.size]
+        for vertex_format in formats:
+            try:
+                vertex_buffer = vertex_format.pack(quantized if vertex_format.quantizes_positions else data.vertices)
+                sizes.append(vertex_buffer.nbytes + index_buffer.nbytes)
+            except ValueError:
+                # Such as texture coordinates outside [0, 1] for the compact formats.
+                sizes.append(sizes[-1])
+        # Positions as the GPU reads them back: shorts / 32767, then the dequantization.
+        stored = np.maximum(np.rint(quantized.reshape(-1, 8)[:, :3] * 32767) / 32767, -1)
+        matrix = np.asarray(dequantization, dtype=np.float64)
+        restored = stored @ matrix[:3, :3].T + matrix[:3, 3]
+        totals += sizes
+        print(
+            f"{filename:<20} {len(rows):>8} {index_buffer.dtype.name:>6} {sizes[0] / 1024:>10.1f} "
+            + " ".join(f"{size / 1024:>22.1f}" for size in sizes[1:])
+            + f" {np.abs(restored - rows[:, :3]).max(initial=0):>12.6f}"
+        )
+    print(
+        f"{'total':<20} {'':>8} {'':>6} {totals[0] / 1024:>10.1f} "
+        + " ".join(f"{total / 1024:>22.1f}" for total in totals[1:])
+    )
+    print(
+        f"{'saved KiB':<20} {'':>8} {'':>6} {'':>10} "
+        + " ".join(f"{(totals[0] - total) / 1024:>22.1f}" for total in totals[1:])
+    )
+
+
+def _decode_bc1(data, width, height):
+    """
+    Decodes BC1 blocks (in four-color or three-color mode) back to an (h, w, 3) image,
+    as the GPU reads them.
+    """
+    words = data.reshape(-1, 8).copy().view(np.uint32)
+    color0, color1 = (words[:, 0] & 0xFFFF).astype(np.uint16), (words[:, 0] >> 16).astype(np.uint16)
+    end0, end1 = TextureCache._from_565(color0), TextureCache._from_565(color1)
+    four = (color0 > color1)[:, None]
+    palette = np.stack([
+        end0,
+        end1,
+        np.where(four, (2 * end0 + end1) / 3, (end0 + end1) / 2),
+        np.where(four, (end0 + 2 * end1) / 3, 0),
+    ], axis=1)
+    indices = (words[:, 1:2] >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    texels = np.take_along_axis(palette, indices.astype(np.intp)[:, :, None].repeat(3, axis=2), axis=1)
+    rows, columns = -(-height // 4), -(-width // 4)
+    image = texels.reshape(rows, columns, 4, 4, 3).swapaxes(1, 2).reshape(rows * 4, columns * 4, 3)
+    return image[:height, :width]
+
+
+def bench_textures(repeat):
+    """
+    Compares decoding each bundled image with pygame against loading its baked mip chain
+    from the texture cache, with the time to bake it and the GPU memory of each format:
+    uncompressed, BC1, and both limited to 1024 texels on a side. Also shows the RMS
+    error (in 8-bit levels) of BC1 at full size.
+    """
+    import pygame
+
+    images = sorted(
+        os.path.join("models", name) for name in os.listdir("models") if name.lower().endswith(TextureCache.IMAGE_EXTENSIONS)
+    )
+    options = [("rgb", None), ("bc1", None), ("rgb", 1024), ("bc1", 1024)]
+    labels = [f"{name} {limit or 'full'} KiB" for name, limit in options]
+    print(
+        f"{'image':<26} {'size':>9} {'decode ms':>9} {'bake ms':>8} {'bc1 bake ms':>11} {'cached ms':>9} "
+        + " ".join(f"{label:>14}" for label in labels)
+        + f" {'bc1 rmse':>8}"
+    )
+    for filename in images:
+        def decode():
+            image = pygame.image.load(filename)
+            return pygame.image.tostring(image, "RGB", True)
+
+        decode_time, _ = _time(decode, repeat)
+        bake_time, rgb = _time(lambda: TextureCache.bake_image(filename, "rgb"), repeat)
+        bc1_time, bc1 = _time(lambda: TextureCache.bake_image(filename, "bc1"), 1)
+        TextureCache.load_texture(filename)
+        cached_time, _ = _time(lambda: TextureCache.load_texture(filename), repeat)
+        sizes = [TextureCache.load_texture(filename, name, limit).nbytes for name, limit in options]
+        width, height, source = rgb.levels[0]
+        decoded = _decode_bc1(bc1.levels[0][2], width, height)
+        rmse = np.sqrt(((decoded - source.reshape(height, width, 3)) ** 2).mean())
+        print(
+            f"{filename:<26} {f'{width}x{height}':>9} {decode_time * 1000:>9.1f} {bake_time * 1000:>8.1f} "
+            f"{bc1_time * 1000:>11.1f} {cached_time * 1000:>9.2f} "
+            + " ".join(f"{size / 1024:>14.1f}" for size in sizes)
+            + f" {rmse:>8.2f}"
+        )
+
+
+def _heightfield(side):
+    """
+    Gets the vertex and index buffers of a side x side grid of vertices on a wavy
+    surface, with zero normals.
+    """
+    x, z = np.meshgrid(np.linspace(-1, 1, side), np.linspace(-1, 1, side))
+    vertices = np.zeros((side * side, 8), dtype=np.float32)
+    vertices[:, 0], vertices[:, 2] = x.reshape(-1), z.reshape(-1)
+    vertices[:, 1] = np.sin(4 * vertices[:, 0]) * np.cos(4 * vertices[:, 2]) / 4
+    corner = (np.arange(side - 1)[:, None] * side + np.arange(side - 1)).reshape(-1)
+    quads = np.stack([corner, corner + side, corner + side + 1, corner + 1], axis=1)
+    triangles = np.concatenate([quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]])
+    return vertices.reshape(-1), triangles.reshape(-1).astype(np.uint32)
+
+
+def bench_normals(repeat):
+    """
+    Times generating smooth (angle- and area-weighted) normals, and normals split at a
+    60 degree crease angle, for the models without normals and a 70k-triangle grid.
+    """
+    meshes = []
+    for filename in ["models/bunny.obj", "models/GULL.OBJ"]:
+        with open(filename) as f:
+            meshes.append((filename, *Mesh3D.parse_textured_obj(f)))
+    meshes.append(("grid (70k triangles)", *_heightfield(188)))
+
+    crease = math.radians(60)
+    print(f"{'model':<20} {'triangles':>9} {'angle ms':>9} {'area ms':>9} {'crease ms':>10} {'split vertices':>15}")
+    for label, vertices, faces in meshes:
+        angle_time, _ = _time(lambda: generate_normals(vertices, faces), repeat)
+        area_time, _ = _time(lambda: generate_normals(vertices, faces, weighting="area"), repeat)
+        crease_time, (split, _) = _time(lambda: generate_normals(vertices, faces, crease_angle=crease), repeat)
+        print(
+            f"{label:<20} {faces.size // 3:>9} {angle_time * 1000:>9.2f} {area_time * 1000:>9.2f} "
+            f"{crease_time * 1000:>10.2f} {vertices.size // 8:>7} -> {split.size // 8:<7}"
+        )
+
+
+def bench_scene_graph(repeat):
+    """
+    Compares eagerly rebuilt model matrices against SceneNode's lazy ones, for 10k nodes
+    that are each moved and rotated twice per frame (as the demo does with the bird)
+    before their matrices are read. Also times a 100 x 100 hierarchy where only the
+    parents move, so every child's world matrix goes out of date.
+    """
+    count = 10000
+    offset, turn = glm.vec3(0.001, 0, 0), glm.vec3(0, 0.001, 0)
+
+    def frame(nodes):
+        for node in nodes:
+            node.move(offset)
+            node.rotate(turn)
+            node.move(offset)
+            node.rotate(turn)
+        for node in nodes:
+            node.get_model_matrix()
+
+    eager = [_EagerTransform() for _ in range(count)]
+    lazy = [SceneNode.SceneNode() for _ in range(count)]
+    _EagerTransform.builds = 0
+    TransformStore.matrix_builds.clear()
+    eager_time, _ = _time(lambda: frame(eager), repeat)
+    lazy_time, _ = _time(lambda: frame(lazy), repeat)
+    eager_builds = _EagerTransform.builds / repeat
+    lazy_builds = sum(TransformStore.matrix_builds.values()) / repeat
+
+    print(f"{'scene':<22} {'ms/frame':>9} {'matrices/frame':>15}")
+    print(f"{'flat, eager':<22} {eager_time * 1000:>9.1f} {eager_builds:>15.0f}")
+    print(f"{'flat, lazy':<22} {lazy_time * 1000:>9.1f} {lazy_builds:>15.0f}")
+
+    parents = [SceneNode.SceneNode() for _ in range(100)]
+    children = []
+    for parent in parents:
+        for i in range(99):
+            child = SceneNode.SceneNode(glm.vec3(i * 0.1, 0, 0))
+            parent.add_child(child)
+            children.append(child)
+
+    def hierarchy_frame():
+        for parent in parents:
+            parent.rotate(turn)
+            parent.rotate(turn)
+        for node in children:
+            node.get_model_matrix()
+
+    hierarchy_frame()
+    TransformStore.matrix_builds.clear()
+    hierarchy_time, _ = _time(hierarchy_frame, repeat)
+    builds = TransformStore.matrix_builds
+    print(
+        f"{'hierarchy, lazy':<22} {hierarchy_time * 1000:>9.1f} "
+        f"{sum(builds.values()) / repeat:>15.0f}  "
+        f"({builds['local'] / repeat:.0f} local, {builds['world'] / repeat:.0f} world)"
+    )
+
+
+def bench_transforms(repeat):
+    """
+    Compares per-node and batched ways of animating 10k nodes and packing their model
+    matrices into an instance buffer: moving each node and joining each matrix's bytes,
+    against writing the TransformStore's arrays directly and gathering its rows.
+    """
+    count = 10000
+    store = TransformStore.TransformStore(count)
+    nodes = [SceneNode.SceneNode(store=store) for _ in range(count)]
+    rows = np.array([node.row for node in nodes])
+    offset = glm.vec3(0.001, 0, 0)
+
+    def per_node():
+        for node in nodes:
+            node.move(offset)
+        return np.frombuffer(
+            b"".join(node.get_model_matrix().to_bytes() for node in nodes), dtype=np.float32
+        ).reshape(-1, 16)
+
+    def batched():
+        store.positions[rows, 0] += 0.001
+        store.mark_dirty(rows)
+        return TransformStore.model_matrices(nodes)
+
+    per_node_time, _ = _time(per_node, repeat)
+    batched_time, _ = _time(batched, repeat)
+    # Both ways of packing the current matrices must agree.
+    packed = np.frombuffer(
+        b"".join(node.get_model_matrix().to_bytes() for node in nodes), dtype=np.float32
+    ).reshape(-1, 16)
+    assert np.array_equal(packed, TransformStore.model_matrices(nodes))
+    print(f"{'update + pack':<22} {'ms/frame':>9}")
+    print(f"{'per node, glm':<22} {per_node_time * 1000:>9.1f}")
+    print(f"{'batched, store':<22} {batched_time * 1000:>9.1f}")
+
+
+def bench_instancing(repeat):
+    """
+    Compares drawing a grid of cubes one glDrawElements at a time against one
+    glDrawElementsInstanced call, in objects drawn per second.
+    """
+    from OpenGL.GL import glClear, glFinish, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT
+    from RenderProgram import RenderProgram
+
+    _gl_context()
+    looped = _shader_program()
+    instanced = _shader_program(["INSTANCED"])
+    vertices, faces = MeshCache.load_textured_obj("models/cube.obj")
+    mesh = Mesh3D(vertices, faces, 0)
+    perspective = glm.perspective(math.radians(30), 1, 0.1, 100)
+    camera = glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, -10), glm.vec3(0, 1, 0))
+
+    print(f"{'objects':>8} {'loop obj/s':>12} {'instanced obj/s':>16} {'speedup':>8}")
+    for count in (100, 1000, 10000):
+        objects = _forest(mesh, count)
+        renderer = RenderProgram()
+
+        def frame(program, render):
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            renderer.use_program(program)
+            render(perspective, camera, objects)
+            glFinish()
+
+        loop_time, _ = _time(lambda: frame(looped, renderer.render), repeat)
+        instanced_time, _ = _time(lambda: frame(instanced, renderer.render_instanced), repeat)
+        print(
+            f"{count:>8} {count / loop_time:>12.0f} {count / instanced_time:>16.0f} "
+            f"{loop_time / instanced_time:>7.1f}x"
+        )
+
+
+def bench_texture_array(repeat):
+    """
+    Compares drawing a grid of cubes with four different textures as one instanced
+    draw per texture, each from a mesh with its own 2D texture, against one instanced
+    draw of a single mesh with the textures in a TextureArray, in draw calls and
+    milliseconds per frame.
+    """
+    from OpenGL.GL import glClear, glFinish, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT
+    from RenderProgram import RenderProgram
+    from TextureArray import TextureArray
+
+    _gl_context()
+    per_texture = _shader_program(["INSTANCED"])
+    arrayed = _shader_program(["INSTANCED", "TEXTURE_ARRAY"])
+    size = 256
+    filenames = ["models/dice.png", "models/wall.jpg", "models/icon.png", "models/woodbox.png"]
+    vertices, faces = MeshCache.load_textured_obj("models/cube.obj")
+    meshes = [
+        Mesh3D(vertices, faces, Mesh3D.upload_mipmaps(TextureCache.load_texture(filename, size=(size, size)).levels))
+        for filename in filenames
+    ]
+    array = TextureArray(filenames, size)
+    perspective = glm.perspective(math.radians(30), 1, 0.1, 100)
+    camera = glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, -10), glm.vec3(0, 1, 0))
+
+    print(f"{'objects':>8} {'2D draws':>9} {'2D ms':>8} {'array draws':>12} {'array ms':>9}")
+    for count in (100, 1000, 10000):
+        # The same grid both ways; object i has texture i % 4.
+        separate = _forest(meshes[0], count)
+        shared = _forest(meshes[0], count)
+        for i, (a, b) in enumerate(zip(separate, shared)):
+            a.mesh = meshes[i % len(meshes)]
+            b.texture_layer = i % len(meshes)
+        renderer = RenderProgram()
+
+        def frame(program, objects, texture_array=None):
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            renderer.use_program(program)
+            renderer.render_instanced(perspective, camera, objects, texture_array)
+            glFinish()
+
+        separate_time, _ = _time(lambda: frame(per_texture, separate), repeat)
+        separate_draws = renderer.end_frame()["glDrawElementsInstanced"] // repeat
+        shared_time, _ = _time(lambda: frame(arrayed, shared, array), repeat)
+        shared_draws = renderer.end_frame()["glDrawElementsInstanced"] // repeat
+        print(
+            f"{count:>8} {separate_draws:>9} {separate_time * 1000:>8.2f} "
+            f"{shared_draws:>12} {shared_time * 1000:>9.2f}"
+        )
+
+
+def bench_shaders(repeat):
+    """
+    Compares the time to build light_demo.py's three programs by compiling both stages
+    of each one, as the demo used to, against a ShaderManager that shares stages
+    between permutations, with no program cache and with a warm one. Drivers with a
+    shader cache of their own make every way faster after the first run.
+    """
+    from OpenGL.GL import GL_FRAGMENT_SHADER, GL_VERTEX_SHADER, glFinish, shaders
+    from Light import SHADER_DEFINES
+    from ShaderManager import ShaderManager, preprocess
+
+    _gl_context()
+    permutations = [(), ("INSTANCED", "TEXTURE_ARRAY"), ("UNLIT",)]
+    light_defines = [(name, str(value)) for name, value in SHADER_DEFINES.items()]
+    with open("shaders/normal_perspective.vert") as f:
+        vertex_source = f.read()
+    with open("shaders/specular_light.frag") as f:
+        fragment_source = f.read()
+
+    def separately():
+        for defines in permutations:
+            pairs = [(name, "") for name in defines] + light_defines
+            shaders.compileProgram(
+                shaders.compileShader(preprocess(vertex_source, pairs), GL_VERTEX_SHADER),
+                shaders.compileShader(preprocess(fragment_source, pairs), GL_FRAGMENT_SHADER),
+            )
+        glFinish()
+
+    with tempfile.TemporaryDirectory() as directory:
+        shader_directory = os.path.join(directory, "shaders")
+        shutil.copytree("shaders", shader_directory, ignore=shutil.ignore_patterns(".*"))
+
+        def managed(cache):
+            manager = ShaderManager(shader_directory, cache, SHADER_DEFINES)
+            for defines in permutations:
+                manager.program("normal_perspective.vert", "specular_light.frag", defines)
+            glFinish()
+            return manager.counts
+
+        separate_time, _ = _time(separately, repeat)
+        uncached_time, uncached = _time(lambda: managed(False), repeat)
+        managed(True)
+        cached_time, cached = _time(lambda: managed(True), repeat)
+    print(f"{'build':<22} {'ms':>8} {'compiled':>9} {'linked':>7} {'loaded':>7}")
+    print(f"{'every stage':<22} {separate_time * 1000:>8.1f} {2 * len(permutations):>9} {len(permutations):>7} {0:>7}")
+    for name, seconds, counts in [("manager", uncached_time, uncached), ("manager, cached", cached_time, cached)]:
+        print(
+            f"{name:<22} {seconds * 1000:>8.1f} {counts['compiled']:>9} {counts['linked']:>7} {counts['loaded']:>7}"
+        )
+
+
+def _flap(vertices, phase, body=0.04, amplitude=0.6):
+    """
+    Bends a bird's wings -- the vertices more than `body` from the x = 0 plane -- up and
+    down about the sides of its body, by amplitude * sin(phase) radians. Returns new
+    (n, 8) vertices with the wings' positions and normals rotated.
+    """
+    flapped = vertices.copy()
+    x = vertices[:, 0]
+    wing = np.abs(x) > body
+    side = np.sign(x[wing])
+    angle = side * amplitude * math.sin(phase)
+    cos, sin = np.cos(angle), np.sin(angle)
+    wing_x, y = x[wing] - side * body, vertices[wing, 1]
+    flapped[wing, 0] = side * body + wing_x * cos - y * sin
+    flapped[wing, 1] = wing_x * sin + y * cos
+    nx, ny = vertices[wing, 3], vertices[wing, 4]
+    flapped[wing, 3] = nx * cos - ny * sin
+    flapped[wing, 4] = nx * sin + ny * cos
+    return flapped
+
+
+def bench_dynamic_mesh(repeat):
+    """
+    Flaps the gull's wings every frame and compares ways of getting the new vertices to
+    the GPU: a new Mesh3D per frame, and each DynamicMesh mode. Shows milliseconds per
+    frame, the flap itself included, and the flushes that had to wait for the GPU.
+    """
+    import pygame
+    from OpenGL.GL import glClear, glFinish, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT
+    from DynamicMesh import DynamicMesh, supports_buffer_storage
+    from RenderProgram import RenderProgram
+
+    _gl_context()
+    program = _shader_program()
+    vertices, faces = MeshCache.load_textured_obj("models/GULL.OBJ")
+    vertices = vertices.reshape(-1, 8)
+    texture = Mesh3D.upload_mipmaps(TextureCache.load_texture("models/GULL.JPG").levels)
+    perspective = glm.perspective(math.radians(30), 1, 0.1, 100)
+    camera = glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, -10), glm.vec3(0, 1, 0))
+    frames = 60
+
+    ways = [
+        ("new Mesh3D", None, None),
+        ("subdata", "subdata", None),
+        ("orphan", "orphan", None),
+        ("ring, mapped", "ring", False),
+    ]
+    if supports_buffer_storage():
+        ways.append(("ring, persistent", "ring", True))
+    print(f"{len(vertices)} vertices, {vertices.nbytes / 1024:.1f} KiB per frame")
+    print(f"{'upload':<18} {'ms/frame':>9} {'stalls':>7}")
+    for name, mode, persistent in ways:
+        if mode is None:
+            mesh = Mesh3D(vertices.reshape(-1), faces, texture)
+        else:
+            mesh = DynamicMesh(vertices, faces, texture, mode=mode, persistent=persistent)
+        bird = Object3D(mesh)
+        bird.move(glm.vec3(0, 0, -2))
+        bird.rotate(glm.vec3(0.3, 0.5, 0))
+        renderer = RenderProgram()
+
+        def animate():
+            for frame in range(frames):
+                flapped = _flap(vertices, frame * 0.3)
+                if mode is None:
+                    bird.mesh.delete()
+                    bird.mesh = Mesh3D(flapped.reshape(-1), faces, texture)
+                else:
+                    bird.mesh.update(flapped)
+                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+                renderer.use_program(program)
+                renderer.render(perspective, camera, [bird])
+                pygame.display.flip()
+            glFinish()
+
+        seconds, _ = _time(animate, repeat)
+        stalls = getattr(bird.mesh, "stalls", 0)
+        print(f"{name:<18} {seconds / frames * 1000:>9.2f} {stalls:>7}")
+        bird.mesh.delete()
+
+
+def bench_asset_loading(repeat):
+    """
+    Compares the time from startup to the first frame when every bundled model is
+    loaded before drawing (AssetManager) against loading them in the background
+    (AssetLoader), with a cold and a warm mesh cache. Also shows when the background
+    loads finish and the longest frame while they upload.
+    """
+    import pygame
+    from OpenGL.GL import glClear, glFinish, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT
+    from Light import Light
+    from RenderProgram import RenderProgram
+
+    _gl_context()
+    program = _shader_program()
+    perspective = glm.perspective(math.radians(30), 1, 0.1, 100)
+    camera = glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, -10), glm.vec3(0, 1, 0))
+    scene = [
+        ("models/bunny.obj", "models/dice.png", 1),
+        ("models/cube.obj", "models/wall.jpg", 1),
+        ("models/GULL.OBJ", "models/GULL.JPG", 4),
+        ("models/goose.OBJ", "models/bird_texture.jpg", 1),
+        ("models/dice.obj", "models/dice.png", 1),
+    ]
+
+    def frame(renderer, objects):
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        if objects:
+            renderer.use_program(program)
+            renderer.render(perspective, camera, objects)
+        pygame.display.flip()
+        glFinish()
+
+    def load(directory, background):
+        """
+        Starts up the scene from `directory`. Returns the seconds to the first frame and
+        to the frame where everything is drawn, and the longest frame in between.
+        """
+        start = time.perf_counter()
+        assets = AssetManager()
+        renderer = RenderProgram()
+        renderer.set_lights([Light.directional(glm.vec3(-1, -1, -1))])
+        loader = AssetLoader(assets) if background else assets
+        objects = []
+        for obj_filename, texture_filename, levels in scene:
+            obj_filename = os.path.join(directory, obj_filename)
+            texture_filename = os.path.join(directory, texture_filename)
+            if levels > 1:
+                objects.append(loader.load_lod_object(obj_filename, texture_filename, levels))
+            else:
+                objects.append(loader.load_object(obj_filename, texture_filename))
+        first_frame = longest = None
+        while True:
+            frame_start = time.perf_counter()
+            if background:
+                loader.update()
+            frame(renderer, loader.ready(objects) if background else objects)
+            now = time.perf_counter()
+            if first_frame is None:
+                first_frame = now - start
+            else:
+                longest = max(longest or 0, now - frame_start)
+            if not background or not loader.pending:
+                break
+        if background:
+            loader.close()
+        for o in objects:
+            assets.release_object(o)
+        return first_frame, now - start, longest
+
+    print(f"{'cache':<6} {'loading':<11} {'first frame ms':>14} {'all drawn ms':>13} {'longest frame ms':>17}")
+    for background in (False, True):
+        cold, warm = [], []
+        for _ in range(repeat):
+            # A fresh copy of the models, so the first load starts without a mesh cache.
+            with tempfile.TemporaryDirectory() as directory:
+                shutil.copytree("models", os.path.join(directory, "models"), ignore=shutil.ignore_patterns(".*"))
+                cold.append(load(directory, background))
+                warm.append(load(directory, background))
+        for label, results in (("cold", cold), ("warm", warm)):
+            first_frame, drawn, longest = min(results)
+            longest = f"{longest * 1000:>17.1f}" if longest is not None else f"{'-':>17}"
+            print(
+                f"{label:<6} {'background' if background else 'upfront':<11} {first_frame * 1000:>14.1f} "
+                f"{drawn * 1000:>13.1f} {longest}"
+            )
+
+
+BENCHMARKS = {
+    "obj_loader": bench_obj_loader,
+    "mesh_cache": bench_mesh_cache,
+    "obj_memory": bench_obj_memory,
+    "lods": bench_lods,
+    "normals": bench_normals,
+    "mesh_optimizer": bench_mesh_optimizer,
+    "vertex_formats": bench_vertex_formats,
+    "textures": bench_textures,
+    "mesh_memory": bench_mesh_memory,
+    "scene_graph": bench_scene_graph,
+    "transforms": bench_transforms,
+    "instancing": bench_instancing,
+    "texture_array": bench_texture_array,
+    "shaders": bench_shaders,
+    "dynamic_mesh": bench_dynamic_mesh,
+    "asset_loading": bench_asset_loading,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS), nargs="+")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for name in args.benchmark:
+        print(f"== {name}")
+        BENCHMARKS[name](args.repeat)
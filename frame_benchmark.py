@@ -0,0 +1,305 @@
+"""
+Reproducible frame-time benchmark. Renders scripted scenes offscreen (see Headless.py)
+for a fixed number of frames, and prints CPU frame times, GPU times from GL_TIME_ELAPSED
+queries, and GL call counts per frame as JSON:
+
+    python frame_benchmark.py
+    python frame_benchmark.py gull trees_10k --frames 300 --output results.json
+
+Every camera and object path depends only on the frame number, so two runs render the
+same frames. The first few frames of each scene warm up caches and the driver, and are
+left out of the results.
+
+GPU times are only as good as the driver's timer queries: Mesa's llvmpipe, for one,
+doesn't time its rasterizer threads, so on software contexts compare CPU and frame times.
+"""
+import Headless
+
+import argparse
+import ctypes
+import json
+import math
+import time
+from collections import Counter
+
+import glm
+import numpy as np
+from OpenGL.GL import *
+# PyOpenGL's wrapped glGetQueryObjectui64v can't convert its 64-bit output.
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+
+from AssetManager import AssetManager
+from Light import Light, MAX_LIGHTS, SHADER_DEFINES
+from Object3D import Object3D
+from RenderProgram import RenderProgram
+from RenderQueue import RenderQueue
+from ShaderManager import ShaderManager
+
+
+def _orbit(t, radius, height, target=glm.vec3(0, 0, 0)):
+    """
+    Gets a view matrix circling `target` once as t goes from 0 to 1.
+    """
+    angle = 2 * math.pi * t
+    eye = target + glm.vec3(radius * math.sin(angle), height, radius * math.cos(angle))
+    return glm.lookAt(eye, target, glm.vec3(0, 1, 0))
+
+
+def _grid(mesh, count, spacing, scale):
+    """
+    Lays out `count` objects sharing `mesh` on a square grid on the y = 0 plane, centered
+    on the origin.
+    """
+    side = math.ceil(math.sqrt(count))
+    objects = []
+    for i in range(count):
+        o = Object3D(mesh)
+        o.move(glm.vec3((i % side - (side - 1) / 2) * spacing, 0, (i // side - (side - 1) / 2) * spacing))
+        o.grow(glm.vec3(scale, scale, scale))
+        objects.append(o)
+    return objects
+
+
+class BunnyScene:
+    """
+    The textured bunny spinning under an orbiting point light.
+    """
+
+    def __init__(self, assets, programs):
+        self.programs = programs
+        self.bunny = assets.load_object("models/bunny.obj", "models/dice.png")
+        self.bunny.center_point(glm.vec3(-0.03, 0.07, 0))
+        self.bunny.grow(glm.vec3(5, 5, 5))
+        self.light = Light.point(glm.vec3(0, 1, 2), attenuation=glm.vec3(1, 0.1, 0))
+
+    def update(self, renderer, t):
+        self.bunny.rotate(glm.vec3(0, 2 * math.pi * t, 0) - self.bunny.orientation)
+        self.light.position = glm.vec3(2 * math.sin(4 * math.pi * t), 1, 2 * math.cos(4 * math.pi * t))
+        renderer.set_lights([self.light])
+        return _orbit(t, 3, 0.5)
+
+    def draw(self, renderer, queue, projection, view):
+        queue.submit_object(self.programs["lighting"], self.bunny)
+        queue.flush(projection, view)
+
+    def release(self, assets):
+        assets.release_object(self.bunny)
+
+
+class GullScene:
+    """
+    The gull flying away from the camera and back, switching levels of detail as it goes.
+    """
+
+    def __init__(self, assets, programs):
+        self.programs = programs
+        self.gull = assets.load_lod_object("models/GULL.OBJ", "models/GULL.JPG")
+        self.gull.grow(glm.vec3(4, 4, 4))
+        self.light = Light.directional(glm.vec3(-1, -1, -1))
+        self.viewport_height = glGetIntegerv(GL_VIEWPORT)[3]
+
+    def update(self, renderer, t):
+        # Out to 40 units and back, banking gently.
+        distance = 2 + 38 * math.sin(math.pi * t)
+        self.gull.move(glm.vec3(0, 0, -distance) - self.gull.position)
+        self.gull.rotate(glm.vec3(0, 0, 0.3 * math.sin(6 * math.pi * t)) - self.gull.orientation)
+        renderer.set_lights([self.light])
+        return glm.lookAt(glm.vec3(0, 0.5, 0), glm.vec3(0, 0, -10), glm.vec3(0, 1, 0))
+
+    def draw(self, renderer, queue, projection, view):
+        self.gull.select_lod(projection, view, self.viewport_height)
+        queue.submit_object(self.programs["lighting"], self.gull)
+        queue.flush(projection, view)
+
+    def release(self, assets):
+        assets.release_object(self.gull)
+
+
+class TreesScene:
+    """
+    A grid of identical objects drawn with instancing, seen from an orbiting camera. The
+    demo's trees9.obj isn't bundled, so the textured cube stands in for the trees.
+    """
+
+    def __init__(self, assets, programs, count):
+        self.programs = programs
+        self.count = count
+        self.mesh = assets.load_mesh("models/cube.obj", "models/woodbox.png")
+        self.trees = _grid(self.mesh, count, spacing=1, scale=0.5)
+        self.side = math.ceil(math.sqrt(count))
+        self.light = Light.directional(glm.vec3(-1, -2, -1))
+
+    def update(self, renderer, t):
+        renderer.set_lights([self.light])
+        return _orbit(t, 0.8 * self.side, 0.3 * self.side)
+
+    def draw(self, renderer, queue, projection, view):
+        renderer.use_program(self.programs["lighting_instanced"])
+        renderer.render_instanced(projection, view, self.trees)
+
+    def release(self, assets):
+        # The trees share one reference to the mesh.
+        assets.release_mesh(self.mesh)
+
+
+class ManyLightsScene:
+    """
+    A 10 x 10 grid of cubes lit by MAX_LIGHTS colored point lights circling over it, so
+    that every object is lit by a different subset of the lights.
+    """
+
+    def __init__(self, assets, programs):
+        self.programs = programs
+        self.mesh = assets.load_mesh("models/cube.obj", "models/woodbox.png")
+        self.cubes = _grid(self.mesh, 100, spacing=1.5, scale=0.5)
+        self.lights = [
+            Light.point(
+                glm.vec3(0, 0, 0),
+                glm.vec3(0.5 + 0.5 * math.cos(i), 0.5 + 0.5 * math.cos(i + 2), 0.5 + 0.5 * math.cos(i + 4)),
+                attenuation=glm.vec3(1, 0.5, 2),
+            )
+            for i in range(MAX_LIGHTS)
+        ]
+
+    def update(self, renderer, t):
+        for i, light in enumerate(self.lights):
+            angle = 2 * math.pi * (t + i / len(self.lights))
+            radius = 2 + 5 * (i % 4) / 3
+            light.position = glm.vec3(radius * math.sin(angle), 1, radius * math.cos(angle))
+        renderer.set_lights(self.lights)
+        return _orbit(t, 14, 8)
+
+    def draw(self, renderer, queue, projection, view):
+        for cube in self.cubes:
+            queue.submit_object(self.programs["lighting"], cube)
+        queue.flush(projection, view)
+
+    def release(self, assets):
+        assets.release_mesh(self.mesh)
+
+
+SCENES = {
+    "bunny": BunnyScene,
+    "gull": GullScene,
+    "trees_1k": lambda assets, programs: TreesScene(assets, programs, 1000),
+    "trees_10k": lambda assets, programs: TreesScene(assets, programs, 10000),
+    "many_lights": ManyLightsScene,
+}
+
+
+def _summary(values):
+    """
+    Gets the mean, percentiles and extremes of a list of times in milliseconds.
+    """
+    values = np.asarray(values)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "mean": round(float(values.mean()), 4),
+        "p50": round(float(p50), 4),
+        "p95": round(float(p95), 4),
+        "p99": round(float(p99), 4),
+        "min": round(float(values.min()), 4),
+        "max": round(float(values.max()), 4),
+    }
+
+
+def run_scene(name, context, programs, frames, warmup):
+    """
+    Renders `warmup` + `frames` frames of the named scene, and gets the timings and call
+    counts of the last `frames`. The scene's meshes, textures and uniform buffers are
+    deleted afterwards, so every scene starts from the same GL state whatever ran
+    before it.
+    """
+    assets = AssetManager()
+    renderer = RenderProgram()
+    renderer.set_uniform("ambientColor", glm.vec3(0.1, 0.1, 0.1), glm.vec3)
+    queue = RenderQueue(renderer)
+    scene = SCENES[name](assets, programs)
+    projection = glm.perspective(math.radians(30), context.width / context.height, 0.1, 100)
+
+    queries = glGenQueries(frames)
+    cpu_ms, frame_ms, calls = [], [], Counter()
+    for frame in range(-warmup, frames):
+        # Warm-up frames replay the start of the path.
+        t = max(frame, 0) / frames
+        start = time.perf_counter()
+        if frame >= 0:
+            glBeginQuery(GL_TIME_ELAPSED, queries[frame])
+        glClearColor(0.529, 0.808, 0.922, 1.0)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        view = scene.update(renderer, t)
+        scene.draw(renderer, queue, projection, view)
+        if frame >= 0:
+            glEndQuery(GL_TIME_ELAPSED)
+        submitted = time.perf_counter()
+        # Stands in for the buffer swap, which waits for the GPU in the windowed demo.
+        glFinish()
+        finished = time.perf_counter()
+
+        counts = renderer.end_frame() + queue.end_frame()
+        if frame >= 0:
+            cpu_ms.append((submitted - start) * 1000)
+            frame_ms.append((finished - start) * 1000)
+            calls.update(counts)
+
+    gpu_ms = []
+    for query in queries:
+        elapsed = ctypes.c_uint64()
+        glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(elapsed))
+        gpu_ms.append(elapsed.value / 1e6)
+    glDeleteQueries(frames, queries)
+    scene.release(assets)
+    renderer.delete()
+
+    return {
+        "cpu_ms": _summary(cpu_ms),
+        "frame_ms": _summary(frame_ms),
+        "gpu_ms": _summary(gpu_ms),
+        "per_frame": {key: calls[key] / frames for key in sorted(calls)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenes", nargs="*", help=f"any of {', '.join(SCENES)} (default: all)")
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--output", help="write the JSON here instead of to stdout")
+    args = parser.parse_args()
+    unknown = set(args.scenes) - set(SCENES)
+    if unknown:
+        parser.error(f"unknown scenes: {', '.join(sorted(unknown))}")
+
+    context = Headless.OffscreenContext(args.width, args.height)
+    shader_manager = ShaderManager(defines=SHADER_DEFINES)
+    programs = {
+        "lighting": shader_manager.program("normal_perspective.vert", "specular_light.frag"),
+        "lighting_instanced": shader_manager.program(
+            "normal_perspective.vert", "specular_light.frag", ["INSTANCED"]
+        ),
+    }
+    results = {
+        "renderer": glGetString(GL_RENDERER).decode(),
+        "version": glGetString(GL_VERSION).decode(),
+        "width": args.width,
+        "height": args.height,
+        "frames": args.frames,
+        "warmup": args.warmup,
+        "scenes": {},
+    }
+    for name in args.scenes or list(SCENES):
+        results["scenes"][name] = run_scene(name, context, programs, args.frames, args.warmup)
+    context.close()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
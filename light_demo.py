@@ -10,6 +10,13 @@ from numpy import array
 from OpenGL.GL import shaders
 
 from RenderProgram import *
+from Light import Light, SHADER_DEFINES
+from RenderQueue import RenderQueue
+from AssetManager import AssetManager
+from AssetLoader import AssetLoader
+from TextureArray import TextureArray, prepare_layers
+from Profiler import profiler, ProfilerOverlay
+from ShaderManager import ShaderManager
 import time
 import math
 
@@ -20,19 +27,8 @@ def load_obj(filename) -> Object3D:
         return Object3D(Mesh3D.load_obj(f))
 
 
-def load_textured_obj(filename, texture_filename) -> Object3D:
-    with open(filename) as f:
-        return Object3D(
-            Mesh3D.load_textured_obj(f, pygame.image.load(texture_filename))
-        )
-
-
-def load_shader_source(filename):
-    with open(filename) as f:
-        return f.read()
-
-
 if __name__ == "__main__":
+    startup = time.perf_counter()
     pygame.init()
 
     screen_width = 800
@@ -55,54 +51,59 @@ if __name__ == "__main__":
         DOUBLEBUF | OPENGL,
     )
     pygame.display.set_caption("specular lighting demo")
+    # Meshes and textures used by several objects are only loaded once. They load in the
+    # background, and each object is drawn once its meshes are uploaded.
+    assets = AssetManager()
+    loader = AssetLoader(assets)
     #bunny
-    bunny = load_textured_obj("models/bunny_textured.obj", "models/dice.png")
+    bunny = loader.load_object("models/bunny_textured.obj", "models/dice.png")
     bunny.center_point(glm.vec3(-0.03, 0.07, 0))
     bunny.move(glm.vec3(0.1, -0.5, -3))
     bunny.grow(glm.vec3(5, 5, 5))
     #positional light
-    light = load_textured_obj("models/cube.obj", "models/wall.jpg")
+    light = loader.load_object("models/cube.obj", "models/wall.jpg")
     light.center_point(glm.vec3(0, 0, -10))
     light.move(glm.vec3(0, 0, -1))
     light.grow(glm.vec3(0.01, 0.01, 0.01))
     ##added bird
-    bird = load_textured_obj("models/bird.obj", "models/wall.jpg")
+    # The bird is far away and small on screen, so it switches to simpler levels of detail.
+    bird = loader.load_lod_object("models/bird.obj", "models/wall.jpg")
     bird.center_point(glm.vec3(0, 0, 0))
     bird.move(glm.vec3(-3, 4.5, -10))
     bird.grow(glm.vec3(0.08, 0.08, 0.08))  # Adjust the scale factors to make the bird smaller
     bird.rotate(glm.vec3(x, y, 0.0))  # Rotate the bird forward around the x-axis and face right around the y-axis
-    tree1 = load_textured_obj("models/trees9.obj", "models/icon.png")
+    tree1 = loader.load_object("models/trees9.obj", "models/icon.png")
     tree1.center_point(glm.vec3(0, 0, 0))
     tree1.move(glm.vec3(-5, 0, -10))
     tree1.grow(glm.vec3(0.1, 0.1, 0.1))  # Decrease the size by 10 times
 
-    tree2 = load_textured_obj("models/trees9.obj", "models/icon.png")
+    tree2 = loader.load_object("models/trees9.obj", "models/icon.png")
     tree2.center_point(glm.vec3(0, 0, 0))
     tree2.move(glm.vec3(5, 0, -10))
     tree2.grow(glm.vec3(0.1, 0.1, 0.1))  # Decrease the size by 10 times
+    # The trees' textures share one texture array, so both trees are drawn in a single
+    # instanced draw even though they look different.
+    forest_textures = ["models/icon.png", "models/woodbox.png"]
+    forest_layers = loader.executor.submit(prepare_layers, forest_textures)
+    forest = None
 
-    # Load the vertex and fragment shaders for this program.
-    vertex_shader = shaders.compileShader(
-        load_shader_source("shaders/normal_perspective.vert"), GL_VERTEX_SHADER
-    )
-    fragment_shader = shaders.compileShader(
-        load_shader_source("shaders/specular_light.frag"), GL_FRAGMENT_SHADER
-    )
-    shader_lighting = shaders.compileProgram(
-        vertex_shader, fragment_shader
-    )
+    # Build the shader programs. The shader manager compiles each shader once, loads
+    # programs linked on an earlier run from its cache, and reloads them when the files
+    # in shaders/ change.
+    shader_manager = ShaderManager(defines=SHADER_DEFINES)
+    shader_lighting = shader_manager.program("normal_perspective.vert", "specular_light.frag")
 
-    # Compile a second shader for drawing the "light" cube, which should
-    # not light *itself*.
-    vertex_shader = shaders.compileShader(
-        load_shader_source("shaders/normal_perspective.vert"), GL_VERTEX_SHADER
-    )
-    fragment_shader = shaders.compileShader(
-        load_shader_source("shaders/texture_mapped.frag"), GL_FRAGMENT_SHADER
+    # The same lighting, with the model matrix and texture array layer supplied per
+    # instance, for drawing every tree in one call.
+    shader_lighting_instanced = shader_manager.program(
+        "normal_perspective.vert", "specular_light.frag", ["INSTANCED", "TEXTURE_ARRAY"]
     )
-    shader_no_lighting = shaders.compileProgram(vertex_shader, fragment_shader)
+
+    # A second program for drawing the "light" cube, which should not light *itself*.
+    shader_no_lighting = shader_manager.program("normal_perspective.vert", "specular_light.frag", ["UNLIT"])
 
     renderer = RenderProgram()
+    queue = RenderQueue(renderer)
     # Define the scene.
     camera = glm.lookAt(
         glm.vec3(0, 0, 10), glm.vec3(0, 0, -10), glm.vec3(0, 1, 0)
@@ -118,8 +119,8 @@ if __name__ == "__main__":
     renderer.set_uniform(
         "ambientColor", ambient_color * ambient_intensity, glm.vec3
     )
-    renderer.set_uniform("pointPosition", point_position, glm.vec3)
-    renderer.set_uniform("pointColor", glm.vec3(1, 1, 1), glm.vec3)
+    point_light = Light.point(point_position, glm.vec3(1, 1, 1))
+    renderer.set_lights([point_light])
 
     # Loop
     done = False
@@ -127,6 +128,7 @@ if __name__ == "__main__":
     start = time.perf_counter()
 
     keys_down = set()
+    overlay = None
     spin = False
     bird_speed = 0.001
     bird_direction = 1
@@ -139,6 +141,11 @@ if __name__ == "__main__":
                 done = True
             elif event.type == pygame.KEYDOWN:
                 keys_down.add(event.dict["key"])
+                # F3 turns the profiler and its overlay on and off.
+                if event.dict["key"] == pygame.K_F3:
+                    profiler.enabled = not profiler.enabled
+                    if profiler.enabled and overlay is None:
+                        overlay = ProfilerOverlay(profiler, shader_manager)
             elif event.type == pygame.KEYUP:
                 keys_down.remove(event.dict["key"])
 
@@ -172,12 +179,16 @@ if __name__ == "__main__":
             bunny.rotate(glm.vec3(0, -0.001, 0))
         elif pygame.K_z in keys_down:
             light.move(glm.vec3(-0.1, 0, 0))
-            renderer.set_uniform("pointPosition", light.position, glm.vec3)
+            point_light.position = light.position
+            renderer.set_lights([point_light])
         elif pygame.K_x in keys_down:
             light.move(glm.vec3(0.1, 0, 0))
-            renderer.set_uniform("pointPosition", light.position, glm.vec3)
+            point_light.position = light.position
+            renderer.set_lights([point_light])
         elif pygame.K_SPACE in keys_down:
             spin = not spin
+        profiler.lap("input")
+
         bird.move(glm.vec3(bird_speed * bird_direction, 0, 0))
 
         if bird.position.x > 3:
@@ -200,29 +211,59 @@ if __name__ == "__main__":
             background_color[0] = light_intensity * 0.529  # Red component
             background_color[1] = light_intensity * 0.808  # Green component
             background_color[2] = light_intensity * 0.922  # Blue component
+        profiler.lap("update")
+
+        if loader.pending:
+            loader.update()
+            if not loader.pending:
+                print(f"assets loaded {time.perf_counter() - startup:.3f} s after startup")
+                assets.print_report()
+        if forest is None and forest_layers.done():
+            forest = TextureArray(forest_textures, prepared=forest_layers.result())
+            tree2.texture_layer = forest.layer("models/woodbox.png")
+        # Edited shaders are relinked in place, so only their cached uniforms need resetting.
+        for program in shader_manager.poll():
+            renderer.forget_program(program)
+        profiler.lap("load")
+
+        with profiler.gpu_scope("render"):
+            # Set the background color
+            glClearColor(*background_color, 1.0)
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)  # Clear color and depth buffers
+
+            point_light.position = point_position
+            renderer.set_lights([point_light])
+            # Draw the bunny and the bird with lighting, and the light source without
+            # lighting itself. The queue sorts these by program, texture and mesh.
+            for o in loader.ready([bird]):
+                o.select_lod(perspective, camera, screen_height)
+            for o in loader.ready([bunny, bird]):
+                queue.submit_object(shader_lighting, o)
+            for o in loader.ready([light]):
+                queue.submit_object(shader_no_lighting, o)
+            queue.flush(perspective, camera)
 
-        # Set the background color
-        glClearColor(*background_color, 1.0)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)  # Clear color and depth buffers
-
-        # Draw the bunny with lighting.
-        renderer.use_program(shader_lighting)
-        renderer.set_uniform("pointPosition", point_position, glm.vec3)
-        renderer.render(perspective, camera, [bunny])
-        # Draw the bird with lighting.
-        renderer.use_program(shader_lighting)
-        renderer.set_uniform("pointPosition", point_position, glm.vec3)
-        renderer.render(perspective, camera, [bird])
-
-        # Draw the trees without lighting.
-        renderer.use_program(shader_lighting)
-        renderer.render(perspective, camera, [tree1, tree2])
-        # Draw the light source without lighting itself.
-        renderer.use_program(shader_no_lighting)
-        renderer.render(perspective, camera, [light])
+            # Draw the trees.
+            trees = loader.ready([tree1, tree2])
+            if trees and forest is not None:
+                renderer.use_program(shader_lighting_instanced)
+                renderer.render_instanced(perspective, camera, trees, texture_array=forest)
+        profiler.lap("render")
 
+        if profiler.enabled:
+            overlay.draw()
         pygame.display.flip()
+        profiler.lap("flip")
         end = time.perf_counter()
         frames += 1
+        if frames == 1:
+            print(f"first frame {end - startup:.3f} s after startup")
+        renderer.end_frame()
+        queue.end_frame()
+        profiler.end_frame()
         # print(f"{frames/(end - start)} FPS")
+    loader.close()
+    if profiler.events:
+        profiler.export_chrome_trace("profile_trace.json")
+        print("\n".join(profiler.report_lines()))
     pygame.quit()
@@ -3,7 +3,25 @@ in vec2 TexCoord;
 layout (location=0) out vec4 FragColor;
 
 uniform sampler2D ourTexture;
-uniform vec3 ambientColor;
+// ShaderManager defines these from Light.SHADER_DEFINES, which also sizes the block in
+// UniformBlocks.py.
+#if !defined(MAX_LIGHTS) || !defined(MAX_OBJECT_LIGHTS)
+#error MAX_LIGHTS and MAX_OBJECT_LIGHTS must be defined (see Light.SHADER_DEFINES)
+#endif
+
+// Ambient light plus up to MAX_LIGHTS directional, point and spot lights, shared by
+// every program (see UniformBlocks.py and Light.py).
+layout (std140) uniform Lights {
+    vec3 ambientColor;
+    // xyz: position, w: kind (0 = directional, 1 = point, 2 = spot).
+    vec4 lightPositions[MAX_LIGHTS];
+    // xyz: direction the light shines in, w: cosine of a spot light's outer angle.
+    vec4 lightDirections[MAX_LIGHTS];
+    // rgb: color, w: cosine of a spot light's inner angle.
+    vec4 lightColors[MAX_LIGHTS];
+    // xyz: constant, linear and quadratic attenuation.
+    vec4 lightAttenuations[MAX_LIGHTS];
+};
 void main() {
     vec3 ambient = ambientColor;
     FragColor = vec4(ambient, 1) * texture(ourTexture, TexCoord);
@@ -2,8 +2,12 @@
 layout (location=0) in vec3 vPosition;
 layout (location=1) in vec3 vColor;
 
-uniform mat4 projection;
-uniform mat4 view;
+// Camera state shared by every program, written once per frame (see UniformBlocks.py).
+layout (std140) uniform Frame {
+    mat4 projection;
+    mat4 view;
+    vec3 cameraPosition;
+};
 uniform mat4 model;
 
 out vec3 VertexColor;
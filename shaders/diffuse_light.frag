@@ -7,19 +7,62 @@ in vec3 FragPos;
 layout (location=0) out vec4 FragColor;
 
 uniform sampler2D ourTexture;
-// Lighting parameters for ambient light, and a single point light w/ no attenuation.
-uniform vec3 ambientColor;
-uniform vec3 pointPosition;
-uniform vec3 pointColor;
+// ShaderManager defines these from Light.SHADER_DEFINES, which also sizes the block in
+// UniformBlocks.py.
+#if !defined(MAX_LIGHTS) || !defined(MAX_OBJECT_LIGHTS)
+#error MAX_LIGHTS and MAX_OBJECT_LIGHTS must be defined (see Light.SHADER_DEFINES)
+#endif
+
+// Ambient light plus up to MAX_LIGHTS directional, point and spot lights, shared by
+// every program (see UniformBlocks.py and Light.py).
+layout (std140) uniform Lights {
+    vec3 ambientColor;
+    // xyz: position, w: kind (0 = directional, 1 = point, 2 = spot).
+    vec4 lightPositions[MAX_LIGHTS];
+    // xyz: direction the light shines in, w: cosine of a spot light's outer angle.
+    vec4 lightDirections[MAX_LIGHTS];
+    // rgb: color, w: cosine of a spot light's inner angle.
+    vec4 lightColors[MAX_LIGHTS];
+    // xyz: constant, linear and quadratic attenuation.
+    vec4 lightAttenuations[MAX_LIGHTS];
+};
+// The lights that can reach the object being drawn (see RenderProgram.render).
+uniform int lightIndices[MAX_OBJECT_LIGHTS];
+uniform int lightCount;
+
+// Gets the direction from the fragment towards light i, and the light's color after
+// attenuation and spot cone falloff.
+vec3 incidentLight(int i, out vec3 lightDir) {
+    vec4 position = lightPositions[i];
+    if (position.w == 0.0) {
+        lightDir = -normalize(lightDirections[i].xyz);
+        return lightColors[i].rgb;
+    }
+
+    vec3 toLight = position.xyz - FragPos;
+    float distance = length(toLight);
+    lightDir = toLight / distance;
+    vec3 k = lightAttenuations[i].xyz;
+    float attenuation = 1.0 / (k.x + k.y * distance + k.z * distance * distance);
+    if (position.w == 2.0) {
+        float cosine = dot(-lightDir, normalize(lightDirections[i].xyz));
+        attenuation *= smoothstep(lightDirections[i].w, lightColors[i].w, cosine);
+    }
+    return attenuation * lightColors[i].rgb;
+}
 
 void main() {
     vec3 norm = normalize(Normal);
-    vec3 lightDir = normalize(pointPosition - FragPos);  
-    float cosineLight = max(dot(norm, lightDir), 0.0);
 
-    // Compute the ambient and diffuse components.
+    // Compute the ambient component, and sum the diffuse component of every light.
     vec3 ambient = ambientColor;
-    vec3 diffuse = cosineLight * pointColor;
+    vec3 diffuse = vec3(0.0);
+    for (int j = 0; j < lightCount; j++) {
+        vec3 lightDir;
+        vec3 lightColor = incidentLight(lightIndices[j], lightDir);
+        float cosineLight = max(dot(norm, lightDir), 0.0);
+        diffuse += cosineLight * lightColor;
+    }
 
     // Assemble the final fragment color.
     FragColor = vec4(diffuse + ambient, 1) * texture(ourTexture, TexCoord);
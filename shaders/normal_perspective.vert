@@ -1,14 +1,34 @@
 #version 330
+// Permutations (see ShaderManager.py):
+//   INSTANCED: the model matrix is a per-instance attribute instead of a uniform, for
+//     drawing every instance in one call (see RenderProgram.render_instanced).
+//   TEXTURE_ARRAY: with INSTANCED, each instance also picks a layer of a texture array.
+
 // Vertex attributes: position, normal, texture coordinates.
 layout (location=0) in vec3 vPosition;
 layout (location=1) in vec3 vNormal;
 layout (location=2) in vec2 vTexCoord;
 
-// Matrices for model (local->world), view (world->view), 
-// and projection (view->clip).
-uniform mat4 projection;
-uniform mat4 view;
+// Matrices for view (world->view) and projection (view->clip), and the camera position,
+// shared by every program and written once per frame (see UniformBlocks.py).
+layout (std140) uniform Frame {
+    mat4 projection;
+    mat4 view;
+    vec3 cameraPosition;
+};
+#ifdef INSTANCED
+// Per-instance attribute: the model (local->world) matrix of this instance.
+// A mat4 attribute occupies locations 3, 4, 5 and 6, one column each.
+layout (location=3) in mat4 instanceModel;
+#define model instanceModel
+#else
+// Matrix for model (local->world).
 uniform mat4 model;
+#endif
+#ifdef TEXTURE_ARRAY
+// Per-instance attribute: the layer of the texture array this instance samples.
+layout (location=7) in float instanceLayer;
+#endif
 
 // The outputs of the this shader: 
 //   the world-space coordinate of this vertex, which will be interpolated as a fragment position.
@@ -17,6 +37,9 @@ uniform mat4 model;
 out vec3 FragPos;
 out vec3 Normal;
 out vec2 TexCoord;
+#ifdef TEXTURE_ARRAY
+flat out float TexLayer;
+#endif
 
 void main() {
     // Project the position to clip space.
@@ -27,4 +50,7 @@ void main() {
     Normal = mat3(transpose(inverse(model))) * vNormal;  
     
     TexCoord = vTexCoord;
+#ifdef TEXTURE_ARRAY
+    TexLayer = instanceLayer;
+#endif
 }
\ No newline at end of file
@@ -0,0 +1,8 @@
+#version 410
+in vec2 TexCoord;
+uniform sampler2D ourTexture;
+layout (location=0) out vec4 FragColor;
+
+void main() {
+    FragColor = texture(ourTexture, TexCoord);
+}
@@ -0,0 +1,10 @@
+#version 410
+// Draws a screen-aligned textured rectangle from 4 vertices with no vertex buffer.
+uniform vec4 rect; // left, top, width and height, in normalized device coordinates
+out vec2 TexCoord;
+
+void main() {
+    vec2 corner = vec2(gl_VertexID & 1, gl_VertexID >> 1);
+    TexCoord = vec2(corner.x, 1.0 - corner.y);
+    gl_Position = vec4(rect.x + corner.x * rect.z, rect.y - corner.y * rect.w, 0.0, 1.0);
+}
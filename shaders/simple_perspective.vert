@@ -1,8 +1,12 @@
 #version 330
 layout (location=0) in vec3 vPosition;
 
-uniform mat4 projection;
-uniform mat4 view;
+// Camera state shared by every program, written once per frame (see UniformBlocks.py).
+layout (std140) uniform Frame {
+    mat4 projection;
+    mat4 view;
+    vec3 cameraPosition;
+};
 uniform mat4 model;
 
 void main() {
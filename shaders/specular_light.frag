@@ -1,36 +1,117 @@
 #version 330
+// Permutations (see ShaderManager.py):
+//   UNLIT: the texture's colors as they are, for objects that shouldn't be lit, such as
+//     the light source itself.
+//   UNTEXTURED: lighting and material colors without a texture.
+//   TEXTURE_ARRAY: sample layer TexLayer of a texture array (see TextureArray.py).
 in vec3 Normal;
 in vec2 TexCoord;
 in vec3 FragPos;
+#ifdef TEXTURE_ARRAY
+flat in float TexLayer;
+#endif
 
 // This is the proper way to set the color of the fragment, NOT using gl_FragColor.
 layout (location=0) out vec4 FragColor;
 
+#ifdef TEXTURE_ARRAY
+uniform sampler2DArray ourTexture;
+#else
 uniform sampler2D ourTexture;
-// Lighting parameters for ambient light, and a single point light w/ no attenuation.
-uniform vec3 ambientColor;
-uniform vec3 pointPosition;
-uniform vec3 pointColor;
-uniform vec3 cameraPosition;
+#endif
+// ShaderManager defines these from Light.SHADER_DEFINES, which also sizes the block in
+// UniformBlocks.py.
+#if !defined(MAX_LIGHTS) || !defined(MAX_OBJECT_LIGHTS)
+#error MAX_LIGHTS and MAX_OBJECT_LIGHTS must be defined (see Light.SHADER_DEFINES)
+#endif
 
-const float shininess = 32.0;
+// Ambient light plus up to MAX_LIGHTS directional, point and spot lights, shared by
+// every program (see UniformBlocks.py and Light.py).
+layout (std140) uniform Lights {
+    vec3 ambientColor;
+    // xyz: position, w: kind (0 = directional, 1 = point, 2 = spot).
+    vec4 lightPositions[MAX_LIGHTS];
+    // xyz: direction the light shines in, w: cosine of a spot light's outer angle.
+    vec4 lightDirections[MAX_LIGHTS];
+    // rgb: color, w: cosine of a spot light's inner angle.
+    vec4 lightColors[MAX_LIGHTS];
+    // xyz: constant, linear and quadratic attenuation.
+    vec4 lightAttenuations[MAX_LIGHTS];
+};
+// The lights that can reach the object being drawn (see RenderProgram.render).
+uniform int lightIndices[MAX_OBJECT_LIGHTS];
+uniform int lightCount;
+// Camera state shared by every program, written once per frame (see UniformBlocks.py).
+layout (std140) uniform Frame {
+    mat4 projection;
+    mat4 view;
+    vec3 cameraPosition;
+};
+
+// The material of the submesh being drawn (see Material.py). The defaults leave the
+// texture's colors as they are.
+uniform vec3 materialDiffuse = vec3(1.0);
+uniform vec3 materialSpecular = vec3(1.0);
+uniform float shininess = 32.0;
+
+// Gets the direction from the fragment towards light i, and the light's color after
+// attenuation and spot cone falloff.
+vec3 incidentLight(int i, out vec3 lightDir) {
+    vec4 position = lightPositions[i];
+    if (position.w == 0.0) {
+        lightDir = -normalize(lightDirections[i].xyz);
+        return lightColors[i].rgb;
+    }
+
+    vec3 toLight = position.xyz - FragPos;
+    float distance = length(toLight);
+    lightDir = toLight / distance;
+    vec3 k = lightAttenuations[i].xyz;
+    float attenuation = 1.0 / (k.x + k.y * distance + k.z * distance * distance);
+    if (position.w == 2.0) {
+        float cosine = dot(-lightDir, normalize(lightDirections[i].xyz));
+        attenuation *= smoothstep(lightDirections[i].w, lightColors[i].w, cosine);
+    }
+    return attenuation * lightColors[i].rgb;
+}
+
+// Gets the texture's color at this fragment.
+vec4 textureColor() {
+#if defined(UNTEXTURED)
+    return vec4(1.0);
+#elif defined(TEXTURE_ARRAY)
+    return texture(ourTexture, vec3(TexCoord, TexLayer));
+#else
+    return texture(ourTexture, TexCoord);
+#endif
+}
 
 void main() {
+#ifdef UNLIT
+    FragColor = textureColor();
+#else
     vec3 norm = normalize(Normal);
-    vec3 lightDir = normalize(pointPosition - FragPos);
-    float cosineLight = max(dot(norm, lightDir), 0.0);
+    vec3 viewDir = normalize(cameraPosition - FragPos);
 
-    // Compute the ambient and diffuse components.
+    // Compute the ambient component, and sum the diffuse and specular components of
+    // every light that reaches this object, all in a single pass.
     vec3 ambient = ambientColor;
-    vec3 diffuse = cosineLight * pointColor;
+    vec3 diffuse = vec3(0.0);
+    vec3 specular = vec3(0.0);
+    for (int j = 0; j < lightCount; j++) {
+        vec3 lightDir;
+        vec3 lightColor = incidentLight(lightIndices[j], lightDir);
+        float cosineLight = max(dot(norm, lightDir), 0.0);
+        diffuse += cosineLight * lightColor;
 
-    // Compute the specular component.
-    vec3 viewDir = normalize(cameraPosition - FragPos);
-    vec3 reflectDir = reflect(-lightDir, norm);
-    float cosine = dot(normalize(reflectDir), normalize(viewDir));
-    float specFactor = pow(max(cosine, 0.0), shininess);
-    vec3 specular = specFactor * pointColor;
+        vec3 reflectDir = reflect(-lightDir, norm);
+        float cosine = dot(normalize(reflectDir), viewDir);
+        float specFactor = pow(max(cosine, 0.0), shininess);
+        specular += specFactor * lightColor;
+    }
 
     // Assemble the final fragment color.
-    FragColor = vec4(diffuse + ambient + specular, 1.0) * texture(ourTexture, TexCoord);
+    vec3 color = (diffuse + ambient) * materialDiffuse + specular * materialSpecular;
+    FragColor = vec4(color, 1.0) * textureColor();
+#endif
 }
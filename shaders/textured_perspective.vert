@@ -1,9 +1,13 @@
 #version 410
 layout (location=0) in vec3 vPosition;
-layout (location=1) in vec2 vTexCoord;
+layout (location=2) in vec2 vTexCoord;
 
-uniform mat4 projection;
-uniform mat4 view;
+// Camera state shared by every program, written once per frame (see UniformBlocks.py).
+layout (std140) uniform Frame {
+    mat4 projection;
+    mat4 view;
+    vec3 cameraPosition;
+};
 uniform mat4 model;
 
 out vec2 TexCoord;